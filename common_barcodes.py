@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+from common_store import (DOCS_PATH, NOMBRE_INVENTARIO, CLAVE_MAPEO,
+                          leer_json, escribir_json_atomico, firma_archivo)
+
+NOMBRE_INDICE_BARRAS = "mapeo_barras.idx"
+EXT_META = ".meta.json"
+
+
+def lineas_indice(inventario):
+    """Líneas ordenadas del índice: `"barcode"\\t["id_interno", factor, "nombre"]`.
+
+    Las claves van como cadenas JSON (sin tabuladores ni saltos de línea
+    crudos), así el orden de bytes del archivo es el orden de búsqueda.
+    """
+    lineas = []
+    for barcode, vinculo in (inventario.get(CLAVE_MAPEO) or {}).items():
+        if not isinstance(vinculo, dict):
+            continue
+        id_int = str(vinculo.get("id_interno", ""))
+        item = inventario.get(id_int)
+        nombre = item.get("nombre", "") if isinstance(item, dict) else ""
+        valor = [id_int, int(vinculo.get("factor", 1) or 1), nombre]
+        lineas.append(json.dumps(str(barcode), ensure_ascii=False) + "\t"
+                      + json.dumps(valor, ensure_ascii=False, separators=(',', ':')))
+    lineas.sort(key=lambda l: l.split("\t", 1)[0].encode('utf-8'))
+    return lineas
+
+
+def escribir_indice_barras(docs_path, inventario, firma_inventario):
+    """Regenera el índice si cambió el mapeo (o los nombres vinculados) y registra la firma del inventario."""
+    ruta = os.path.join(docs_path, NOMBRE_INDICE_BARRAS)
+    lineas = lineas_indice(inventario)
+    texto = ("\n".join(lineas) + "\n" if lineas else "").encode('utf-8')
+    huella = hashlib.sha1(texto).hexdigest()
+    meta = leer_json(ruta + EXT_META, {}) or {}
+    if meta.get("huella") != huella or not os.path.exists(ruta):
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(texto)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, ruta)
+    escribir_json_atomico(ruta + EXT_META, {"huella": huella, "inventario": firma_inventario,
+                                            "codigos": len(lineas), "ts": time.time()})
+    return len(lineas)
+
+
+class IndiceBarras:
+    """Índice compacto código de barras -> (ID interno, factor, nombre) para el backend JSON.
+
+    Es un archivo de texto ordenado aparte del inventario; se lee entero
+    como bytes (sin interpretar) y cada consulta es una búsqueda binaria,
+    así el programa puede escanear sin parsear inventario_global.json.
+    No se usa mmap: en Windows un archivo mapeado no puede reemplazarse y
+    los escritores lo regeneran con os.replace.
+
+    La meta (.meta.json) guarda la firma del inventario con el que se
+    generó. Si el inventario lo escribió un programa que no actualiza el
+    índice, se sigue respondiendo con el índice anterior mientras un hilo
+    lo regenera; una consulta sin resultado espera a que termine antes de
+    declarar el código desconocido. Los vínculos nuevos de la sesión se
+    guardan en `agregados` hasta la próxima regeneración.
+    """
+
+    def __init__(self, docs_path=DOCS_PATH, revisar_cada=2.0):
+        self.docs_path = docs_path
+        self.ruta = os.path.join(docs_path, NOMBRE_INDICE_BARRAS)
+        self.ruta_inventario = os.path.join(docs_path, NOMBRE_INVENTARIO)
+        self.revisar_cada = revisar_cada
+        self._lock = threading.RLock()
+        self._datos = b""
+        self._firma = None
+        self._revisado = 0.0
+        self._regenerando = None
+        self.agregados = {}  # {barcode: {"id_interno", "factor", "nombre"}}
+        self.recargar(forzar=True)
+
+    def _regenerar(self):
+        """Regenera el índice desde el inventario completo (lento: parsea el JSON)."""
+        from common_ledger import CLAVE_MARCA, LibroStock
+        # Con el bloqueo del inventario: ningún programa lo reescribe a mitad de la lectura
+        with LibroStock(self.docs_path).bloqueo():
+            firma = firma_archivo(self.ruta_inventario)
+            inventario = leer_json(self.ruta_inventario, {})
+            if not isinstance(inventario, dict):
+                inventario = {}
+            inventario.pop(CLAVE_MARCA, None)
+            total = escribir_indice_barras(self.docs_path, inventario, firma)
+        print(f"[Barras] Índice regenerado: {total} códigos")
+
+    def _leer(self):
+        try:
+            with open(self.ruta, "rb") as f:
+                datos = f.read()
+        except OSError:
+            return
+        with self._lock:
+            self._datos = datos
+            self._firma = firma_archivo(self.ruta)
+            self.agregados.clear()
+
+    def recargar(self, forzar=False):
+        """Vuelve a leer el índice si cambió; lo regenera si falta o quedó viejo."""
+        ahora = time.monotonic()
+        if not forzar and ahora - self._revisado < self.revisar_cada:
+            return
+        self._revisado = ahora
+        if not os.path.exists(self.ruta):
+            if os.path.exists(self.ruta_inventario):
+                self._regenerar()
+            self._leer()
+            return
+        meta = leer_json(self.ruta + EXT_META, {}) or {}
+        firma_inv = firma_archivo(self.ruta_inventario)
+        if (meta.get("inventario") != (list(firma_inv) if firma_inv else None)
+                and not (self._regenerando and self._regenerando.is_alive())):
+            def regenerar():
+                try:
+                    self._regenerar()
+                    self._leer()
+                except Exception as e:
+                    print(f"[Barras] Error al regenerar el índice: {e}")
+            self._regenerando = threading.Thread(target=regenerar, daemon=True)
+            self._regenerando.start()
+        if forzar or firma_archivo(self.ruta) != self._firma:
+            self._leer()
+
+    def _buscar(self, barcode):
+        clave = json.dumps(str(barcode), ensure_ascii=False).encode('utf-8')
+        datos = self._datos
+        lo, hi = 0, len(datos)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            inicio = datos.rfind(b"\n", 0, mid) + 1
+            fin = datos.find(b"\n", inicio)
+            if fin < 0:
+                fin = len(datos)
+            tab = datos.find(b"\t", inicio, fin)
+            actual = datos[inicio:tab]
+            if actual == clave:
+                id_int, factor, nombre = json.loads(datos[tab + 1:fin])
+                return {"id_interno": id_int, "factor": factor, "nombre": nombre}
+            if actual < clave:
+                lo = fin + 1
+            else:
+                hi = inicio
+        return None
+
+    def get(self, barcode, defecto=None):
+        """{"id_interno", "factor", "nombre"} del código, o `defecto`."""
+        self.recargar()
+        with self._lock:
+            vinculo = self.agregados.get(barcode) or self._buscar(barcode)
+        if vinculo is None and self._regenerando and self._regenerando.is_alive():
+            self._regenerando.join(10.0)
+            with self._lock:
+                vinculo = self.agregados.get(barcode) or self._buscar(barcode)
+        return vinculo if vinculo is not None else defecto
+
+    def __contains__(self, barcode):
+        return self.get(barcode) is not None
+
+    def agregar(self, barcode, id_interno, factor, nombre=""):
+        """Vínculo nuevo de esta sesión (el backend lo persiste y regenera el archivo)."""
+        with self._lock:
+            self.agregados[barcode] = {"id_interno": str(id_interno), "factor": int(factor), "nombre": nombre}
+
+
+if __name__ == "__main__":
+    # Uso: python common_barcodes.py regenerar [carpeta] | buscar <codigo> [carpeta]
+    accion = sys.argv[1] if len(sys.argv) > 1 else ""
+    if accion == "regenerar":
+        IndiceBarras(sys.argv[2] if len(sys.argv) > 2 else DOCS_PATH)._regenerar()
+    elif accion == "buscar" and len(sys.argv) > 2:
+        t0 = time.perf_counter()
+        indice = IndiceBarras(sys.argv[3] if len(sys.argv) > 3 else DOCS_PATH)
+        vinculo = indice.get(sys.argv[2])
+        print(f"[Barras] {sys.argv[2]} -> {vinculo} ({(time.perf_counter() - t0) * 1000:.1f} ms con la carga)")
+    else:
+        print("Uso: python common_barcodes.py regenerar [carpeta] | buscar <codigo> [carpeta]")
@@ -0,0 +1,328 @@
+import os
+import sys
+import time
+import heapq
+import threading
+
+from common_store import DOCS_PATH, AlmacenBodegas, obtener_backend, leer_json
+from common_search import IndiceTexto, normalizar
+
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+NOMBRE_CONFIG_BODEGAS = "bodegas_config.json"
+
+
+def archivos_bodegas(docs_path=DOCS_PATH, backend=None):
+    """{nombre_bodega: archivo_json} de bodegas_config.json, o de los yrz_*.json si no hay configuración."""
+    config = leer_json(os.path.join(docs_path, NOMBRE_CONFIG_BODEGAS), None)
+    if isinstance(config, dict):
+        return {str(k): v for k, v in config.items() if isinstance(v, str)}
+    if backend is not None and hasattr(backend, "archivos_bodega"):
+        archivos = backend.archivos_bodega()
+    elif os.path.isdir(docs_path):
+        archivos = sorted(f for f in os.listdir(docs_path) if f.startswith("yrz_") and f.endswith(".json"))
+    else:
+        archivos = []
+    return {f.replace("yrz_", "").replace(".json", "").replace("_", " ").title(): f for f in archivos}
+
+
+class CatalogoBodegas:
+    """Búsqueda de items en todas las bodegas y el inventario global a la vez.
+
+    Reúne los items del inventario (código, nombre, stock) y los de las
+    repisas de cada bodega (también los que no tienen código) en un
+    `IndiceTexto`, con sus ubicaciones (bodega, estante, gaveta). Las
+    bodegas las mantiene un `AlmacenBodegas` (solo relee las que cambiaron)
+    y el inventario se relee cuando cambia su firma; como mucho una
+    revisión cada `revisar_cada` segundos, en un hilo aparte: mientras se
+    actualiza, las consultas responden con los datos anteriores.
+
+    Los resultados se ordenan por: código exacto, prefijo del código,
+    prefijo del nombre, prefijo de una palabra del nombre, contiene; si
+    quedan lugares, se completan con coincidencias aproximadas (trigramas).
+
+    `ubicar()` responde "dónde está el código X" (con las coordenadas del
+    estante en el plano) con una consulta a un diccionario por código;
+    `VigilanteCatalogo` lo mantiene al día sin esperar a una consulta.
+    """
+
+    def __init__(self, docs_path=DOCS_PATH, backend=None, diario=None, revisar_cada=1.0):
+        self.docs_path = docs_path
+        self.backend = backend or obtener_backend(docs_path)
+        self.archivos = {}
+        self.almacen = AlmacenBodegas(self.archivos, docs_path, self.backend, diario)
+        self.revisar_cada = revisar_cada
+        self.indice = IndiceTexto()
+        self._lock = threading.RLock()
+        self._items = {}          # {clave: (codigo o None, nombre, nombre normalizado, código normalizado)}
+        self._ubicaciones = {}    # {clave: [(bodega, estante, gaveta, stock de la repisa, x, y)]}
+        self._en_repisas = {}     # {clave: (codigo o None, nombre)} según las repisas
+        self._inventario = {}     # {codigo: (nombre, stock)}
+        self._firma_inv = None
+        self._version = None
+        self._revisado = 0.0
+        self._actualizando = None
+        self._lock_actualizar = threading.Lock()  # una sola actualización a la vez
+
+    # -------------------------- Actualización --------------------------
+
+    def _leer_inventario(self):
+        inventario = {}
+        for codigo, datos in (self.backend.cargar_inventario() or {}).items():
+            if not codigo.startswith("_") and isinstance(datos, dict):
+                inventario[str(codigo)] = (datos.get('nombre', '') or '', datos.get('stock', 0) or 0)
+        return inventario
+
+    def _leer_bodegas(self):
+        """Ubicaciones de cada item en las repisas y nombres de los que no están en el inventario."""
+        ubicaciones, nombres = {}, {}
+        for bodega in list(self.archivos):
+            for est in self.almacen.estantes(bodega):
+                if not isinstance(est, dict):
+                    continue
+                for s in est.get('suplementos', []) or []:
+                    if isinstance(s, dict):
+                        codigo = str(s.get('codigo', '') or '')
+                        nombre = s.get('nombre', '') or ''
+                        gaveta, stock = s.get('gaveta'), s.get('stock')
+                    else:
+                        codigo, nombre, gaveta, stock = '', str(s), None, None
+                    clave = codigo or f"\x00{nombre}"
+                    ubicaciones.setdefault(clave, []).append(
+                        (bodega, est.get('nombre', ''), gaveta, stock, est.get('x'), est.get('y')))
+                    nombres.setdefault(clave, (codigo or None, nombre))
+        return ubicaciones, nombres
+
+    def actualizar(self):
+        """Relee lo que cambió (inventario y/o bodegas) y actualiza el índice."""
+        with self._lock_actualizar:
+            return self._actualizar()
+
+    def _actualizar(self):
+        archivos = archivos_bodegas(self.docs_path, self.backend)
+        with self._lock:
+            if archivos != self.archivos:
+                self.archivos.clear()
+                self.archivos.update(archivos)
+        firma_inv = self.backend.firma_inventario()
+        version = self.almacen.version()
+        if firma_inv == self._firma_inv and version == self._version:
+            return False
+        inventario = self._leer_inventario() if firma_inv != self._firma_inv else self._inventario
+        if version != self._version:
+            ubicaciones, nombres = self._leer_bodegas()
+        else:
+            ubicaciones, nombres = self._ubicaciones, self._en_repisas
+        previos = self._items
+        items = {}
+        for clave, (codigo, nombre) in list(nombres.items()) + [(c, (c, n)) for c, (n, _) in inventario.items()]:
+            previo = previos.get(clave)
+            if previo is not None and previo[:2] == (codigo, nombre):
+                items[clave] = previo
+            else:
+                items[clave] = (codigo, nombre, normalizar(nombre), normalizar(codigo) if codigo else '')
+        with self._lock:
+            # Solo se tocan en el índice los items nuevos, renombrados o eliminados
+            for clave in self._items.keys() - items.keys():
+                self.indice.eliminar(clave)
+            for clave, item in items.items():
+                if self._items.get(clave, (None, None))[1] != item[1]:
+                    self.indice.agregar(clave, item[1])
+            self._items, self._ubicaciones, self._inventario = items, ubicaciones, inventario
+            self._en_repisas = nombres
+            self._firma_inv, self._version = firma_inv, version
+        return True
+
+    def revisar(self):
+        """Actualiza en segundo plano si pasó `revisar_cada` desde la última revisión (la primera vez, en línea)."""
+        ahora = time.monotonic()
+        if ahora - self._revisado < self.revisar_cada:
+            return
+        self._revisado = ahora
+        if self._version is None:
+            self.actualizar()
+            return
+        if self._actualizando and self._actualizando.is_alive():
+            return
+
+        def actualizar():
+            try:
+                self.actualizar()
+            except Exception as e:
+                print(f"[Catalogo] Error al actualizar: {e}")
+        self._actualizando = threading.Thread(target=actualizar, daemon=True)
+        self._actualizando.start()
+
+    # ----------------------------- Consultas -----------------------------
+
+    @staticmethod
+    def _niveles(q, claves, items):
+        """Coincidencias repartidas por puntaje: [código exacto, prefijo del código,
+        prefijo del nombre, prefijo de una palabra, contiene]."""
+        niveles = ([], [], [], [], [])
+        q_palabra = f" {q}"
+        for clave in claves:
+            item = items.get(clave)
+            if item is None:
+                continue
+            _, _, nombre, codigo = item
+            if codigo.startswith(q):
+                niveles[0 if codigo == q else 1].append(clave)
+            elif nombre.startswith(q):
+                niveles[2].append(clave)
+            else:
+                niveles[3 if q_palabra in nombre else 4].append(clave)
+        return niveles
+
+    def resultado(self, clave, max_ubicaciones=10):
+        """Diccionario público de un item: código, nombre, stock y ubicaciones."""
+        codigo, nombre = self._items[clave][:2]
+        ubicaciones = self._ubicaciones.get(clave, ())
+        stock = self._inventario[codigo][1] if codigo in self._inventario else None
+        return {"codigo": codigo, "nombre": nombre, "stock": stock,
+                "ubicaciones": [{"bodega": b, "estante": e, "gaveta": g, "stock": s, "x": x, "y": y}
+                                for b, e, g, s, x, y in ubicaciones[:max_ubicaciones]],
+                "total_ubicaciones": len(ubicaciones)}
+
+    def buscar(self, consulta, limite=20, bodega=None):
+        """(mejores `limite` resultados, estantes de `bodega` con algún item que coincide).
+
+        El conjunto de estantes considera todas las coincidencias (no solo
+        las mejores) y sirve para filtrar los marcadores del mapa.
+        """
+        self.revisar()
+        q = normalizar(consulta)
+        if not q:
+            return [], None
+        with self._lock:
+            items = self._items
+            claves = self.indice.buscar(q)
+            # Solo se ordenan (por nombre) los niveles necesarios para llenar `limite`
+            mejores = []
+            for puntaje, nivel in enumerate(self._niveles(q, claves, items)):
+                faltan = limite - len(mejores)
+                if faltan <= 0:
+                    break
+                mejores += [(puntaje, c) for c in heapq.nsmallest(faltan, nivel, key=lambda c: items[c][2])]
+            if len(mejores) < limite and len(q) >= 3:
+                vistos = set(claves)
+                for clave, similitud in self.indice.parecidos(q, limite):
+                    if clave in items and clave not in vistos and len(mejores) < limite:
+                        mejores.append((5 + (1 - similitud), clave))
+            resultados = [dict(self.resultado(clave), puntaje=round(puntaje, 3)) for puntaje, clave in mejores]
+            estantes = None
+            if bodega:
+                ubicaciones = self._ubicaciones
+                estantes = {u[1] for clave in claves if clave in ubicaciones
+                            for u in ubicaciones[clave] if u[0] == bodega}
+        return resultados, estantes
+
+    def ubicar(self, codigos):
+        """{codigo: item con todas sus ubicaciones, o None si no existe}.
+
+        Acepta códigos internos o de barras (se resuelven con el índice de
+        códigos de barras del backend; el item lleva entonces "barcode" y
+        "factor").
+        """
+        self.revisar()
+        codigos = [str(c).strip() for c in codigos if str(c).strip()]
+        items = self._items
+        vinculos = {}
+        desconocidos = [c for c in codigos if c not in items]
+        if desconocidos:
+            barras = self.backend.indice_barras()
+            for codigo in desconocidos:
+                vinculo = barras.get(codigo)
+                if vinculo:
+                    vinculos[codigo] = vinculo
+        respuesta = {}
+        with self._lock:
+            for codigo in codigos:
+                vinculo = vinculos.get(codigo)
+                clave = str(vinculo["id_interno"]) if vinculo else codigo
+                if clave not in self._items:
+                    respuesta[codigo] = None
+                    continue
+                item = self.resultado(clave, max_ubicaciones=None)
+                if vinculo:
+                    item.update(barcode=codigo, factor=vinculo.get("factor", 1))
+                respuesta[codigo] = item
+        return respuesta
+
+
+class _AvisoCambios:
+    """Manejador de watchdog: cualquier evento en la carpeta de datos despierta al vigilante."""
+
+    def __init__(self, evento):
+        self.evento = evento
+
+    def dispatch(self, event):
+        self.evento.set()
+
+
+class VigilanteCatalogo(threading.Thread):
+    """Hilo que actualiza el catálogo en cuanto cambia un archivo de datos.
+
+    Con watchdog reacciona a cada escritura en la carpeta (las ráfagas de
+    un mismo guardado se agrupan); sin él revisa cada `intervalo` segundos.
+    Una revisión sin cambios son unos pocos stat, así que es barata.
+    """
+
+    def __init__(self, catalogo, intervalo=2.0):
+        super().__init__(daemon=True)
+        self.catalogo = catalogo
+        self.intervalo = intervalo
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._observador = None
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+        if self._observador is not None:
+            self._observador.stop()
+
+    def run(self):
+        espera = self.intervalo
+        if Observer is not None and os.path.isdir(self.catalogo.docs_path):
+            try:
+                self._observador = Observer()
+                self._observador.schedule(_AvisoCambios(self._despertar), self.catalogo.docs_path, recursive=True)
+                self._observador.daemon = True
+                self._observador.start()
+                espera = max(self.intervalo, 30.0)  # solo como respaldo
+            except Exception as e:
+                print(f"[Catalogo] watchdog no disponible, se revisa por intervalo: {e}")
+                self._observador = None
+        while not self._detener.is_set():
+            try:
+                if self.catalogo.actualizar():
+                    print(f"[Catalogo] Actualizado: {len(self.catalogo._items)} items")
+            except Exception as e:
+                print(f"[Catalogo] Error al actualizar: {e}")
+            if self._despertar.wait(espera):
+                self._despertar.clear()
+                time.sleep(0.2)  # agrupar las escrituras de un mismo guardado
+
+
+if __name__ == "__main__":
+    # Uso: python common_catalog.py <texto> [limite] [carpeta]
+    if len(sys.argv) < 2:
+        print("Uso: python common_catalog.py <texto> [limite] [carpeta]")
+        sys.exit(1)
+    limite = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    docs = sys.argv[3] if len(sys.argv) > 3 else DOCS_PATH
+    t0 = time.perf_counter()
+    catalogo = CatalogoBodegas(docs, obtener_backend(docs))
+    catalogo.actualizar()
+    t1 = time.perf_counter()
+    resultados, _ = catalogo.buscar(sys.argv[1], limite)
+    t2 = time.perf_counter()
+    print(f"[Catalogo] {len(catalogo._items)} items indexados en {(t1 - t0) * 1000:.0f} ms; "
+          f"búsqueda en {(t2 - t1) * 1000:.1f} ms")
+    for r in resultados:
+        lugares = ", ".join(f"{u['bodega']}/{u['estante']}" for u in r["ubicaciones"]) or "sin ubicar"
+        print(f"  [{r['puntaje']}] {r['codigo'] or 'S/C'} | {r['nombre']} | stock {r['stock']} | {lugares}")
@@ -0,0 +1,394 @@
+import os
+import sys
+import json
+import glob
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from common_store import (DOCS_PATH, NOMBRE_DB, CLAVE_MAPEO, BackendJSON,
+                          leer_json, escribir_json_atomico)
+from common_ledger import InventarioMarcado
+
+RUTA_DB = os.path.join(DOCS_PATH, NOMBRE_DB)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    codigo TEXT PRIMARY KEY,
+    nombre TEXT NOT NULL DEFAULT '',
+    stock  INTEGER NOT NULL DEFAULT 0,
+    extra  TEXT
+);
+CREATE TABLE IF NOT EXISTS mapeo_barras (
+    barcode    TEXT PRIMARY KEY,
+    id_interno TEXT NOT NULL,
+    factor     INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS movimientos (
+    id     INTEGER PRIMARY KEY,
+    ts     REAL NOT NULL,
+    origen TEXT,
+    codigo TEXT NOT NULL,
+    delta  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS extras (
+    clave TEXT PRIMARY KEY,
+    valor TEXT
+);
+CREATE TABLE IF NOT EXISTS bodegas (
+    archivo TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS estantes (
+    archivo TEXT NOT NULL,
+    pos     INTEGER NOT NULL,
+    datos   TEXT NOT NULL,
+    PRIMARY KEY (archivo, pos)
+);
+"""
+
+
+def _fila_a_item(nombre, stock, extra):
+    item = {'nombre': nombre, 'stock': stock}
+    if extra:
+        try:
+            item.update(json.loads(extra))
+        except Exception:
+            pass
+    return item
+
+
+def _item_a_fila(codigo, datos):
+    extra = {k: v for k, v in datos.items() if k not in ('nombre', 'stock')}
+    return (str(codigo), datos.get('nombre', '') or '', datos.get('stock', 0) or 0,
+            json.dumps(extra, ensure_ascii=False) if extra else None)
+
+
+class MapeoBarrasSQL:
+    """Consulta directa a la tabla mapeo_barras (misma interfaz que common_barcodes.IndiceBarras)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, barcode, defecto=None):
+        with self.db._lock:
+            fila = self.db.conn.execute(
+                "SELECT m.id_interno, m.factor, COALESCE(i.nombre, '') FROM mapeo_barras m "
+                "LEFT JOIN items i ON i.codigo = m.id_interno WHERE m.barcode = ?", (barcode,)).fetchone()
+        if fila is None:
+            return defecto
+        return {"id_interno": fila[0], "factor": fila[1], "nombre": fila[2]}
+
+    def __contains__(self, barcode):
+        return self.get(barcode) is not None
+
+    def agregar(self, barcode, id_interno, factor, nombre=""):
+        """Nada que hacer: guardar_mapeo_barra ya escribió la fila."""
+
+    def recargar(self, forzar=False):
+        """Nada que hacer: cada consulta lee la tabla."""
+
+
+class BaseDatos:
+    """Backend SQLite (modo WAL) con la misma interfaz que common_store.BackendJSON.
+
+    Cada item, vínculo de código de barras y estante es una fila: editar un
+    item o mover un estante es una actualización de una fila dentro de una
+    transacción, y los lectores concurrentes (servidor web) nunca ven datos
+    a medio escribir.
+    """
+
+    nombre = "sqlite"
+
+    def __init__(self, ruta=RUTA_DB):
+        self.ruta = ruta
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(ruta, timeout=10, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(ESQUEMA)
+
+    @contextmanager
+    def transaccion(self):
+        """Transacción de escritura (BEGIN IMMEDIATE ... COMMIT/ROLLBACK)."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def cerrar(self):
+        with self._lock:
+            self.conn.close()
+
+    # --------------------------- Inventario ---------------------------
+
+    def cargar_inventario(self):
+        """Inventario completo con el mismo formato que inventario_global.json.
+
+        Es un InventarioMarcado cuya `marca` es el último movimiento incluido
+        (misma lectura: en WAL la transacción ve una sola versión de la base).
+        """
+        with self._lock:
+            inventario = InventarioMarcado()
+            self.conn.execute("BEGIN")
+            try:
+                inventario.marca = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM movimientos").fetchone()[0]
+                for codigo, nombre, stock, extra in self.conn.execute(
+                        "SELECT codigo, nombre, stock, extra FROM items ORDER BY rowid"):
+                    inventario[codigo] = _fila_a_item(nombre, stock, extra)
+                for clave, valor in self.conn.execute("SELECT clave, valor FROM extras"):
+                    try:
+                        inventario[clave] = json.loads(valor)
+                    except Exception:
+                        pass
+                inventario[CLAVE_MAPEO] = {
+                    barcode: {"id_interno": id_interno, "factor": factor}
+                    for barcode, id_interno, factor in self.conn.execute(
+                        "SELECT barcode, id_interno, factor FROM mapeo_barras")
+                }
+            finally:
+                self.conn.execute("COMMIT")
+            return inventario
+
+    def _traer_movimientos(self, c, inventario):
+        """Aplica al inventario cargado los ajustes registrados desde su marca.
+
+        Sin marca numérica (diccionario armado por fuera) se toma el stock
+        actual de la tabla para los items que ya existen.
+        """
+        marca = getattr(inventario, "marca", None)
+        if isinstance(marca, int) and not isinstance(marca, bool):
+            filas = c.execute("SELECT codigo, SUM(delta) FROM movimientos WHERE id > ? GROUP BY codigo", (marca,))
+            for codigo, delta in filas.fetchall():
+                item = inventario.get(codigo)
+                if isinstance(item, dict):
+                    item['stock'] = (item.get('stock', 0) or 0) + delta
+        else:
+            for codigo, stock in c.execute("SELECT codigo, stock FROM items").fetchall():
+                item = inventario.get(codigo)
+                if isinstance(item, dict):
+                    item['stock'] = stock
+        if isinstance(inventario, InventarioMarcado):
+            inventario.marca = c.execute("SELECT COALESCE(MAX(id), 0) FROM movimientos").fetchone()[0]
+
+    def guardar_inventario(self, inventario, reemplazar_stock=False):
+        """Reemplaza el inventario completo en una sola transacción.
+
+        Como en el backend JSON, los ajustes de stock registrados después de
+        cargar `inventario` (ventas de barcode.py, drenador de la cola) se
+        aplican antes de escribir, también al diccionario del llamador.
+        `reemplazar_stock=True` escribe el stock tal cual (migración).
+        """
+        with self.transaccion() as c:
+            if not reemplazar_stock:
+                self._traer_movimientos(c, inventario)
+            self._reemplazar_inventario(c, inventario)
+
+    def _reemplazar_inventario(self, c, inventario):
+        filas, extras = [], []
+        for clave, datos in inventario.items():
+            if clave == CLAVE_MAPEO:
+                continue
+            if clave.startswith("_") or not isinstance(datos, dict):
+                extras.append((clave, json.dumps(datos, ensure_ascii=False)))
+            else:
+                filas.append(_item_a_fila(clave, datos))
+        mapeo = [
+            (barcode, str(v.get("id_interno", "")), int(v.get("factor", 1) or 1))
+            for barcode, v in (inventario.get(CLAVE_MAPEO) or {}).items()
+            if isinstance(v, dict)
+        ]
+        c.execute("DELETE FROM items")
+        c.execute("DELETE FROM extras")
+        c.execute("DELETE FROM mapeo_barras")
+        c.executemany("INSERT INTO items (codigo, nombre, stock, extra) VALUES (?, ?, ?, ?)", filas)
+        c.executemany("INSERT INTO extras (clave, valor) VALUES (?, ?)", extras)
+        c.executemany("INSERT INTO mapeo_barras (barcode, id_interno, factor) VALUES (?, ?, ?)", mapeo)
+
+    def sincronizar_inventario(self, inventario):
+        """Trae a un inventario ya cargado los ajustes de stock registrados desde su marca."""
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                self._traer_movimientos(self.conn, inventario)
+            finally:
+                self.conn.execute("COMMIT")
+
+    def firma_inventario(self):
+        """Cambia con cada escritura: data_version (otros procesos) y total_changes (esta conexión)."""
+        with self._lock:
+            return (self.conn.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes)
+
+    def actualizar_item(self, codigo, datos):
+        """Crea o actualiza un item (una fila); devuelve su stock guardado.
+
+        Si la fila ya existe se conserva su stock: solo lo cambia `ajustar_stock`.
+        """
+        fila = _item_a_fila(codigo, datos)
+        with self.transaccion() as c:
+            c.execute("INSERT INTO items (codigo, nombre, stock, extra) VALUES (?, ?, ?, ?) "
+                      "ON CONFLICT(codigo) DO UPDATE SET nombre = excluded.nombre, extra = excluded.extra", fila)
+            return c.execute("SELECT stock FROM items WHERE codigo = ?", (fila[0],)).fetchone()[0]
+
+    def actualizar_items(self, cambios, eliminados=()):
+        """Crea/actualiza y elimina varios items en una transacción (solo esas filas)."""
+        if not cambios and not eliminados:
+            return
+        with self.transaccion() as c:
+            c.executemany("INSERT INTO items (codigo, nombre, stock, extra) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT(codigo) DO UPDATE SET nombre = excluded.nombre, "
+                          "stock = excluded.stock, extra = excluded.extra",
+                          [_item_a_fila(codigo, datos) for codigo, datos in cambios.items()])
+            c.executemany("DELETE FROM items WHERE codigo = ?", [(str(codigo),) for codigo in eliminados])
+
+    def eliminar_item(self, codigo):
+        with self.transaccion() as c:
+            c.execute("DELETE FROM items WHERE codigo = ?", (str(codigo),))
+
+    def ajustar_stock(self, deltas, origen=None):
+        """Suma `deltas` {codigo: cantidad} al stock; devuelve {codigo: stock_nuevo}.
+
+        Cada ajuste queda además en la tabla `movimientos`, en la misma transacción.
+        """
+        nuevos = {}
+        ts = time.time()
+        with self.transaccion() as c:
+            for codigo, delta in deltas.items():
+                c.execute("UPDATE items SET stock = stock + ? WHERE codigo = ?", (delta, str(codigo)))
+                fila = c.execute("SELECT stock FROM items WHERE codigo = ?", (str(codigo),)).fetchone()
+                if fila is not None:
+                    nuevos[codigo] = fila[0]
+                    if delta:
+                        c.execute("INSERT INTO movimientos (ts, origen, codigo, delta) VALUES (?, ?, ?, ?)",
+                                  (ts, origen, str(codigo), delta))
+        return nuevos
+
+    def movimiento_registrado(self, origen, desde=0.0):
+        """True si ya se registró un ajuste de stock con ese `origen` (lotes de common_queue) después de `desde`."""
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM movimientos WHERE origen = ? AND ts >= ? LIMIT 1",
+                                     (origen, desde)).fetchone() is not None
+
+    def compactar(self):
+        """Sin movimientos pendientes: cada ajuste ya actualiza su fila (misma interfaz que JSON)."""
+
+    def indice_barras(self):
+        """Búsqueda código de barras -> {"id_interno", "factor", "nombre"} sin cargar el inventario."""
+        return MapeoBarrasSQL(self)
+
+    def guardar_mapeo_barra(self, barcode, id_interno, factor):
+        with self.transaccion() as c:
+            c.execute("INSERT OR REPLACE INTO mapeo_barras (barcode, id_interno, factor) VALUES (?, ?, ?)",
+                      (barcode, str(id_interno), int(factor)))
+
+    # ---------------------------- Bodegas ----------------------------
+
+    def firma_estantes(self, archivo):
+        """Versión de la bodega (cambia con cada escritura, de cualquier proceso)."""
+        with self._lock:
+            fila = self.conn.execute("SELECT version FROM bodegas WHERE archivo = ?", (archivo,)).fetchone()
+            return fila[0] if fila else None
+
+    def archivos_bodega(self):
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT archivo FROM bodegas ORDER BY archivo")]
+
+    def cargar_estantes(self, archivo):
+        with self._lock:
+            estantes = []
+            for (datos,) in self.conn.execute(
+                    "SELECT datos FROM estantes WHERE archivo = ? ORDER BY pos", (archivo,)):
+                try:
+                    estantes.append(json.loads(datos))
+                except Exception:
+                    pass
+            return estantes
+
+    def guardar_estantes(self, archivo, estantes, cambiados=None):
+        """Guarda la bodega; con `cambiados` solo se reescriben esas posiciones."""
+        escritos = 0
+        with self.transaccion() as c:
+            if cambiados is None:
+                c.execute("DELETE FROM estantes WHERE archivo = ?", (archivo,))
+                posiciones = range(len(estantes))
+            else:
+                posiciones = [p for p in cambiados if 0 <= p < len(estantes)]
+            for pos in posiciones:
+                datos = json.dumps(estantes[pos], ensure_ascii=False)
+                escritos += len(datos)
+                c.execute("INSERT OR REPLACE INTO estantes (archivo, pos, datos) VALUES (?, ?, ?)",
+                          (archivo, pos, datos))
+            c.execute("INSERT INTO bodegas (archivo, version) VALUES (?, 1) "
+                      "ON CONFLICT(archivo) DO UPDATE SET version = version + 1", (archivo,))
+        return escritos
+
+    # ------------------------ Migración / export ------------------------
+
+    def migrar_desde_json(self, docs_path=DOCS_PATH):
+        """Importa inventario_global.json y todos los yrz_*.json a la base."""
+        # Con los movimientos del libro de stock aún no incorporados al archivo
+        inventario = BackendJSON(docs_path).cargar_inventario()
+        if isinstance(inventario, dict):
+            self.guardar_inventario(inventario, reemplazar_stock=True)
+        archivos = set(os.path.basename(p) for p in glob.glob(os.path.join(docs_path, "yrz_*.json")))
+        config = leer_json(os.path.join(docs_path, "bodegas_config.json"), {})
+        if isinstance(config, dict):
+            archivos.update(v for v in config.values() if isinstance(v, str))
+        migradas = 0
+        for archivo in sorted(archivos):
+            datos = leer_json(os.path.join(docs_path, archivo), None)
+            if isinstance(datos, list):
+                self.guardar_estantes(archivo, datos)
+                migradas += 1
+        items = sum(1 for k in inventario if not k.startswith("_")) if isinstance(inventario, dict) else 0
+        return items, migradas
+
+    def exportar_json(self, destino=DOCS_PATH):
+        """Escribe inventario_global.json y los yrz_*.json (compatibilidad).
+
+        Incluye los cambios del diario de operaciones aún no compactados y,
+        en el mismo paso, compacta el diario de `destino` hasta la instantánea
+        exportada: si no, al cargar los yrz_*.json se volverían a aplicar
+        sus operaciones. Si `destino` es la carpeta de la base, el diario es
+        el mismo y también se guarda la instantánea en SQLite.
+        """
+        from common_journal import DiarioBodegas
+        carpeta = os.path.dirname(self.ruta)
+        diario = DiarioBodegas(carpeta)
+        mismo = os.path.normcase(os.path.abspath(destino)) == os.path.normcase(os.path.abspath(carpeta))
+        diario_destino = diario if mismo else DiarioBodegas(destino)
+        os.makedirs(destino, exist_ok=True)
+        # Con la marca del libro de stock de `destino`, para no volver a aplicar sus movimientos
+        BackendJSON(destino).guardar_inventario(self.cargar_inventario())
+        for archivo in self.archivos_bodega():
+            seq = diario_destino.ultimo_seq(archivo)
+            estantes = diario.reproducir(archivo, self.cargar_estantes(archivo))
+
+            def escribir(archivo=archivo, estantes=estantes):
+                escribir_json_atomico(os.path.join(destino, archivo), estantes)
+                if mismo:
+                    self.guardar_estantes(archivo, estantes)
+            diario_destino.compactar(archivo, seq, estantes, escribir)
+
+
+if __name__ == "__main__":
+    # Uso: python common_db.py migrar | exportar [carpeta_destino]
+    accion = sys.argv[1] if len(sys.argv) > 1 else ""
+    if accion == "migrar":
+        db = BaseDatos(RUTA_DB)
+        items, bodegas = db.migrar_desde_json(DOCS_PATH)
+        print(f"[DB] Migrados {items} items y {bodegas} bodegas a {RUTA_DB}")
+    elif accion == "exportar":
+        destino = sys.argv[2] if len(sys.argv) > 2 else DOCS_PATH
+        if not os.path.exists(RUTA_DB):
+            print(f"[DB] No existe la base {RUTA_DB}")
+            sys.exit(1)
+        BaseDatos(RUTA_DB).exportar_json(destino)
+        print(f"[DB] Exportado JSON a {destino}")
+    else:
+        print("Uso: python common_db.py migrar | exportar [carpeta_destino]")
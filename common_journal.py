@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import gzip
+import glob
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+from common_store import DOCS_PATH, leer_json, escribir_json_atomico, firma_archivo
+
+CARPETA_DIARIO = "diario"
+EXT_DIARIO = ".jsonl"
+EXT_MARCA = ".marca.json"
+
+
+def huella_estantes(estantes):
+    """SHA-1 del contenido canónico de una bodega (igual en JSON y en SQLite)."""
+    texto = json.dumps(estantes, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+
+def diferencias(antes, despues):
+    """Operaciones mínimas ('set', 'add', 'del' o 'todo') que llevan de `antes` a `despues`."""
+    n, m = len(antes), len(despues)
+    if m == n + 1 and antes == despues[:n]:
+        return [{'op': 'add', 'estante': despues[-1]}]
+    if m == n - 1:
+        i = next((k for k in range(m) if antes[k] != despues[k]), m)
+        if antes[i + 1:] == despues[i:]:
+            return [{'op': 'del', 'pos': i}]
+    if m == n:
+        cambios = [{'op': 'set', 'pos': k, 'estante': despues[k]} for k in range(n) if antes[k] != despues[k]]
+        if len(cambios) <= max(1, n // 2):
+            return cambios
+    return [{'op': 'todo', 'estantes': despues}]
+
+
+def aplicar(estantes, op):
+    """Devuelve una lista nueva con la operación aplicada (no modifica `estantes`)."""
+    tipo = op.get('op')
+    if tipo == 'todo':
+        return list(op.get('estantes') or [])
+    nuevos = list(estantes)
+    pos = op.get('pos')
+    if tipo == 'add':
+        nuevos.append(op.get('estante'))
+    elif tipo == 'set' and isinstance(pos, int) and 0 <= pos < len(nuevos):
+        nuevos[pos] = op.get('estante')
+    elif tipo == 'del' and isinstance(pos, int) and 0 <= pos < len(nuevos):
+        del nuevos[pos]
+    else:
+        print(f"[Diario] Operación ignorada (seq {op.get('seq')}): {tipo} pos={pos}")
+    return nuevos
+
+
+def _leer_ops(ruta):
+    """Operaciones de un diario (.jsonl o .jsonl.gz); ignora líneas truncadas o corruptas."""
+    if not os.path.exists(ruta):
+        return []
+    abrir = gzip.open if ruta.endswith(".gz") else open
+    ops = []
+    try:
+        with abrir(ruta, "rt", encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    op = json.loads(linea)
+                except ValueError:
+                    continue
+                if isinstance(op, dict) and isinstance(op.get('seq'), int):
+                    ops.append(op)
+    except Exception as e:
+        print(f"[Diario] Error al leer {ruta}: {e}")
+    return ops
+
+
+class DiarioBodegas:
+    """Diario de operaciones por bodega (solo se añade al final) con compactación.
+
+    Cada cambio de estantes se añade como una línea JSON numerada (`seq`) y
+    fechada a diario/<bodega>.jsonl, en vez de reescribir todo el yrz_*.json.
+    Al cargar, la instantánea (yrz_*.json o filas de SQLite) se completa
+    reproduciendo las operaciones posteriores a la última compactación.
+
+    Compactar escribe primero la marca (seq + huella de la nueva instantánea),
+    luego la instantánea y por último retira del diario las operaciones ya
+    incluidas, que pasan comprimidas a diario/historial/<bodega>/. Si el
+    programa se cae entre dos pasos, la huella indica qué instantánea quedó
+    en disco y desde qué `seq` hay que reproducir. Con el historial (bases
+    periódicas + segmentos) se puede reconstruir la bodega en cualquier fecha.
+    """
+
+    def __init__(self, docs_path=DOCS_PATH, sincronizar=True, bases_cada=20):
+        self.carpeta = os.path.join(docs_path, CARPETA_DIARIO)
+        self.sincronizar = sincronizar   # fsync tras cada operación añadida
+        self.bases_cada = bases_cada     # instantánea completa en el historial cada N compactaciones
+        self._seq = {}                   # {archivo: último seq escrito}
+        self._revisados = set()          # diarios cuya cola ya se revisó en esta sesión
+        self._con_base = set()           # bodegas con al menos una base en el historial
+        self._lock = threading.RLock()
+        self.stats = {'operaciones': 0, 'bytes': 0, 'compactaciones': 0}
+
+    # ----------------------------- Rutas -----------------------------
+
+    def _ruta(self, archivo, ext):
+        return os.path.join(self.carpeta, os.path.splitext(archivo)[0] + ext)
+
+    def _historial(self, archivo):
+        return os.path.join(self.carpeta, "historial", os.path.splitext(archivo)[0])
+
+    def firma(self, archivo):
+        """Firma del diario de la bodega (cambia con cada operación añadida)."""
+        return firma_archivo(self._ruta(archivo, EXT_DIARIO))
+
+    def ultimo_seq(self, archivo):
+        """Número de la última operación registrada para la bodega."""
+        with self._lock:
+            if archivo not in self._seq:
+                marca = leer_json(self._ruta(archivo, EXT_MARCA), None) or {}
+                ops = _leer_ops(self._ruta(archivo, EXT_DIARIO))
+                self._seq[archivo] = max([marca.get('seq', 0)] + [op['seq'] for op in ops])
+            return self._seq[archivo]
+
+    # ---------------------------- Escritura ----------------------------
+
+    def _reparar_cola(self, ruta):
+        """Recorta una última línea a medio escribir (caída durante un append)."""
+        if ruta in self._revisados:
+            return
+        self._revisados.add(ruta)
+        try:
+            with open(ruta, "rb+") as f:
+                datos = f.read()
+                if datos and not datos.endswith(b"\n"):
+                    f.truncate(datos.rfind(b"\n") + 1)
+                    print(f"[Diario] Recortada operación incompleta en {ruta}")
+        except OSError:
+            pass
+
+    def registrar(self, archivo, ops, previos=None):
+        """Añade operaciones al diario; `previos` = estado anterior (primera base del historial)."""
+        if not ops:
+            return 0
+        with self._lock:
+            os.makedirs(self.carpeta, exist_ok=True)
+            if previos is not None and archivo not in self._con_base:
+                self._asegurar_base(archivo, previos)
+            ruta = self._ruta(archivo, EXT_DIARIO)
+            self._reparar_cola(ruta)
+            seq = self.ultimo_seq(archivo)
+            ts = time.time()
+            lineas = []
+            for op in ops:
+                seq += 1
+                lineas.append(json.dumps(dict({'seq': seq, 'ts': ts}, **op), ensure_ascii=False))
+            datos = ("\n".join(lineas) + "\n").encode('utf-8')
+            with open(ruta, "ab") as f:
+                f.write(datos)
+                f.flush()
+                if self.sincronizar:
+                    os.fsync(f.fileno())
+            self._seq[archivo] = seq
+            self.stats['operaciones'] += len(ops)
+            self.stats['bytes'] += len(datos)
+            return len(datos)
+
+    def compactar(self, archivo, seq, estantes, escribir):
+        """Vuelca la instantánea `estantes` (estado en `seq`) llamando a `escribir()`.
+
+        Devuelve lo que devuelva `escribir`. Las operaciones con número mayor
+        que `seq` (llegadas mientras se escribía) se quedan en el diario.
+        """
+        ruta_marca = self._ruta(archivo, EXT_MARCA)
+        with self._lock:
+            os.makedirs(self.carpeta, exist_ok=True)
+            previa = leer_json(ruta_marca, None) or {}
+            escribir_json_atomico(ruta_marca, {
+                'seq': seq,
+                'huella': huella_estantes(estantes),
+                'ts': time.time(),
+                'anterior': {'seq': previa.get('seq', 0), 'huella': previa.get('huella')},
+            })
+        resultado = escribir()
+        with self._lock:
+            self._rotar(archivo, seq, estantes)
+            self.stats['compactaciones'] += 1
+        return resultado
+
+    def _rotar(self, archivo, seq, estantes):
+        ruta = self._ruta(archivo, EXT_DIARIO)
+        ops = _leer_ops(ruta)
+        hechas = [op for op in ops if op['seq'] <= seq]
+        restantes = [op for op in ops if op['seq'] > seq]
+        if hechas:
+            carpeta = self._historial(archivo)
+            os.makedirs(carpeta, exist_ok=True)
+            segmento = os.path.join(carpeta, f"seg_{hechas[0]['seq']:010d}_{hechas[-1]['seq']:010d}.jsonl.gz")
+            with gzip.open(segmento, "wt", encoding='utf-8') as f:
+                for op in hechas:
+                    f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            segmentos = len(glob.glob(os.path.join(carpeta, "seg_*.jsonl.gz")))
+            if self.bases_cada and segmentos % self.bases_cada == 0:
+                self._guardar_base(archivo, seq, estantes)
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding='utf-8') as f:
+            for op in restantes:
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, ruta)
+
+    def _guardar_base(self, archivo, seq, estantes):
+        carpeta = self._historial(archivo)
+        os.makedirs(carpeta, exist_ok=True)
+        with gzip.open(os.path.join(carpeta, f"base_{seq:010d}.json.gz"), "wt", encoding='utf-8') as f:
+            json.dump({'seq': seq, 'ts': time.time(), 'estantes': estantes}, f, ensure_ascii=False)
+        self._con_base.add(archivo)
+
+    def _asegurar_base(self, archivo, estantes):
+        if glob.glob(os.path.join(self._historial(archivo), "base_*.json.gz")):
+            self._con_base.add(archivo)
+        else:
+            self._guardar_base(archivo, self.ultimo_seq(archivo), estantes)
+
+    # ---------------------------- Lectura ----------------------------
+
+    def reproducir(self, archivo, estantes):
+        """Aplica a la instantánea cargada las operaciones del diario aún no compactadas."""
+        ops = _leer_ops(self._ruta(archivo, EXT_DIARIO))
+        if not ops:
+            return estantes
+        marca = leer_json(self._ruta(archivo, EXT_MARCA), None)
+        desde = 0
+        if marca:
+            anterior = marca.get('anterior') or {}
+            if not any(op['seq'] > min(marca.get('seq', 0), anterior.get('seq', 0)) for op in ops):
+                return estantes
+            huella = huella_estantes(estantes)
+            if huella == marca.get('huella'):
+                desde = marca.get('seq', 0)
+            elif anterior and anterior.get('huella') in (None, huella):
+                # Caída entre la marca y la escritura de la instantánea
+                desde = anterior.get('seq', 0)
+                print(f"[Diario] Recuperando '{archivo}' desde la operación {desde}")
+            else:
+                print(f"[Diario] '{archivo}' fue modificado fuera del diario; se ignoran sus operaciones pendientes")
+                return estantes
+        for op in ops:
+            if op['seq'] > desde:
+                estantes = aplicar(estantes, op)
+        return estantes
+
+    def reproducir_hasta(self, archivo, ts):
+        """Estado de la bodega en la fecha `ts` (epoch) según el historial.
+
+        None si no hay una base del historial de esa fecha o anterior: no se
+        puede reconstruir un estado previo a la primera base.
+        """
+        carpeta = self._historial(archivo)
+        base = None
+        for ruta in sorted(glob.glob(os.path.join(carpeta, "base_*.json.gz")), reverse=True):
+            try:
+                with gzip.open(ruta, "rt", encoding='utf-8') as f:
+                    candidata = json.load(f)
+            except Exception as e:
+                print(f"[Diario] Base ilegible {ruta}: {e}")
+                continue
+            if candidata.get('ts', 0) <= ts:
+                base = candidata
+                break
+        if base is None:
+            return None
+        estantes, ultimo = base.get('estantes') or [], base.get('seq', 0)
+        fuentes = sorted(glob.glob(os.path.join(carpeta, "seg_*.jsonl.gz")))
+        fuentes.append(self._ruta(archivo, EXT_DIARIO))
+        for ruta in fuentes:
+            if ruta.endswith(".gz") and int(os.path.basename(ruta).split("_")[2].split(".")[0]) <= ultimo:
+                continue
+            for op in _leer_ops(ruta):
+                if op['seq'] <= ultimo:
+                    continue
+                if op.get('ts', 0) > ts:
+                    return estantes
+                estantes = aplicar(estantes, op)
+                ultimo = op['seq']
+        return estantes
+
+
+if __name__ == "__main__":
+    # Uso: python common_journal.py reproducir <archivo_bodega> "<AAAA-MM-DD HH:MM[:SS]>" [destino.json]
+    if len(sys.argv) >= 4 and sys.argv[1] == "reproducir":
+        archivo, fecha = sys.argv[2], sys.argv[3]
+        destino = sys.argv[4] if len(sys.argv) > 4 else f"{os.path.splitext(archivo)[0]}_{fecha[:10]}.json"
+        estado = DiarioBodegas(DOCS_PATH).reproducir_hasta(archivo, datetime.fromisoformat(fecha).timestamp())
+        if estado is None:
+            print(f"[Diario] No hay historial para {archivo} en esa fecha o antes")
+            sys.exit(1)
+        escribir_json_atomico(destino, estado)
+        print(f"[Diario] {archivo} al {fecha}: {len(estado)} estantes -> {destino}")
+    else:
+        print('Uso: python common_journal.py reproducir <archivo_bodega> "<AAAA-MM-DD HH:MM[:SS]>" [destino.json]')
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import gzip
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from common_store import DOCS_PATH
+
+NOMBRE_LIBRO = "movimientos_stock.jsonl"
+NOMBRE_BLOQUEO = "inventario.lock"
+CARPETA_HISTORIAL = "historial_stock"
+CLAVE_MARCA = "_libro_stock"
+
+
+class InventarioMarcado(dict):
+    """Inventario materializado que recuerda hasta qué posición del libro incluye (`marca`).
+
+    `BackendJSON.guardar_inventario` usa esa marca para no descartar los
+    movimientos que otro programa registró después de la carga.
+    """
+    marca = None
+
+
+@contextmanager
+def bloqueo_archivo(ruta):
+    """Bloqueo exclusivo entre procesos sobre `ruta` (fcntl en Linux/macOS, msvcrt en Windows)."""
+    with open(ruta, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK ya reintentó 10 s: otro programa sigue escribiendo
+                    print(f"[Libro] Esperando el bloqueo de {ruta}")
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                except OSError:
+                    pass
+
+
+class LibroStock:
+    """Libro de movimientos de stock (solo se añade al final) para el backend JSON.
+
+    Cada despacho/ingreso es una línea `{"ts", "origen", "deltas"}` en
+    movimientos_stock.jsonl, escrita con el bloqueo de inventario.lock
+    tomado: dos programas pueden vender a la vez sin pisarse y sin
+    reescribir inventario_global.json en cada venta.
+
+    El stock real es el del inventario más los movimientos posteriores a su
+    marca `_libro_stock = {"gen", "pos"}` (generación del libro y byte
+    hasta el que ya está incluido). Al compactar se escribe el inventario
+    con la marca al final del libro y luego el libro se rota a
+    historial_stock/ empezando una generación nueva: si el programa se
+    cierra entre ambos pasos, la marca evita aplicar dos veces los
+    movimientos. Un inventario sin marca se considera al día.
+    """
+
+    def __init__(self, docs_path=DOCS_PATH, sincronizar=True, rotar_desde=256 * 1024):
+        self.docs_path = docs_path
+        self.ruta = os.path.join(docs_path, NOMBRE_LIBRO)
+        self.ruta_bloqueo = os.path.join(docs_path, NOMBRE_BLOQUEO)
+        self.sincronizar = sincronizar
+        self.rotar_desde = rotar_desde
+        self._lock = threading.RLock()
+        self._profundidad = 0
+        self._bloqueo = None
+
+    @contextmanager
+    def bloqueo(self):
+        """Bloqueo del inventario entre procesos (reentrante dentro del proceso)."""
+        with self._lock:
+            if self._profundidad == 0:
+                self._bloqueo = bloqueo_archivo(self.ruta_bloqueo)
+                self._bloqueo.__enter__()
+            self._profundidad += 1
+            try:
+                yield
+            finally:
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    bloqueo, self._bloqueo = self._bloqueo, None
+                    bloqueo.__exit__(None, None, None)
+
+    # ----------------------------- Lectura -----------------------------
+
+    def _abrir(self):
+        """Abre el libro creando la cabecera de la generación 1 si no existe."""
+        if not os.path.exists(self.ruta):
+            self._nuevo(1)
+        return open(self.ruta, "rb")
+
+    def _nuevo(self, gen):
+        with open(self.ruta, "wb") as f:
+            f.write((json.dumps({"gen": gen, "ts": time.time()}) + "\n").encode('utf-8'))
+            f.flush()
+            if self.sincronizar:
+                os.fsync(f.fileno())
+
+    def movimientos(self, marca=None):
+        """(movimientos posteriores a `marca`, posición final {"gen", "pos"}).
+
+        Solo se leen líneas completas: una línea a medio escribir queda
+        para la próxima lectura.
+        """
+        with self._abrir() as f:
+            cabecera = f.readline()
+            try:
+                gen = int(json.loads(cabecera)["gen"])
+            except Exception:
+                gen = 0
+            inicio = f.tell()
+            if marca is None:
+                f.seek(0, os.SEEK_END)
+                return [], {"gen": gen, "pos": f.tell()}
+            if marca.get("gen") == gen:
+                inicio = max(inicio, int(marca.get("pos") or 0))
+            elif not isinstance(marca.get("gen"), int) or marca["gen"] > gen:
+                # El libro es anterior a la marca (restaurado o borrado): nada que aplicar
+                f.seek(0, os.SEEK_END)
+                return [], {"gen": gen, "pos": f.tell()}
+            f.seek(inicio)
+            movs, pos = [], inicio
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break
+                pos += len(linea)
+                try:
+                    mov = json.loads(linea)
+                except ValueError:
+                    continue
+                if isinstance(mov, dict) and isinstance(mov.get("deltas"), dict):
+                    movs.append(mov)
+            return movs, {"gen": gen, "pos": pos}
+
+    def posicion(self):
+        """Posición actual del final del libro {"gen", "pos"} (marca para el inventario)."""
+        return self.movimientos(None)[1]
+
+    def pendientes(self, marca):
+        """Como `movimientos`, pero si la marca es de una generación ya archivada
+        incluye también el resto de esas generaciones (historial_stock/)."""
+        movs, pos = self.movimientos(marca)
+        if not isinstance(marca.get("gen"), int) or not 0 < marca["gen"] < pos["gen"]:
+            return movs, pos
+        anteriores = []
+        for gen in range(marca["gen"], pos["gen"]):
+            ruta = os.path.join(self.docs_path, CARPETA_HISTORIAL, f"movimientos_{gen:06d}.jsonl.gz")
+            try:
+                with gzip.open(ruta, "rb") as f:
+                    datos = f.read()
+            except OSError as e:
+                print(f"[Libro] No se pudo leer {ruta}: {e}")
+                continue
+            inicio = datos.find(b"\n") + 1
+            if gen == marca["gen"]:
+                inicio = max(inicio, int(marca.get("pos") or 0))
+            for linea in datos[inicio:].splitlines():
+                try:
+                    mov = json.loads(linea)
+                except ValueError:
+                    continue
+                if isinstance(mov, dict) and isinstance(mov.get("deltas"), dict):
+                    anteriores.append(mov)
+        return anteriores + movs, pos
+
+    @staticmethod
+    def aplicar(inventario, movs):
+        """Suma los deltas de `movs` al stock de `inventario` (en el lugar)."""
+        for mov in movs:
+            for codigo, delta in mov["deltas"].items():
+                item = inventario.get(codigo)
+                if isinstance(item, dict):
+                    item['stock'] = (item.get('stock', 0) or 0) + delta
+
+    def materializar(self, inventario):
+        """Aplica al inventario los movimientos posteriores a su marca.
+
+        Devuelve un InventarioMarcado sin la clave de la marca, con `marca` en
+        la posición del libro hasta la que quedó incluido.
+        """
+        if not isinstance(inventario, dict):
+            return inventario
+        inventario = InventarioMarcado(inventario)
+        marca = inventario.pop(CLAVE_MARCA, None)
+        with self.bloqueo():
+            if marca is None:
+                # Sin marca se considera al día con el libro actual
+                inventario.marca = self.posicion()
+                return inventario
+            movs, inventario.marca = self.pendientes(marca)
+        self.aplicar(inventario, movs)
+        return inventario
+
+    # ----------------------------- Escritura -----------------------------
+
+    def registrar(self, deltas, origen=None):
+        """Añade un movimiento; debe llamarse con `bloqueo()` tomado. Devuelve la nueva posición."""
+        linea = json.dumps({"ts": time.time(), "origen": origen, "deltas": deltas},
+                           ensure_ascii=False, separators=(',', ':')) + "\n"
+        self._abrir().close()
+        with open(self.ruta, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            fin = f.tell()
+            # Una línea truncada por un corte anterior se descarta antes de escribir
+            if fin:
+                f.seek(fin - 1)
+                if f.read(1) != b"\n":
+                    f.seek(0)
+                    datos = f.read()
+                    fin = datos.rfind(b"\n") + 1
+                    f.truncate(fin)
+                    f.seek(fin)
+            f.write(linea.encode('utf-8'))
+            f.flush()
+            if self.sincronizar:
+                os.fsync(f.fileno())
+        return self.posicion()
+
+    def rotar(self, pos):
+        """Archiva el libro ya incluido en el inventario (marca `pos`) y empieza otra generación.
+
+        Debe llamarse con `bloqueo()` tomado, después de escribir el inventario.
+        """
+        if not os.path.exists(self.ruta) or os.path.getsize(self.ruta) < self.rotar_desde:
+            return False
+        if self.posicion() != pos:
+            return False
+        carpeta = os.path.join(self.docs_path, CARPETA_HISTORIAL)
+        os.makedirs(carpeta, exist_ok=True)
+        destino = os.path.join(carpeta, f"movimientos_{pos['gen']:06d}.jsonl.gz")
+        with open(self.ruta, "rb") as origen, gzip.open(destino, "wb") as f:
+            f.write(origen.read())
+        self._nuevo(pos['gen'] + 1)
+        print(f"[Libro] Generación {pos['gen']} archivada en {destino}")
+        return True
+
+    def contiene_origen(self, origen, desde=0.0):
+        """True si hay un movimiento con ese origen en el libro o en las generaciones archivadas desde `desde` (epoch)."""
+        with self.bloqueo():
+            movs, pos = self.movimientos({"gen": 0})
+        if any(mov.get("origen") == origen for mov in movs):
+            return True
+        for gen in range(pos['gen'] - 1, 0, -1):
+            anterior = os.path.join(self.docs_path, CARPETA_HISTORIAL, f"movimientos_{gen:06d}.jsonl.gz")
+            if not os.path.exists(anterior) or os.path.getmtime(anterior) < desde:
+                break
+            try:
+                with gzip.open(anterior, "rt", encoding='utf-8') as f:
+                    for linea in f:
+                        try:
+                            if json.loads(linea).get("origen") == origen:
+                                return True
+                        except (ValueError, AttributeError):
+                            continue
+            except Exception as e:
+                print(f"[Libro] Error al leer {anterior}: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    # Uso: python common_ledger.py resumen [carpeta]
+    accion = sys.argv[1] if len(sys.argv) > 1 else ""
+    if accion == "resumen":
+        libro = LibroStock(sys.argv[2] if len(sys.argv) > 2 else DOCS_PATH)
+        with libro.bloqueo():
+            movs, pos = libro.movimientos({"gen": 0})
+        total = {}
+        for mov in movs:
+            for codigo, delta in mov["deltas"].items():
+                total[codigo] = total.get(codigo, 0) + delta
+        print(f"[Libro] Generación {pos['gen']}: {len(movs)} movimientos, {len(total)} items")
+        for codigo, delta in sorted(total.items()):
+            print(f"  {codigo}: {delta:+d}")
+    else:
+        print("Uso: python common_ledger.py resumen [carpeta]")
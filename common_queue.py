@@ -0,0 +1,288 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from common_store import DOCS_PATH, obtener_backend
+from common_ledger import bloqueo_archivo
+
+NOMBRE_COLA = "cola_escaneos.db"
+
+# estado: 0 = pendiente, 1 = en un lote que se está aplicando, 2 = aplicado,
+#         3 = apartado: su ID interno no está en el inventario (ver `reintentar`)
+ESQUEMA_COLA = """
+CREATE TABLE IF NOT EXISTS escaneos (
+    id       INTEGER PRIMARY KEY,
+    ts       REAL NOT NULL,
+    estacion TEXT,
+    barcode  TEXT NOT NULL,
+    codigo   TEXT,
+    cantidad INTEGER NOT NULL DEFAULT 0,
+    modo     TEXT NOT NULL,
+    estado   INTEGER NOT NULL DEFAULT 0,
+    lote     INTEGER
+);
+CREATE INDEX IF NOT EXISTS escaneos_estado ON escaneos (estado, id);
+CREATE TABLE IF NOT EXISTS lotes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL
+);
+"""
+
+
+def resolver(mapeo, barcode):
+    """(ID interno, unidades) del código de barras según `_mapeo_barras`, o (None, 0)."""
+    vinculo = (mapeo or {}).get(barcode)
+    if not isinstance(vinculo, dict) or not vinculo.get("id_interno"):
+        return None, 0
+    return str(vinculo["id_interno"]), int(vinculo.get("factor", 1) or 1)
+
+
+class ColaEscaneos:
+    """Cola local y durable (SQLite en modo WAL) de escaneos de estaciones sin interfaz.
+
+    Cada estación solo inserta filas: un escaneo queda guardado aunque el
+    inventario esté ocupado o el programa se cierre. `drenar()` aplica los
+    pendientes por lotes como un único movimiento de stock por lote
+    (`ajustar_stock` con origen "cola:<lote>"): antes de aplicar, las filas
+    se marcan con el número de lote y, si el proceso se corta a mitad,
+    `recuperar()` consulta al backend si ese origen ya quedó registrado para
+    no aplicarlo dos veces. Drenar y recuperar se hacen con un bloqueo entre
+    procesos (<cola>.lock): con varias estaciones drenando, ninguna toma
+    por cortado el lote que otra está aplicando.
+    """
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or os.path.join(DOCS_PATH, NOMBRE_COLA)
+        self.ruta_bloqueo = self.ruta + ".lock"
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(self.ruta, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(ESQUEMA_COLA)
+        with self.transaccion() as c:
+            if c.execute("SELECT COUNT(*) FROM lotes").fetchone()[0] == 0:
+                # Colas anteriores numeraban el lote con el id de su primera fila:
+                # la secuencia empieza por encima para no repetir un origen "cola:<n>"
+                ultimo_lote, ultimo_id = c.execute("SELECT MAX(lote), MAX(id) FROM escaneos").fetchone()
+                tope = max(ultimo_lote or 0, ultimo_id or 0)
+                if tope:
+                    c.execute("INSERT INTO lotes (id, ts) VALUES (?, 0)", (tope,))
+
+    @contextmanager
+    def transaccion(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def cerrar(self):
+        with self._lock:
+            self.conn.close()
+
+    def agregar(self, barcode, modo, codigo=None, cantidad=0, estacion=None):
+        """Encola un escaneo ('venta' descuenta, 'entrada' suma); `codigo` None = sin resolver."""
+        with self.transaccion() as c:
+            cur = c.execute("INSERT INTO escaneos (ts, estacion, barcode, codigo, cantidad, modo) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (time.time(), estacion, str(barcode), codigo, int(cantidad), modo))
+            return cur.lastrowid
+
+    def drenando(self):
+        """Bloqueo entre procesos que toma quien aplica lotes (no reentrante)."""
+        return bloqueo_archivo(self.ruta_bloqueo)
+
+    def resumen(self):
+        """{estado: cantidad de escaneos} y escaneos sin resolver."""
+        with self._lock:
+            estados = dict(self.conn.execute("SELECT estado, COUNT(*) FROM escaneos GROUP BY estado"))
+            sin_resolver = self.conn.execute(
+                "SELECT COUNT(*) FROM escaneos WHERE estado = 0 AND codigo IS NULL").fetchone()[0]
+        return estados, sin_resolver
+
+    def _resolver_pendientes(self, mapeo):
+        """Resuelve con el mapeo actual los escaneos que llegaron antes de vincularse."""
+        with self._lock:
+            filas = self.conn.execute(
+                "SELECT id, barcode FROM escaneos WHERE estado = 0 AND codigo IS NULL").fetchall()
+        resueltos = []
+        for id_fila, barcode in filas:
+            codigo, factor = resolver(mapeo, barcode)
+            if codigo is not None:
+                resueltos.append((codigo, factor, id_fila))
+        if resueltos:
+            with self.transaccion() as c:
+                c.executemany("UPDATE escaneos SET codigo = ?, cantidad = ? WHERE id = ? AND codigo IS NULL",
+                              resueltos)
+        return len(resueltos)
+
+    def _aplicar_lote(self, backend, lote):
+        """Aplica (una vez) las filas marcadas con `lote` y las da por aplicadas.
+
+        Las filas cuyo ID interno no está en el inventario (`ajustar_stock` no
+        las devuelve) quedan apartadas con estado 3 en vez de perderse.
+        """
+        with self._lock:
+            filas = self.conn.execute(
+                "SELECT codigo, cantidad, modo FROM escaneos WHERE lote = ? AND estado = 1", (lote,)).fetchall()
+        deltas = {}
+        for codigo, cantidad, modo in filas:
+            signo = -1 if modo == "venta" else 1
+            deltas[codigo] = deltas.get(codigo, 0) + signo * cantidad
+        # También los deltas nulos: así el backend dice si el código existe
+        nuevos = backend.ajustar_stock(deltas, origen=f"cola:{lote}") if deltas else {}
+        desconocidos = [codigo for codigo in deltas if codigo not in nuevos]
+        with self.transaccion() as c:
+            if desconocidos:
+                c.execute(f"UPDATE escaneos SET estado = 3 WHERE lote = ? AND codigo IN "
+                          f"({','.join('?' * len(desconocidos))})", [lote] + desconocidos)
+                print(f"[Cola] Lote {lote}: {len(desconocidos)} códigos no están en el inventario "
+                      f"({', '.join(desconocidos[:5])}); quedan apartados")
+            c.execute("UPDATE escaneos SET estado = 2 WHERE lote = ? AND estado = 1", (lote,))
+        return {codigo: delta for codigo, delta in deltas.items() if codigo in nuevos and delta}
+
+    def reintentar(self):
+        """Vuelve a dejar pendientes los escaneos apartados (p. ej. tras dar de alta el item)."""
+        with self.transaccion() as c:
+            return c.execute("UPDATE escaneos SET estado = 0, lote = NULL WHERE estado = 3").rowcount
+
+    def recuperar(self, backend):
+        """Termina los lotes que quedaron a medias (el proceso se cortó al aplicarlos).
+
+        Se llama una vez al arrancar el drenador; con el bloqueo de drenado
+        tomado, un lote en estado 1 no puede ser de otro drenador en curso.
+        """
+        with self.drenando():
+            return self._recuperar(backend)
+
+    def _recuperar(self, backend):
+        # Solo cuentan movimientos posteriores a la creación del lote (filas de
+        # colas anteriores, sin fila en `lotes`: desde su primer escaneo)
+        with self._lock:
+            lotes = self.conn.execute(
+                "SELECT e.lote, COALESCE(MAX(l.ts), MIN(e.ts)) FROM escaneos e "
+                "LEFT JOIN lotes l ON l.id = e.lote WHERE e.estado = 1 GROUP BY e.lote ORDER BY e.lote").fetchall()
+        for lote, desde in lotes:
+            if backend.movimiento_registrado(f"cola:{lote}", desde):
+                with self.transaccion() as c:
+                    c.execute("UPDATE escaneos SET estado = 2 WHERE lote = ?", (lote,))
+                print(f"[Cola] Lote {lote} ya estaba aplicado")
+            else:
+                self._aplicar_lote(backend, lote)
+                print(f"[Cola] Lote {lote} reaplicado tras un corte")
+        return len(lotes)
+
+    def drenar(self, backend, lote_max=500, mapeo=None):
+        """Aplica los escaneos pendientes en lotes de `lote_max`; devuelve {codigo: delta} total.
+
+        No recupera lotes cortados: eso es `recuperar()`, una vez al arrancar.
+        """
+        with self.drenando():
+            return self._drenar(backend, lote_max, mapeo)
+
+    def _drenar(self, backend, lote_max, mapeo):
+        # El inventario solo se lee si hay escaneos sin vincular que resolver
+        if self.resumen()[1]:
+            if mapeo is None:
+                mapeo = backend.indice_barras()
+                mapeo.recargar(forzar=True)
+            self._resolver_pendientes(mapeo)
+        total = {}
+        while True:
+            with self.transaccion() as c:
+                ids = [r[0] for r in c.execute(
+                    "SELECT id FROM escaneos WHERE estado = 0 AND codigo IS NOT NULL ORDER BY id LIMIT ?",
+                    (lote_max,))]
+                if not ids:
+                    break
+                # Número de una secuencia propia (nunca un id de fila: tras `reintentar`
+                # se repetiría un origen "cola:<n>" ya registrado en el inventario)
+                lote = c.execute("INSERT INTO lotes (ts) VALUES (?)", (time.time(),)).lastrowid
+                c.execute(f"UPDATE escaneos SET estado = 1, lote = ? WHERE id IN ({','.join('?' * len(ids))})",
+                          [lote] + ids)
+            for codigo, delta in self._aplicar_lote(backend, lote).items():
+                total[codigo] = total.get(codigo, 0) + delta
+            if len(ids) < lote_max:
+                break
+        return total
+
+    def purgar(self, dias=30):
+        """Elimina los escaneos aplicados hace más de `dias` días."""
+        limite = time.time() - dias * 86400
+        with self.transaccion() as c:
+            borrados = c.execute("DELETE FROM escaneos WHERE estado = 2 AND ts < ?", (limite,)).rowcount
+            # AUTOINCREMENT no reutiliza los números de los lotes borrados
+            c.execute("DELETE FROM lotes WHERE ts < ? AND id NOT IN "
+                      "(SELECT lote FROM escaneos WHERE lote IS NOT NULL)", (limite,))
+            return borrados
+
+
+class DrenadorCola(threading.Thread):
+    """Hilo que drena la cola de escaneos al inventario cada `intervalo` segundos."""
+
+    def __init__(self, cola, backend, intervalo=2.0, lote_max=500, al_aplicar=None):
+        super().__init__(daemon=True)
+        self.cola = cola
+        self.backend = backend
+        self.intervalo = intervalo
+        self.lote_max = lote_max
+        self.al_aplicar = al_aplicar  # callback({codigo: delta}) tras cada drenado con cambios
+        self._detener = threading.Event()
+
+    def detener(self):
+        self._detener.set()
+
+    def run(self):
+        try:
+            self.cola.recuperar(self.backend)
+        except Exception as e:
+            print(f"[Cola] Error al recuperar lotes: {e}")
+        while not self._detener.is_set():
+            try:
+                aplicados = self.cola.drenar(self.backend, self.lote_max)
+                if aplicados:
+                    print(f"[Cola] Aplicados movimientos de {len(aplicados)} items")
+                    if self.al_aplicar:
+                        self.al_aplicar(aplicados)
+            except Exception as e:
+                print(f"[Cola] Error al drenar: {e}")
+            self._detener.wait(self.intervalo)
+
+
+if __name__ == "__main__":
+    # Uso: python common_queue.py drenar [segundos] | estado | reintentar | purgar [dias]
+    accion = sys.argv[1] if len(sys.argv) > 1 else ""
+    cola = ColaEscaneos()
+    if accion == "drenar":
+        backend = obtener_backend(DOCS_PATH)
+        if len(sys.argv) > 2:
+            drenador = DrenadorCola(cola, backend, intervalo=float(sys.argv[2]))
+            drenador.start()
+            try:
+                while drenador.is_alive():
+                    drenador.join(1.0)
+            except KeyboardInterrupt:
+                drenador.detener()
+        else:
+            cola.recuperar(backend)
+            aplicados = cola.drenar(backend)
+            print(f"[Cola] Aplicados movimientos de {len(aplicados)} items")
+        backend.compactar()
+    elif accion == "estado":
+        estados, sin_resolver = cola.resumen()
+        print(f"[Cola] Pendientes: {estados.get(0, 0)} ({sin_resolver} sin vincular) | "
+              f"en curso: {estados.get(1, 0)} | aplicados: {estados.get(2, 0)} | "
+              f"apartados (sin item): {estados.get(3, 0)}")
+    elif accion == "reintentar":
+        print(f"[Cola] {cola.reintentar()} escaneos apartados vuelven a pendientes")
+    elif accion == "purgar":
+        dias = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+        print(f"[Cola] Eliminados {cola.purgar(dias)} escaneos aplicados")
+    else:
+        print("Uso: python common_queue.py drenar [segundos] | estado | reintentar | purgar [dias]")
@@ -0,0 +1,262 @@
+import sys
+import math
+import time
+import random
+
+from common_store import DOCS_PATH
+
+VECINOS_2OPT = 12  # candidatos por parada en 2-opt (los más cercanos)
+
+
+def _distancias(puntos):
+    """Matriz de distancias euclidianas (píxeles del plano) entre todas las paradas."""
+    return [[math.hypot(x1 - x2, y1 - y2) for x2, y2 in puntos] for x1, y1 in puntos]
+
+
+def _vecino_mas_cercano(d, inicio):
+    n = len(d)
+    visitado = [False] * n
+    ruta = [inicio]
+    visitado[inicio] = True
+    actual = inicio
+    for _ in range(n - 1):
+        fila = d[actual]
+        siguiente = min((j for j in range(n) if not visitado[j]), key=fila.__getitem__)
+        visitado[siguiente] = True
+        ruta.append(siguiente)
+        actual = siguiente
+    return ruta
+
+
+def _dos_opt(ruta, d, cerrar, vecinos):
+    """Mejora la ruta invirtiendo tramos mientras acorte (la primera parada queda fija).
+
+    Solo se prueban aristas nuevas hacia los `vecinos` más cercanos de cada
+    parada y se revisan de nuevo únicamente las paradas cuyas aristas cambiaron
+    (don't-look bits): cada pasada cuesta O(n·k) en lugar de O(n²).
+    """
+    n = len(ruta)
+    if n < 4:
+        return ruta
+    pos = [0] * n
+    for i, v in enumerate(ruta):
+        pos[v] = i
+    cercanos = [sorted(range(n), key=fila.__getitem__)[1:vecinos + 1] for fila in d]
+    pendientes = list(ruta)
+    en_cola = [True] * n
+
+    def siguiente(j):
+        if j + 1 < n:
+            return ruta[j + 1]
+        return ruta[0] if cerrar else None
+
+    while pendientes:
+        a = pendientes.pop()
+        en_cola[a] = False
+        for c in cercanos[a]:
+            pa, pc = pos[a], pos[c]
+            # Dos movimientos crean la arista a-c: con los sucesores o con los predecesores
+            for i, j in ((min(pa, pc), max(pa, pc)), (min(pa, pc) - 1, max(pa, pc) - 1)):
+                if i < 0 or j <= i + 1:
+                    continue
+                A, B, C, D = ruta[i], ruta[i + 1], ruta[j], siguiente(j)
+                ganancia = d[A][B] - d[A][C]
+                if D is not None:
+                    ganancia += d[C][D] - d[B][D]
+                if ganancia > 1e-9:
+                    ruta[i + 1:j + 1] = ruta[i + 1:j + 1][::-1]
+                    for k in range(i + 1, j + 1):
+                        pos[ruta[k]] = k
+                    for v in (A, B, C, D):
+                        if v is not None and not en_cola[v]:
+                            en_cola[v] = True
+                            pendientes.append(v)
+                    break
+            else:
+                continue
+            # La ruta cambió: se vuelve a revisar `a` desde el principio
+            if not en_cola[a]:
+                en_cola[a] = True
+                pendientes.append(a)
+            break
+    return ruta
+
+
+def longitud(ruta, puntos, cerrar=False):
+    """Longitud del recorrido (píxeles del plano)."""
+    total = sum(math.hypot(puntos[a][0] - puntos[b][0], puntos[a][1] - puntos[b][1])
+                for a, b in zip(ruta, ruta[1:]))
+    if cerrar and len(ruta) > 1:
+        a, b = ruta[-1], ruta[0]
+        total += math.hypot(puntos[a][0] - puntos[b][0], puntos[a][1] - puntos[b][1])
+    return total
+
+
+def ordenar_paradas(puntos, inicio=None, cerrar=False, vecinos=VECINOS_2OPT):
+    """Orden de visita corto para `puntos` [(x, y)]: vecino más cercano + 2-opt.
+
+    `inicio` (x, y) es el punto de partida (p. ej. la entrada); con `cerrar`
+    la ruta vuelve a él. Sin inicio se parte de la parada más alejada del
+    centro (un extremo del recorrido). Devuelve los índices de `puntos` en
+    orden de visita.
+    """
+    n = len(puntos)
+    if n <= 1:
+        return list(range(n))
+    if inicio is not None:
+        todos = [tuple(inicio)] + [tuple(p) for p in puntos]
+        primero = 0
+    else:
+        todos = [tuple(p) for p in puntos]
+        cx = sum(x for x, _ in todos) / n
+        cy = sum(y for _, y in todos) / n
+        primero = max(range(n), key=lambda i: (todos[i][0] - cx) ** 2 + (todos[i][1] - cy) ** 2)
+    d = _distancias(todos)
+    ruta = _dos_opt(_vecino_mas_cercano(d, primero), d, cerrar, vecinos)
+    if inicio is not None:
+        return [i - 1 for i in ruta[1:]]
+    return ruta
+
+
+def elegir_paradas(ubicaciones):
+    """Agrupa los items por (bodega, estante) eligiendo una ubicación por item.
+
+    `ubicaciones` es {codigo: item} con el formato de CatalogoBodegas.ubicar
+    ({"nombre", "ubicaciones": [{"bodega", "estante", "gaveta", "x", "y"}]}).
+    Se usa la bodega con más items de la lista; si un item está en varios
+    estantes se prefiere uno que ya es parada y, si no, el más cercano a las
+    paradas elegidas. Devuelve ({(bodega, estante): parada}, no encontrados, sin coordenadas).
+    """
+    no_encontrados, sin_coordenadas = [], []
+    candidatos = {}
+    votos = {}
+    for codigo, item in ubicaciones.items():
+        if item is None:
+            no_encontrados.append(codigo)
+            continue
+        lugares = [u for u in item.get("ubicaciones", ()) if u.get("x") is not None and u.get("y") is not None]
+        if not lugares:
+            sin_coordenadas.append(codigo)
+            continue
+        candidatos[codigo] = (item, lugares)
+        for b in {u["bodega"] for u in lugares}:
+            votos[b] = votos.get(b, 0) + 1
+
+    paradas = {}
+
+    def agregar(codigo, item, u):
+        clave = (u["bodega"], u["estante"])
+        parada = paradas.setdefault(clave, {"bodega": u["bodega"], "estante": u["estante"],
+                                            "x": u["x"], "y": u["y"], "items": []})
+        parada["items"].append({"codigo": item.get("codigo") or codigo, "nombre": item.get("nombre", ""),
+                                "gaveta": u.get("gaveta")})
+
+    # Primero los items con una sola opción (fijan paradas), luego el resto
+    multiples = []
+    for codigo, (item, lugares) in candidatos.items():
+        mejor_bodega = max({u["bodega"] for u in lugares}, key=lambda b: votos[b])
+        lugares = [u for u in lugares if u["bodega"] == mejor_bodega]
+        if len(lugares) == 1:
+            agregar(codigo, item, lugares[0])
+        else:
+            multiples.append((codigo, item, lugares))
+    for codigo, item, lugares in multiples:
+        existente = next((u for u in lugares if (u["bodega"], u["estante"]) in paradas), None)
+        if existente is None:
+            en_bodega = [p for p in paradas.values() if p["bodega"] == lugares[0]["bodega"]]
+            existente = min(lugares, key=lambda u: min(
+                (math.hypot(u["x"] - p["x"], u["y"] - p["y"]) for p in en_bodega), default=0.0))
+        agregar(codigo, item, existente)
+    return paradas, no_encontrados, sin_coordenadas
+
+
+def planificar_recorrido(ubicaciones, inicio=None, cerrar=False):
+    """Recorrido de picking para {codigo: item} (formato de CatalogoBodegas.ubicar).
+
+    Devuelve {"tramos": [{"bodega", "paradas", "distancia"}], "no_encontrados",
+    "sin_coordenadas", "ms"}: un tramo por bodega (cada plano tiene sus propias
+    coordenadas), la bodega con más paradas primero. `inicio` es {bodega: (x, y)}.
+    """
+    t0 = time.perf_counter()
+    paradas, no_encontrados, sin_coordenadas = elegir_paradas(ubicaciones)
+    por_bodega = {}
+    for parada in paradas.values():
+        por_bodega.setdefault(parada["bodega"], []).append(parada)
+    tramos = []
+    for bodega, lista in sorted(por_bodega.items(), key=lambda kv: -len(kv[1])):
+        puntos = [(p["x"], p["y"]) for p in lista]
+        punto_inicio = (inicio or {}).get(bodega)
+        orden = ordenar_paradas(puntos, punto_inicio, cerrar)
+        ordenadas = [lista[i] for i in orden]
+        recorrido = [tuple(punto_inicio)] + [puntos[i] for i in orden] if punto_inicio else [puntos[i] for i in orden]
+        tramos.append({"bodega": bodega, "paradas": ordenadas,
+                       "distancia": round(longitud(list(range(len(recorrido))), recorrido, cerrar), 1)})
+    return {"tramos": tramos, "no_encontrados": no_encontrados, "sin_coordenadas": sin_coordenadas,
+            "ms": round((time.perf_counter() - t0) * 1000, 2)}
+
+
+def ubicaciones_desde_almacen(almacen, codigos, inventario=None):
+    """{codigo: item} con el formato de CatalogoBodegas.ubicar a partir de un AlmacenBodegas.
+
+    Para programas que ya tienen las bodegas residentes (bodega.py).
+    """
+    respuesta = {}
+    almacen.refrescar()
+    for codigo in codigos:
+        codigo = str(codigo).strip()
+        lugares = []
+        nombre = (inventario or {}).get(codigo, {}).get('nombre', '') if isinstance(inventario, dict) else ''
+        for nivel, pos, nombre_est in almacen.ubicaciones_codigo(codigo, refrescar=False):
+            estantes = almacen.estantes(nivel)
+            est = estantes[pos] if 0 <= pos < len(estantes) else {}
+            gaveta = None
+            for s in est.get('suplementos', []) or []:
+                if isinstance(s, dict) and str(s.get('codigo', '') or '') == codigo:
+                    gaveta = s.get('gaveta')
+                    nombre = nombre or s.get('nombre', '')
+                    break
+            lugares.append({"bodega": nivel, "estante": nombre_est, "gaveta": gaveta,
+                            "x": est.get('x'), "y": est.get('y')})
+        respuesta[codigo] = {"codigo": codigo, "nombre": nombre, "ubicaciones": lugares} if lugares or nombre else None
+    return respuesta
+
+
+def benchmark(paradas=200, repeticiones=20, semilla=1):
+    """Tiempo de ordenar_paradas para `paradas` puntos aleatorios en un plano de 4000x3000."""
+    rnd = random.Random(semilla)
+    tiempos, mejoras = [], []
+    for _ in range(repeticiones):
+        puntos = [(rnd.uniform(0, 4000), rnd.uniform(0, 3000)) for _ in range(paradas)]
+        t0 = time.perf_counter()
+        orden = ordenar_paradas(puntos)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+        d = _distancias(puntos)
+        solo_vecino = longitud(_vecino_mas_cercano(d, orden[0]), puntos)
+        mejoras.append(1 - longitud(orden, puntos) / solo_vecino)
+    tiempos.sort()
+    return {"paradas": paradas, "mediana_ms": round(tiempos[len(tiempos) // 2], 2),
+            "max_ms": round(tiempos[-1], 2), "mejora_sobre_vecino": round(sum(mejoras) / len(mejoras), 3)}
+
+
+if __name__ == "__main__":
+    # Uso: python common_route.py benchmark [paradas] | ruta <codigo> [<codigo> ...]
+    accion = sys.argv[1] if len(sys.argv) > 1 else ""
+    if accion == "benchmark":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        r = benchmark(n)
+        print(f"[Ruta] {r['paradas']} paradas: mediana {r['mediana_ms']} ms, máximo {r['max_ms']} ms, "
+              f"{r['mejora_sobre_vecino'] * 100:.1f}% más corta que solo vecino más cercano")
+    elif accion == "ruta" and len(sys.argv) > 2:
+        from common_catalog import CatalogoBodegas
+        catalogo = CatalogoBodegas(DOCS_PATH)
+        catalogo.actualizar()
+        plan = planificar_recorrido(catalogo.ubicar(sys.argv[2:]))
+        for tramo in plan["tramos"]:
+            print(f"[Ruta] {tramo['bodega']}: {len(tramo['paradas'])} paradas, {tramo['distancia']} px")
+            for i, p in enumerate(tramo["paradas"], 1):
+                print(f"  {i:3d}. {p['estante']}: " + ", ".join(it['codigo'] for it in p["items"]))
+        if plan["no_encontrados"] or plan["sin_coordenadas"]:
+            print(f"[Ruta] Sin ubicar: {', '.join(plan['no_encontrados'] + plan['sin_coordenadas'])}")
+        print(f"[Ruta] Calculada en {plan['ms']} ms")
+    else:
+        print("Uso: python common_route.py benchmark [paradas] | ruta <codigo> [<codigo> ...]")
@@ -0,0 +1,215 @@
+import bisect
+import heapq
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes ('Café ' -> 'cafe'), para comparar búsquedas."""
+    texto = str(texto or '').strip().lower()
+    if texto.isascii():
+        return texto
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTexto:
+    """Índice invertido de trigramas sobre "código + nombre" de los items.
+
+    `buscar(q)` devuelve los códigos cuyo código o nombre contiene `q` (misma
+    regla que el filtro lineal de siempre, pero sin tildes ni mayúsculas).
+    Una consulta de 3 caracteres es directamente la lista de su trigrama;
+    una más larga intersecta las listas de sus trigramas menos frecuentes y
+    verifica solo esos candidatos. Las de 1-2 caracteres recorren los textos
+    ya normalizados (o solo el resultado anterior, si se está escribiendo
+    sobre él). Además mantiene los códigos ordenados para búsquedas por
+    prefijo.
+
+    Cada código conserva su número interno mientras exista, así los
+    resultados salen en el orden de inserción (el del inventario). Las
+    listas (array de enteros de 4 bytes) admiten entradas obsoletas tras
+    renombrar o eliminar: la verificación las descarta y `compactar()` las
+    limpia cuando son muchas.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = {}          # {codigo: id interno}
+        self._codigos = []      # [codigo por id] (None = eliminado)
+        self._textos = []       # [código\x00nombre normalizado por id] (None = eliminado)
+        self._gramas = {}       # {trigrama: array('I', ids)}
+        self._desordenadas = set()  # trigramas con ids agregados fuera de orden (o repetidos)
+        self._ordenados = []    # códigos ordenados (prefijos)
+        self._obsoletas = 0     # entradas de trigramas que ya no corresponden
+        self._version = 0       # cambia con cada modificación
+        self._ultima = None     # (version, consulta corta, ids) para refinar al escribir
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, codigo):
+        return str(codigo) in self._ids
+
+    def cargar(self, items):
+        """Reconstruye el índice desde [(codigo, nombre), ...]."""
+        with self._lock:
+            self.__init__()
+            for codigo, nombre in items:
+                self._insertar(str(codigo), nombre)
+            self._ordenados = sorted(self._ids)
+
+    def _insertar(self, codigo, nombre):
+        i = len(self._codigos)
+        texto = f"{normalizar(codigo)}\x00{normalizar(nombre)}"
+        self._ids[codigo] = i
+        self._codigos.append(codigo)
+        self._textos.append(texto)
+        gramas = self._gramas
+        self._version += 1
+        for g in _trigramas(texto):
+            lista = gramas.get(g)
+            if lista is None:
+                gramas[g] = lista = array('I')
+            lista.append(i)
+
+    def agregar(self, codigo, nombre):
+        """Agrega un item o actualiza su nombre."""
+        codigo = str(codigo)
+        with self._lock:
+            i = self._ids.get(codigo)
+            if i is None:
+                self._insertar(codigo, nombre)
+                bisect.insort(self._ordenados, codigo)
+                return
+            texto = f"{normalizar(codigo)}\x00{normalizar(nombre)}"
+            previo = self._textos[i]
+            if texto == previo:
+                return
+            self._textos[i] = texto
+            self._version += 1
+            anteriores, nuevos = _trigramas(previo), _trigramas(texto)
+            for g in nuevos - anteriores:
+                self._gramas.setdefault(g, array('I')).append(i)
+                self._desordenadas.add(g)
+            self._obsoletas += len(anteriores - nuevos)
+            self._compactar_si_hace_falta()
+
+    def eliminar(self, codigo):
+        codigo = str(codigo)
+        with self._lock:
+            i = self._ids.pop(codigo, None)
+            if i is None:
+                return
+            self._obsoletas += len(_trigramas(self._textos[i]))
+            self._codigos[i] = None
+            self._textos[i] = None
+            self._version += 1
+            pos = bisect.bisect_left(self._ordenados, codigo)
+            if pos < len(self._ordenados) and self._ordenados[pos] == codigo:
+                del self._ordenados[pos]
+            self._compactar_si_hace_falta()
+
+    def _compactar_si_hace_falta(self):
+        if self._obsoletas > 200000 and self._obsoletas > 5 * len(self._ids):
+            self.compactar()
+
+    def compactar(self):
+        """Reconstruye las listas de trigramas sin entradas obsoletas (conserva el orden)."""
+        with self._lock:
+            self._gramas = {}
+            self._desordenadas.clear()
+            for i, texto in enumerate(self._textos):
+                if texto is not None:
+                    for g in _trigramas(texto):
+                        self._gramas.setdefault(g, array('I')).append(i)
+            self._obsoletas = 0
+
+    def _lista(self, grama):
+        """Lista de ids del trigrama, ordenada y sin repetidos."""
+        lista = self._gramas.get(grama)
+        if lista is not None and grama in self._desordenadas:
+            lista = self._gramas[grama] = array('I', sorted(set(lista)))
+            self._desordenadas.discard(grama)
+        return lista
+
+    def buscar(self, consulta, limite=None):
+        """Códigos cuyo código o nombre contiene `consulta`, en orden de inserción."""
+        q = normalizar(consulta)
+        with self._lock:
+            codigos, textos = self._codigos, self._textos
+            if not q:
+                resultado = [c for c in codigos if c is not None]
+                return resultado if limite is None else resultado[:limite]
+            if len(q) < 3:
+                ultima = self._ultima
+                if ultima and ultima[0] == self._version and ultima[1] in q:
+                    candidatos = ultima[2]
+                else:
+                    candidatos = range(len(textos))
+                ids = [i for i in candidatos if textos[i] is not None and q in textos[i]]
+                self._ultima = (self._version, q, ids)
+            elif len(q) == 3:
+                ids = self._lista(q) or ()
+                if self._obsoletas:
+                    ids = [i for i in ids if textos[i] is not None and q in textos[i]]
+            else:
+                listas = []
+                for t in _trigramas(q):
+                    lista = self._lista(t)
+                    if not lista:
+                        return []
+                    listas.append(lista)
+                listas.sort(key=len)
+                candidatos = set(listas[0])
+                for lista in listas[1:3]:
+                    candidatos.intersection_update(lista)
+                ids = sorted(i for i in candidatos if textos[i] is not None and q in textos[i])
+            if limite is not None:
+                ids = ids[:limite]
+            return [codigos[i] for i in ids]
+
+    def parecidos(self, consulta, limite=20, minimo=0.5):
+        """[(codigo, similitud)] de los textos que comparten más trigramas con `consulta`.
+
+        Tolera errores de tipeo ("protien" encuentra "protein"): cuenta en
+        cuántas listas de trigramas de la consulta aparece cada id y se
+        queda con los que reúnen al menos `minimo` de ellos (0..1).
+        """
+        gramas = _trigramas(normalizar(consulta))
+        if not gramas:
+            return []
+        with self._lock:
+            conteo = Counter()
+            for g in gramas:
+                conteo.update(self._lista(g) or ())
+            necesarios = max(1, round(minimo * len(gramas)))
+            candidatos = heapq.nlargest(2 * limite, (i for i, n in conteo.items() if n >= necesarios),
+                                        key=conteo.__getitem__)
+            # Recuento exacto (las listas pueden tener entradas obsoletas)
+            resultado = []
+            for i in candidatos:
+                texto = self._textos[i]
+                if texto is None:
+                    continue
+                comunes = sum(1 for g in gramas if g in texto)
+                if comunes >= necesarios:
+                    resultado.append((self._codigos[i], comunes / len(gramas)))
+            resultado.sort(key=lambda r: -r[1])
+            return resultado[:limite]
+
+    def prefijo_codigo(self, prefijo, limite=None):
+        """Códigos que empiezan por `prefijo`, en orden (índice de códigos ordenado)."""
+        prefijo = str(prefijo)
+        with self._lock:
+            inicio = bisect.bisect_left(self._ordenados, prefijo)
+            resultado = []
+            for codigo in self._ordenados[inicio:]:
+                if not codigo.startswith(prefijo) or (limite is not None and len(resultado) >= limite):
+                    break
+                resultado.append(codigo)
+            return resultado
@@ -0,0 +1,750 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+# --- CONFIGURACIÓN DE RUTAS ---
+DOCS_PATH = os.path.join(os.path.expanduser("~"), "Documents", "Yuuruii", "AgustinaFalcon")
+NOMBRE_INVENTARIO = "inventario_global.json"
+NOMBRE_DB = "agustina_falcon.db"
+CLAVE_MAPEO = "_mapeo_barras"
+
+
+def leer_json(ruta, defecto=None):
+    """Lee un archivo JSON; devuelve `defecto` si no existe o está corrupto."""
+    if not ruta or not os.path.exists(ruta):
+        return defecto
+    try:
+        with open(ruta, "r", encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[Store] Error al leer {ruta}: {e}")
+        return defecto
+
+
+def escribir_json_atomico(ruta, datos):
+    """Escribe JSON en un temporal y lo renombra, para que ningún lector vea un archivo a medias.
+
+    Devuelve el número de bytes escritos.
+    """
+    texto = json.dumps(datos, indent=4, ensure_ascii=False).encode('utf-8')
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(texto)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, ruta)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return len(texto)
+
+
+def firma_archivo(ruta):
+    """(mtime_ns, tamaño) del archivo, o None si no existe."""
+    try:
+        st = os.stat(ruta)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def copiar_estantes(estantes):
+    """Copia la lista de estantes sin compartir las listas de suplementos del llamador."""
+    copia = []
+    for est in estantes or []:
+        if not isinstance(est, dict):
+            continue
+        nuevo = dict(est)
+        nuevo['suplementos'] = [dict(s) if isinstance(s, dict) else s for s in est.get('suplementos', []) or []]
+        copia.append(nuevo)
+    return copia
+
+
+class BackendJSON:
+    """Backend clásico: inventario_global.json + un yrz_*.json por bodega.
+
+    Las operaciones sobre un item releen el inventario solo si otro programa
+    modificó el archivo desde la última escritura, para no pisar sus cambios,
+    y se hacen con el bloqueo de inventario.lock tomado. Los ajustes de stock
+    no reescriben el archivo: se añaden al libro de movimientos
+    (common_ledger.LibroStock) y se incorporan al inventario cada
+    `compactar_cada` movimientos o en la próxima escritura completa.
+    """
+
+    nombre = "json"
+
+    def __init__(self, docs_path=DOCS_PATH, compactar_cada=200):
+        from common_ledger import LibroStock
+        self.docs_path = docs_path
+        self.ruta_inventario = os.path.join(docs_path, NOMBRE_INVENTARIO)
+        self.libro = LibroStock(docs_path)
+        self.compactar_cada = compactar_cada
+        self._lock = threading.RLock()
+        self._inv = None
+        self._inv_firma = None
+        self._inv_pos = None      # posición del libro ya aplicada a _inv
+        self._sin_compactar = 0   # movimientos aplicados a _inv que el archivo aún no incluye
+        self._indice_barras = None
+
+    # --------------------------- Inventario ---------------------------
+
+    def cargar_inventario(self):
+        """Inventario completo {codigo: {...}, '_mapeo_barras': {...}} con el stock al día."""
+        datos = leer_json(self.ruta_inventario, {})
+        if not isinstance(datos, dict):
+            return {}
+        return self.libro.materializar(datos)
+
+    def guardar_inventario(self, inventario):
+        """Reemplaza el inventario completo.
+
+        Si viene de `cargar_inventario` (InventarioMarcado), los movimientos que
+        otros programas registraron después de cargarlo se aplican antes de
+        escribir, también al diccionario del llamador, que queda al día. Un
+        diccionario sin marca se toma como al día con el libro.
+        """
+        from common_ledger import CLAVE_MARCA
+        with self._lock, self.libro.bloqueo():
+            pos = self.sincronizar_inventario(inventario)
+            datos = dict(inventario)
+            datos[CLAVE_MARCA] = pos
+            escribir_json_atomico(self.ruta_inventario, datos)
+            self._escribir_indice_barras(datos, firma_archivo(self.ruta_inventario))
+            self.libro.rotar(pos)
+            self._inv = None
+
+    def sincronizar_inventario(self, inventario):
+        """Aplica a un inventario de `cargar_inventario` los movimientos registrados
+        desde que se cargó y avanza su marca; devuelve la posición del libro."""
+        with self.libro.bloqueo():
+            marca = getattr(inventario, "marca", None)
+            if not isinstance(marca, dict):
+                # Sin marca del libro (o la de otro backend, p. ej. al exportar desde SQLite)
+                return self.libro.posicion()
+            movs, pos = self.libro.pendientes(marca)
+            self.libro.aplicar(inventario, movs)
+            inventario.marca = pos
+            return pos
+
+    def firma_inventario(self):
+        """Cambia cuando cambia el inventario o se registra un movimiento de stock."""
+        return (firma_archivo(self.ruta_inventario), firma_archivo(self.libro.ruta))
+
+    def _escribir_indice_barras(self, inventario, firma):
+        """Mantiene al día el índice de códigos de barras (common_barcodes) tras escribir el inventario."""
+        try:
+            from common_barcodes import escribir_indice_barras
+            escribir_indice_barras(self.docs_path, inventario, firma)
+        except Exception as e:
+            print(f"[Store] No se pudo actualizar el índice de códigos de barras: {e}")
+
+    def indice_barras(self):
+        """Búsqueda código de barras -> {"id_interno", "factor", "nombre"} sin cargar el inventario."""
+        if self._indice_barras is None:
+            from common_barcodes import IndiceBarras
+            self._indice_barras = IndiceBarras(self.docs_path)
+        return self._indice_barras
+
+    def _inventario_actual(self):
+        """Inventario en memoria al día: relee el archivo solo si cambió y aplica los movimientos nuevos."""
+        from common_ledger import CLAVE_MARCA
+        firma = firma_archivo(self.ruta_inventario)
+        if self._inv is None or firma != self._inv_firma:
+            datos = leer_json(self.ruta_inventario, {})
+            self._inv = datos if isinstance(datos, dict) else {}
+            self._inv_firma = firma
+            self._inv_pos = self._inv.pop(CLAVE_MARCA, None)
+            self._sin_compactar = 0
+            if self._inv_pos is None:
+                # Archivo sin marca (anterior al libro o escrito por fuera): se marca
+                # al final del libro para que los próximos movimientos cuenten para todos
+                self._inv_pos = self.libro.posicion()
+                self._persistir()
+                return self._inventario_actual()
+        movs, pos = self.libro.movimientos(self._inv_pos)
+        if movs:
+            self.libro.aplicar(self._inv, movs)
+            self._sin_compactar += len(movs)
+            self._inv_pos = pos
+        return self._inv
+
+    def _persistir(self):
+        """Escribe el inventario en memoria (con la marca del libro) y rota el libro."""
+        from common_ledger import CLAVE_MARCA
+        datos = dict(self._inv)
+        datos[CLAVE_MARCA] = self._inv_pos
+        escribir_json_atomico(self.ruta_inventario, datos)
+        self._inv_firma = firma_archivo(self.ruta_inventario)
+        self._escribir_indice_barras(datos, self._inv_firma)
+        self._sin_compactar = 0
+        if self.libro.rotar(self._inv_pos):
+            # Nueva generación: la marca escrita ya no coincide con el libro
+            self._inv = None
+
+    def actualizar_item(self, codigo, datos):
+        """Crea o actualiza un item; devuelve su stock guardado.
+
+        Si el item ya existe se conserva su stock actual (con los movimientos
+        del libro): el stock de un item existente solo cambia con `ajustar_stock`.
+        """
+        with self._lock, self.libro.bloqueo():
+            inv = self._inventario_actual()
+            nuevo = dict(datos)
+            if isinstance(inv.get(codigo), dict):
+                nuevo['stock'] = inv[codigo].get('stock', 0)
+            inv[codigo] = nuevo
+            self._persistir()
+            return nuevo.get('stock', 0)
+
+    def actualizar_items(self, cambios, eliminados=()):
+        """Crea/reemplaza varios items y elimina otros con una sola escritura."""
+        if not cambios and not eliminados:
+            return
+        with self._lock, self.libro.bloqueo():
+            inventario = self._inventario_actual()
+            for codigo, datos in cambios.items():
+                inventario[codigo] = dict(datos)
+            for codigo in eliminados:
+                inventario.pop(codigo, None)
+            self._persistir()
+
+    def eliminar_item(self, codigo):
+        """Elimina un item (si existe)."""
+        with self._lock, self.libro.bloqueo():
+            if self._inventario_actual().pop(codigo, None) is not None:
+                self._persistir()
+
+    def ajustar_stock(self, deltas, origen=None):
+        """Suma `deltas` {codigo: cantidad} al stock; devuelve {codigo: stock_nuevo}.
+
+        Se registra como un movimiento del libro (una línea), no como una
+        reescritura del inventario.
+        """
+        with self._lock, self.libro.bloqueo():
+            inv = self._inventario_actual()
+            validos = {codigo: delta for codigo, delta in deltas.items()
+                       if isinstance(inv.get(codigo), dict) and delta}
+            if not validos:
+                return {codigo: inv[codigo].get('stock', 0) for codigo in deltas
+                        if isinstance(inv.get(codigo), dict)}
+            pos = self.libro.registrar(validos, origen)
+            self.libro.aplicar(inv, [{"deltas": validos}])
+            self._inv_pos = pos
+            self._sin_compactar += 1
+            if self._sin_compactar >= self.compactar_cada:
+                self._persistir()
+            return {codigo: inv[codigo].get('stock', 0) for codigo in deltas
+                    if isinstance(inv.get(codigo), dict)}
+
+    def movimiento_registrado(self, origen, desde=0.0):
+        """True si ya se registró un ajuste de stock con ese `origen` (lotes de common_queue) después de `desde`."""
+        return self.libro.contiene_origen(origen, desde)
+
+    def compactar(self):
+        """Incorpora al inventario los movimientos pendientes del libro."""
+        with self._lock, self.libro.bloqueo():
+            self._inventario_actual()
+            if self._sin_compactar:
+                self._persistir()
+
+    def guardar_mapeo_barra(self, barcode, id_interno, factor):
+        """Vincula un código de barras a un ID interno con su factor de unidades."""
+        with self._lock, self.libro.bloqueo():
+            inv = self._inventario_actual()
+            inv.setdefault(CLAVE_MAPEO, {})[barcode] = {"id_interno": id_interno, "factor": int(factor)}
+            self._persistir()
+
+    # ---------------------------- Bodegas ----------------------------
+
+    def firma_estantes(self, archivo):
+        return firma_archivo(os.path.join(self.docs_path, archivo))
+
+    def cargar_estantes(self, archivo):
+        datos = leer_json(os.path.join(self.docs_path, archivo), [])
+        return datos if isinstance(datos, list) else []
+
+    def guardar_estantes(self, archivo, estantes, cambiados=None):
+        """Escribe la bodega completa (en JSON no hay escrituras parciales)."""
+        return escribir_json_atomico(os.path.join(self.docs_path, archivo), estantes)
+
+
+_BACKENDS = {}
+
+
+def obtener_backend(docs_path=DOCS_PATH):
+    """Backend de datos compartido por los cuatro programas.
+
+    Se usa SQLite si existe la base (creada con `python common_db.py migrar`)
+    o si AGUSTINA_BACKEND=sqlite; AGUSTINA_BACKEND=json fuerza los archivos JSON.
+    """
+    if docs_path in _BACKENDS:
+        return _BACKENDS[docs_path]
+    modo = os.environ.get("AGUSTINA_BACKEND", "").strip().lower()
+    ruta_db = os.path.join(docs_path, NOMBRE_DB)
+    backend = None
+    if modo == "sqlite" or (modo != "json" and os.path.exists(ruta_db)):
+        try:
+            from common_db import BaseDatos
+            backend = BaseDatos(ruta_db)
+        except Exception as e:
+            print(f"[Store] No se pudo abrir SQLite, usando JSON: {e}")
+    if backend is None:
+        backend = BackendJSON(docs_path)
+    _BACKENDS[docs_path] = backend
+    return backend
+
+
+class AlmacenBodegas:
+    """Mantiene residentes en memoria todas las bodegas (yrz_*.json) con índices.
+
+    Cada bodega se lee una sola vez y se vuelve a leer únicamente si cambia la
+    firma de su archivo (mtime/tamaño en JSON, versión en SQLite). Los índices
+    permiten responder en tiempo constante "dónde está el código X", "qué
+    estantes tienen items con este nombre" y "a qué bodega pertenece este
+    estante".
+
+    Las listas en `_datos` nunca se modifican in situ (cada cambio instala
+    una lista nueva), por lo que un hilo de guardado puede escribirlas sin
+    copiarlas.
+
+    Cada cambio se anota además en el diario de operaciones (common_journal):
+    al cargar, la instantánea se completa con las operaciones del diario, y
+    `escribir` compacta el diario en una instantánea nueva.
+    """
+
+    def __init__(self, archivos, docs_path=DOCS_PATH, backend=None, diario=None):
+        # `archivos` es el dict {nombre_bodega: archivo_json}; se guarda por
+        # referencia para seguir los cambios de configuración (agregar/eliminar).
+        self.archivos = archivos
+        self.docs_path = docs_path
+        self.backend = backend or obtener_backend(docs_path)
+        if diario is None:
+            from common_journal import DiarioBodegas
+            diario = DiarioBodegas(docs_path)
+        self.diario = diario
+        self._datos = {}       # {nivel: [estantes]}
+        self._firmas = {}      # {nivel: (archivo, firma_del_backend, firma_del_diario)}
+        # Índices globales: {clave: {nivel: [(posicion, nombre_estante), ...]}}
+        self._por_codigo = {}
+        self._por_nombre = {}
+        self._por_estante = {}
+        self._nombre_lower = {}  # {nombre: nombre.lower()}
+        # Claves aportadas por cada bodega (para poder retirarlas al reindexar)
+        self._claves = {}      # {nivel: (codigos, nombres, estantes)}
+        # Códigos cuya ubicación cambió desde la última llamada a tomar_codigos_tocados()
+        self._tocados = set()
+        # Bodegas con cambios en memoria aún no escritos (no se releen del disco)
+        self._sin_guardar = set()
+        self._version = 0      # cambia con cada bodega (re)indexada o descartada
+        self._lock = threading.RLock()
+
+    # ---------------------- Carga e invalidación ----------------------
+
+    def ruta(self, nivel):
+        """Ruta completa del JSON de una bodega."""
+        if nivel and nivel in self.archivos:
+            return os.path.join(self.docs_path, self.archivos[nivel])
+        return ""
+
+    def _firma(self, nivel):
+        archivo = self.archivos.get(nivel)
+        return (archivo, self.backend.firma_estantes(archivo), self.diario.firma(archivo))
+
+    def _cargar(self, archivo):
+        """Instantánea del backend más las operaciones del diario no compactadas."""
+        return self.diario.reproducir(archivo, self.backend.cargar_estantes(archivo))
+
+    def refrescar(self, nivel=None):
+        """Recarga las bodegas cuya firma cambió y descarta las eliminadas."""
+        with self._lock:
+            niveles = [nivel] if nivel is not None else list(self.archivos.keys())
+            if nivel is None:
+                for viejo in [n for n in self._datos if n not in self.archivos]:
+                    self._desindexar(viejo)
+                    self._datos.pop(viejo, None)
+                    self._firmas.pop(viejo, None)
+                    self._version += 1
+            for n in niveles:
+                if n not in self.archivos:
+                    continue
+                if n in self._sin_guardar and n in self._datos:
+                    # La copia residente es más nueva que la del disco
+                    continue
+                firma = self._firma(n)
+                if self._firmas.get(n) == firma and n in self._datos:
+                    continue
+                self._establecer(n, self._cargar(self.archivos[n]))
+                self._firmas[n] = firma
+
+    def invalidar(self, nivel=None):
+        """Fuerza la relectura de una bodega (o de todas) en la próxima consulta."""
+        with self._lock:
+            if nivel is None:
+                self._firmas.clear()
+            else:
+                self._firmas.pop(nivel, None)
+
+    # --------------------------- Índices ---------------------------
+
+    def _establecer(self, nivel, estantes):
+        # Ubicaciones previas de los códigos de esta bodega, para detectar cambios
+        previos = self._claves.get(nivel, (set(),))[0]
+        antes = {c: self._por_codigo[c][nivel] for c in previos
+                 if nivel in self._por_codigo.get(c, {})}
+        self._desindexar(nivel)
+        self._datos[nivel] = estantes
+        self._version += 1
+        codigos, nombres, nombres_est = set(), set(), set()
+        for pos, est in enumerate(estantes):
+            if not isinstance(est, dict):
+                continue
+            nombre_est = est.get('nombre', '')
+            self._por_estante.setdefault(nombre_est, {}).setdefault(nivel, []).append((pos, nombre_est))
+            nombres_est.add(nombre_est)
+            for s in est.get('suplementos', []) or []:
+                if isinstance(s, dict):
+                    code = str(s.get('codigo', '') or '')
+                    nombre = s.get('nombre', '') or ''
+                    if code:
+                        self._por_codigo.setdefault(code, {}).setdefault(nivel, []).append((pos, nombre_est))
+                        codigos.add(code)
+                else:
+                    nombre = str(s)
+                self._por_nombre.setdefault(nombre, {}).setdefault(nivel, []).append((pos, nombre_est))
+                if nombre not in self._nombre_lower:
+                    self._nombre_lower[nombre] = nombre.lower()
+                nombres.add(nombre)
+        self._claves[nivel] = (codigos, nombres, nombres_est)
+        for c in codigos | set(antes):
+            if antes.get(c) != self._por_codigo.get(c, {}).get(nivel):
+                self._tocados.add(c)
+
+    @staticmethod
+    def _claves_estante(est):
+        """(nombre del estante, [códigos], [nombres de items]) que un estante aporta a los índices."""
+        if not isinstance(est, dict):
+            return None, [], []
+        codigos, nombres = [], []
+        for s in est.get('suplementos', []) or []:
+            if isinstance(s, dict):
+                code = str(s.get('codigo', '') or '')
+                if code:
+                    codigos.append(code)
+                nombres.append(s.get('nombre', '') or '')
+            else:
+                nombres.append(str(s))
+        return est.get('nombre', ''), codigos, nombres
+
+    def _reindexar_posicion(self, nivel, pos, viejo, nuevo):
+        """Actualiza los índices de una sola posición (sin recorrer toda la bodega)."""
+        antes, despues = self._claves_estante(viejo), self._claves_estante(nuevo)
+        if antes == despues:
+            return  # p. ej. solo cambió x/y al mover el estante
+        claves = self._claves.setdefault(nivel, (set(), set(), set()))
+        indices = (self._por_codigo, self._por_nombre, self._por_estante)
+        for indice, conjunto, keys in zip(indices, claves, (antes[1], antes[2], [antes[0]] if antes[0] is not None else [])):
+            for k in keys:
+                por_nivel = indice.get(k, {})
+                lista = por_nivel.get(nivel, [])
+                try:
+                    lista.remove((pos, antes[0]))
+                except ValueError:
+                    continue
+                if indice is self._por_codigo:
+                    self._tocados.add(k)
+                if not lista:
+                    por_nivel.pop(nivel, None)
+                    conjunto.discard(k)
+                    if not por_nivel:
+                        del indice[k]
+                        if indice is self._por_nombre:
+                            self._nombre_lower.pop(k, None)
+        for indice, conjunto, keys in zip(indices, claves, (despues[1], despues[2], [despues[0]] if despues[0] is not None else [])):
+            for k in keys:
+                bisect.insort(indice.setdefault(k, {}).setdefault(nivel, []), (pos, despues[0]))
+                conjunto.add(k)
+                if indice is self._por_codigo:
+                    self._tocados.add(k)
+                elif indice is self._por_nombre and k not in self._nombre_lower:
+                    self._nombre_lower[k] = k.lower()
+
+    def _desindexar(self, nivel):
+        claves = self._claves.pop(nivel, None)
+        if not claves:
+            return
+        for indice, keys in zip((self._por_codigo, self._por_nombre, self._por_estante), claves):
+            for k in keys:
+                por_nivel = indice.get(k)
+                if por_nivel is None:
+                    continue
+                por_nivel.pop(nivel, None)
+                if not por_nivel:
+                    del indice[k]
+                    if indice is self._por_nombre:
+                        self._nombre_lower.pop(k, None)
+
+    def _ordenar(self, por_nivel):
+        """Aplana {nivel: [(pos, estante)]} respetando el orden de las bodegas."""
+        res = []
+        for n in self.archivos:
+            for pos, nombre_est in por_nivel.get(n, ()):
+                res.append((n, pos, nombre_est))
+        return res
+
+    # --------------------------- Consultas ---------------------------
+
+    def version(self, refrescar=True):
+        """Contador que cambia cuando cambia cualquier bodega (para cachés derivadas)."""
+        if refrescar:
+            self.refrescar()
+        return self._version
+
+    def estantes(self, nivel):
+        """Lista residente de estantes de una bodega (no modificar in situ)."""
+        self.refrescar(nivel)
+        return self._datos.get(nivel, [])
+
+    def ubicaciones_codigo(self, codigo, refrescar=True):
+        """[(nivel, posicion, nombre_estante)] de los estantes que contienen el código."""
+        if refrescar:
+            self.refrescar()
+        return self._ordenar(self._por_codigo.get(str(codigo), {}))
+
+    def buscar_nombre(self, texto):
+        """[(nivel, posicion, nombre_estante)] con items cuyo nombre contiene `texto`."""
+        self.refrescar()
+        t = (texto or '').lower()
+        encontrados = {}
+        for nombre, lower in self._nombre_lower.items():
+            if t in lower:
+                for n, ubic in self._por_nombre.get(nombre, {}).items():
+                    encontrados.setdefault(n, set()).update(ubic)
+        return self._ordenar({n: sorted(u) for n, u in encontrados.items()})
+
+    def bodegas_de_estante(self, nombre_estante):
+        """Bodegas que tienen un estante con ese nombre."""
+        self.refrescar()
+        return [n for n, _, _ in self._ordenar(self._por_estante.get(nombre_estante, {}))]
+
+    def codigos_asignados(self):
+        """Conjunto de códigos presentes en alguna repisa."""
+        self.refrescar()
+        return set(self._por_codigo.keys())
+
+    def tomar_codigos_tocados(self):
+        """Devuelve (y vacía) los códigos cuya ubicación cambió desde la última llamada."""
+        with self._lock:
+            tocados, self._tocados = self._tocados, set()
+            return tocados
+
+    def nombres_suplementos(self):
+        """Nombres de todos los items asignados, ordenados (para autocompletado)."""
+        self.refrescar()
+        return sorted(self._por_nombre.keys())
+
+    # --------------------------- Escritura ---------------------------
+
+    def _registrar(self, nivel, ops, previos):
+        """Anota las operaciones en el diario (un append pequeño por cambio)."""
+        archivo = self.archivos.get(nivel)
+        if not archivo or not ops:
+            return
+        try:
+            self.diario.registrar(archivo, ops, previos)
+        except Exception as e:
+            # El cambio sigue en memoria y se guardará en la próxima compactación
+            print(f"[Store] No se pudo anotar en el diario de '{nivel}': {e}")
+            return
+        firma = self._firmas.get(nivel)
+        if firma is not None:
+            self._firmas[nivel] = (firma[0], firma[1], self.diario.firma(archivo))
+
+    def actualizar(self, nivel, estantes):
+        """Reemplaza en memoria los estantes de una bodega, reindexa y anota la diferencia en el diario."""
+        from common_journal import diferencias
+        with self._lock:
+            previos = self.estantes(nivel)
+            nuevos = copiar_estantes(estantes)
+            self._registrar(nivel, diferencias(previos, nuevos), previos)
+            self._establecer(nivel, nuevos)
+
+    def actualizar_estante(self, nivel, posicion, estante):
+        """Reemplaza en memoria un único estante; False si la posición no existe."""
+        with self._lock:
+            previos = self.estantes(nivel)
+            if not 0 <= posicion < len(previos):
+                return False
+            estantes = list(previos)
+            estantes[posicion] = copiar_estantes([estante])[0]
+            self._registrar(nivel, [{'op': 'set', 'pos': posicion, 'estante': estantes[posicion]}], previos)
+            # Solo la posición que cambió (mover un estante no toca los índices)
+            self._reindexar_posicion(nivel, posicion, previos[posicion], estantes[posicion])
+            self._datos[nivel] = estantes
+            self._version += 1
+            return True
+
+    def escribir(self, nivel, cambiados=None):
+        """Compacta el diario escribiendo la copia residente; devuelve los bytes escritos."""
+        with self._lock:
+            archivo = self.archivos.get(nivel)
+            estantes = self._datos.get(nivel)
+            seq = self.diario.ultimo_seq(archivo) if archivo else 0
+        if archivo is None or estantes is None:
+            print(f"[Store] Nivel '{nivel}' no válido para guardar")
+            return 0
+        escritos = self.diario.compactar(
+            archivo, seq, estantes,
+            lambda: self.backend.guardar_estantes(archivo, estantes, cambiados=cambiados))
+        with self._lock:
+            self._firmas[nivel] = self._firma(nivel)
+        return escritos or 0
+
+    def guardar(self, nivel, estantes):
+        """Escribe la bodega en disco y deja la copia residente sincronizada."""
+        if nivel not in self.archivos:
+            print(f"[Store] Nivel '{nivel}' no válido para guardar")
+            return False
+        self.actualizar(nivel, estantes)
+        self.escribir(nivel)
+        return True
+
+    def guardar_estante(self, nivel, posicion, estante):
+        """Guarda un único estante; en SQLite es una actualización de una fila."""
+        if nivel not in self.archivos or not self.actualizar_estante(nivel, posicion, estante):
+            return False
+        self.escribir(nivel, cambiados=[posicion])
+        return True
+
+
+class ColaGuardado:
+    """Guardado diferido (write-behind) de bodegas en un hilo de fondo.
+
+    Cada cambio actualiza la copia residente del almacén y marca la bodega
+    como sucia; el hilo la escribe cuando pasan `espera` segundos sin nuevos
+    cambios (o como mucho cada `espera_maxima` segundos si no paran, o al
+    acumular `max_cambios`). Muchos cambios seguidos sobre la misma bodega se
+    funden en una sola escritura.
+
+    Como cada cambio ya queda anotado en el diario del almacén, esa escritura
+    es una compactación y puede retrasarse sin riesgo de perder datos.
+    """
+
+    def __init__(self, almacen, espera=0.6, espera_maxima=5.0, max_cambios=None):
+        self.almacen = almacen
+        self.espera = espera
+        self.espera_maxima = espera_maxima
+        self.max_cambios = max_cambios
+        self._pendientes = {}  # {nivel: [cambiados|None, primer_cambio, ultimo_cambio, n_cambios]}
+        self._cond = threading.Condition()
+        self._escritura = threading.Lock()
+        self._detenido = False
+        self.stats = {
+            'cambios': 0,            # cambios encolados
+            'escrituras': 0,         # escrituras reales a disco
+            'bytes_escritos': 0,
+            'latencia_ultima_ms': 0.0,
+            'latencia_max_ms': 0.0,
+            'latencia_total_ms': 0.0,
+        }
+        self._hilo = threading.Thread(target=self._trabajar, name="ColaGuardado", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, nivel, cambiados=None):
+        """Marca la bodega como sucia; `cambiados` = posiciones tocadas (None = todas)."""
+        ahora = time.monotonic()
+        with self._cond:
+            with self.almacen._lock:
+                self.almacen._sin_guardar.add(nivel)
+            entrada = self._pendientes.get(nivel)
+            if entrada is None:
+                self._pendientes[nivel] = [None if cambiados is None else set(cambiados), ahora, ahora, 1]
+            else:
+                if entrada[0] is not None:
+                    if cambiados is None:
+                        entrada[0] = None
+                    else:
+                        entrada[0].update(cambiados)
+                entrada[2] = ahora
+                entrada[3] += 1
+            self.stats['cambios'] += 1
+            self._cond.notify()
+
+    def pendientes(self):
+        with self._cond:
+            return list(self._pendientes.keys())
+
+    def vaciar(self, nivel=None):
+        """Escribe ya (en el hilo llamador) la bodega indicada o todas las pendientes."""
+        with self._cond:
+            niveles = list(self._pendientes.keys()) if nivel is None else [nivel]
+        self._escribir(niveles)
+
+    def detener(self):
+        """Vacía todo lo pendiente y termina el hilo (llamar al cerrar la aplicación)."""
+        self.vaciar()
+        with self._cond:
+            self._detenido = True
+            self._cond.notify()
+        self._hilo.join(timeout=5)
+
+    def resumen(self):
+        st = dict(self.stats)
+        promedio = st['latencia_total_ms'] / st['escrituras'] if st['escrituras'] else 0.0
+        diario = self.almacen.diario.stats
+        return (f"{st['cambios']} cambios -> {st['escrituras']} escrituras, "
+                f"{st['bytes_escritos']} bytes, latencia media {promedio:.1f} ms "
+                f"(máx {st['latencia_max_ms']:.1f} ms); diario: {diario['operaciones']} operaciones, "
+                f"{diario['bytes']} bytes")
+
+    def _escribir(self, niveles):
+        with self._escritura:
+            for nivel in niveles:
+                with self._cond:
+                    entrada = self._pendientes.pop(nivel, None)
+                if entrada is None:
+                    continue
+                t0 = time.perf_counter()
+                try:
+                    escritos = self.almacen.escribir(nivel, None if entrada[0] is None else sorted(entrada[0]))
+                except Exception as e:
+                    print(f"[ColaGuardado] Error al guardar '{nivel}': {e}")
+                    # Reintentar en la próxima vuelta
+                    with self._cond:
+                        if nivel not in self._pendientes:
+                            entrada[2] = time.monotonic()
+                            self._pendientes[nivel] = entrada
+                    continue
+                ms = (time.perf_counter() - t0) * 1000
+                with self._cond:
+                    self.stats['escrituras'] += 1
+                    self.stats['bytes_escritos'] += escritos
+                    self.stats['latencia_ultima_ms'] = ms
+                    self.stats['latencia_max_ms'] = max(self.stats['latencia_max_ms'], ms)
+                    self.stats['latencia_total_ms'] += ms
+                    if nivel not in self._pendientes:
+                        with self.almacen._lock:
+                            self.almacen._sin_guardar.discard(nivel)
+
+    def _trabajar(self):
+        while True:
+            with self._cond:
+                while not self._pendientes and not self._detenido:
+                    self._cond.wait()
+                if self._detenido:
+                    return
+                ahora = time.monotonic()
+                listos = [n for n, (_, primero, ultimo, cuenta) in self._pendientes.items()
+                          if ahora - ultimo >= self.espera or ahora - primero >= self.espera_maxima
+                          or (self.max_cambios and cuenta >= self.max_cambios)]
+                if not listos:
+                    proximo = min(min(u + self.espera, p + self.espera_maxima)
+                                  for _, p, u, _ in self._pendientes.values())
+                    self._cond.wait(max(0.01, proximo - ahora))
+                    continue
+            self._escribir(listos)
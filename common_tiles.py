@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import math
+import shutil
+import hashlib
+import threading
+
+from common_store import DOCS_PATH, leer_json, escribir_json_atomico, firma_archivo
+from common_ledger import bloqueo_archivo
+
+CARPETA_TESELAS = "teselas"
+TAM_TESELA = 256
+MAX_BASE = 1024  # lado máximo de la imagen de base (se carga entera, debajo de las teselas)
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def version_imagen(ruta_imagen):
+    """Identificador corto de la versión del plano (cambia si se reemplaza el archivo)."""
+    firma = firma_archivo(ruta_imagen)
+    return hashlib.sha1(repr(firma).encode('utf-8')).hexdigest()[:12] if firma else None
+
+
+def carpeta_piramide(graphics_path, ruta_imagen):
+    """Carpeta con todas las versiones de la pirámide del plano."""
+    nombre = os.path.splitext(os.path.basename(ruta_imagen))[0]
+    return os.path.join(graphics_path, CARPETA_TESELAS, nombre)
+
+
+def generar_piramide(ruta_imagen, destino, version, tam=TAM_TESELA, calidad=80):
+    """Genera la pirámide (nivel 0 = una tesela, último nivel = resolución original).
+
+    Cada nivel es la mitad del siguiente; las teselas van en `<nivel>/<x>_<y>.webp`
+    (PNG si Pillow no tiene WebP) y `base.<ext>` es el primer nivel con lado
+    <= MAX_BASE. Se escribe en una carpeta temporal que se renombra al final,
+    así un lector nunca ve una pirámide a medias.
+    """
+    from PIL import Image, features
+    Image.MAX_IMAGE_PIXELS = None  # planos escaneados grandes (archivos propios, no de internet)
+    ext, formato = ("webp", "WEBP") if features.check('webp') else ("png", "PNG")
+    with Image.open(ruta_imagen) as original:
+        modo = "RGBA" if original.mode in ("RGBA", "LA", "P") else "RGB"
+        actual = original.convert(modo)
+    ancho, alto = actual.size
+    niveles = max(1, math.ceil(math.log2(max(ancho, alto) / tam)) + 1)
+    tmp = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        info, teselas = _escribir_niveles(actual, tmp, version, tam, calidad, ext, formato, niveles)
+        shutil.rmtree(destino, ignore_errors=True)
+        os.replace(tmp, destino)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        # Otro proceso (sin el mismo bloqueo) pudo dejarla completa mientras tanto
+        existente = leer_json(os.path.join(destino, "info.json"), None)
+        if existente:
+            return existente
+        raise
+    print(f"[Teselas] {os.path.basename(ruta_imagen)}: {niveles} niveles, {teselas} teselas ({ancho}x{alto})")
+    return info
+
+
+def _escribir_niveles(actual, tmp, version, tam, calidad, ext, formato, niveles):
+    """Escribe todos los niveles, la base y info.json en `tmp`; devuelve (info, teselas)."""
+    from PIL import Image
+    ancho, alto = actual.size
+    base = None
+    teselas = 0
+    for nivel in range(niveles - 1, -1, -1):
+        carpeta = os.path.join(tmp, str(nivel))
+        os.makedirs(carpeta, exist_ok=True)
+        w, h = actual.size
+        for ty in range(math.ceil(h / tam)):
+            for tx in range(math.ceil(w / tam)):
+                recorte = actual.crop((tx * tam, ty * tam, min(w, (tx + 1) * tam), min(h, (ty + 1) * tam)))
+                recorte.save(os.path.join(carpeta, f"{tx}_{ty}.{ext}"), formato, quality=calidad)
+                teselas += 1
+        if base is None and max(w, h) <= MAX_BASE:
+            actual.save(os.path.join(tmp, f"base.{ext}"), formato, quality=calidad)
+            base = (w, h)
+        if nivel:
+            actual = actual.resize((max(1, math.ceil(w / 2)), max(1, math.ceil(h / 2))), Image.Resampling.LANCZOS)
+    info = {"version": version, "ancho": ancho, "alto": alto, "tam": tam, "niveles": niveles,
+            "formato": ext, "base_ancho": base[0], "base_alto": base[1]}
+    escribir_json_atomico(os.path.join(tmp, "info.json"), info)
+    return info, teselas
+
+
+def asegurar_piramide(graphics_path, ruta_imagen):
+    """Info de la pirámide de la versión actual del plano; la genera la primera vez."""
+    version = version_imagen(ruta_imagen)
+    if version is None:
+        return None
+    raiz = carpeta_piramide(graphics_path, ruta_imagen)
+    destino = os.path.join(raiz, version)
+    info = leer_json(os.path.join(destino, "info.json"), None)
+    if info:
+        return info
+    with _locks_lock:
+        lock = _locks.setdefault(raiz, threading.Lock())
+    os.makedirs(raiz, exist_ok=True)
+    # El hilo de bodega.py y cada worker del servidor web pueden pedirla a la vez:
+    # bloqueo entre procesos por (plano, versión), además del de este proceso
+    with lock, bloqueo_archivo(os.path.join(raiz, f".{version}.lock")):
+        info = leer_json(os.path.join(destino, "info.json"), None)
+        if info:
+            return info
+        info = generar_piramide(ruta_imagen, destino, version)
+        # Versiones anteriores del mismo plano, con sus archivos de bloqueo
+        for vieja in os.listdir(raiz):
+            ruta_vieja = os.path.join(raiz, vieja)
+            if vieja != version and os.path.isdir(ruta_vieja) and not vieja.endswith(".tmp"):
+                shutil.rmtree(ruta_vieja, ignore_errors=True)
+            elif vieja.startswith(".") and vieja.endswith(".lock") and vieja != f".{version}.lock":
+                try:
+                    os.remove(ruta_vieja)
+                except OSError:
+                    pass  # otro proceso la tiene abierta (Windows); se borra en la próxima versión
+        return info
+
+
+if __name__ == "__main__":
+    # Uso: python common_tiles.py <plano.png> [carpeta graphics]
+    if len(sys.argv) < 2:
+        print("Uso: python common_tiles.py <plano.png> [carpeta graphics]")
+        sys.exit(1)
+    graphics = sys.argv[2] if len(sys.argv) > 2 else os.path.join(DOCS_PATH, "graphics")
+    print(json.dumps(asegurar_piramide(graphics, sys.argv[1]), indent=2))
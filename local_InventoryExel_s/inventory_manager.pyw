@@ -9,9 +9,24 @@ except Exception:
     Image = None
     ImageTk = None
 import pandas as pd
+import numpy as np
+import csv
+import io
 import json
+import time
 import threading
 from pathlib import Path
+try:
+    from openpyxl import load_workbook
+except Exception:
+    load_workbook = None
+
+# Módulos compartidos del proyecto (common_*.py en la raíz)
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_PROYECTO not in sys.path:
+    sys.path.insert(0, RAIZ_PROYECTO)
+from common_store import obtener_backend
+from common_search import IndiceTexto
 
 # ============================================
 # CONFIGURACIÓN
@@ -27,6 +42,183 @@ COLOR_PRIMARY = "#DA9CFF"
 COLOR_BG = "#0d0d0d"
 COLOR_PANEL = "#1a1a1a"
 
+# ============================================
+# MOTOR DE IMPORTACIÓN (operaciones por columna)
+# ============================================
+FILAS_POR_BLOQUE = 20000  # filas normalizadas entre cada aviso de progreso
+
+def _texto(serie):
+    return serie.astype(str).str.strip()
+
+def detectar_encabezado(df):
+    """Busca la fila con COLUMNA_ID sin recorrer filas en Python.
+
+    Devuelve (fila, col_id, col_nombre, col_stock) por posición, o None si no
+    hay encabezado. col_stock es None si la hoja no trae columna de stock.
+    """
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        celdas = df.iloc[inicio:inicio + FILAS_POR_BLOQUE].apply(_texto)
+        filas = np.flatnonzero(celdas.eq(COLUMNA_ID).any(axis=1).to_numpy())
+        if not len(filas):
+            continue
+        encabezado = celdas.iloc[filas[0]].tolist()
+        if COLUMNA_NOMBRE not in encabezado:
+            return None
+        if COLUMNA_STOCK in encabezado:
+            col_stock = encabezado.index(COLUMNA_STOCK)
+        else:
+            # Algunas planillas traen "Stock" en una fila de títulos aparte
+            marcas = np.argwhere(celdas.eq(COLUMNA_STOCK).to_numpy())
+            col_stock = int(marcas[0][1]) if len(marcas) else None
+        return (inicio + int(filas[0]), encabezado.index(COLUMNA_ID),
+                encabezado.index(COLUMNA_NOMBRE), col_stock)
+    return None
+
+def normalizar_bloque(bloque, col_id, col_nombre, col_stock):
+    """Filas de datos -> (ids, nombres, stocks) con operaciones vectorizadas.
+
+    Mismas reglas que la importación fila a fila: el ID es el texto antes del
+    primer punto (12345.0 -> "12345"), se descartan IDs vacíos o NaN y el
+    stock no numérico cuenta como 0.
+    """
+    crudos = bloque.iloc[:, col_id]
+    ids = crudos.astype(str).str.split('.', n=1).str[0].str.strip()
+    validos = ((ids != '') & (ids != 'nan') & crudos.notna()).to_numpy()
+    nombres = _texto(bloque.iloc[:, col_nombre].fillna(''))
+    if col_stock is None:
+        stocks = np.zeros(len(bloque), dtype=np.int64)
+    else:
+        crudo = bloque.iloc[:, col_stock]
+        if crudo.dtype == object:
+            crudo = crudo.astype(str).str.strip()
+        valores = np.array(pd.to_numeric(crudo, errors='coerce'), dtype=float)
+        valores[~np.isfinite(valores)] = 0
+        stocks = np.trunc(valores).astype(np.int64)
+    return ids[validos].tolist(), nombres[validos].tolist(), stocks[validos].tolist()
+
+def agregar_bloque(destino, ids, nombres, stocks):
+    """Añade filas normalizadas al inventario (un ID repetido conserva la última fila)."""
+    destino.update(zip(ids, ({"nombre": n, "stock": s} for n, s in zip(nombres, stocks))))
+
+def diferencias_inventario(actual, nuevo):
+    """Compara el inventario guardado con la hoja importada.
+
+    Devuelve (cambios, eliminados, resumen): `cambios` trae los items nuevos y
+    los modificados (conservando sus demás campos, p. ej. 'asignable'),
+    `eliminados` los códigos que ya no vienen en la hoja. Las claves internas
+    ('_mapeo_barras') nunca se tocan.
+    """
+    cambios, agregados, modificados = {}, 0, 0
+    for codigo, fila in nuevo.items():
+        if codigo.startswith('_'):
+            continue
+        previo = actual.get(codigo)
+        if not isinstance(previo, dict):
+            cambios[codigo] = fila
+            agregados += 1
+        elif previo.get('nombre') != fila['nombre'] or previo.get('stock') != fila['stock']:
+            cambios[codigo] = dict(previo, nombre=fila['nombre'], stock=fila['stock'])
+            modificados += 1
+    eliminados = [c for c in actual if not c.startswith('_') and c not in nuevo]
+    resumen = {'agregados': agregados, 'modificados': modificados, 'eliminados': len(eliminados),
+               'sin_cambios': len(nuevo) - agregados - modificados}
+    return cambios, eliminados, resumen
+
+def indexar(inventario):
+    """Índice de búsqueda con los items del inventario (sin claves internas)."""
+    indice = IndiceTexto()
+    indice.cargar((k, v.get('nombre', '')) for k, v in inventario.items()
+                  if not k.startswith('_') and isinstance(v, dict))
+    return indice
+
+# --- Lectores por bloques: cada uno produce (DataFrame de filas crudas, avance 0..1 o None) ---
+
+def _agrupar_filas(filas, avance=None):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= FILAS_POR_BLOQUE:
+            yield pd.DataFrame(bloque), avance() if avance else None
+            bloque = []
+    if bloque:
+        yield pd.DataFrame(bloque), avance() if avance else None
+
+def bloques_excel(archivo):
+    """Hoja completa en memoria con pandas (.xls, o .xlsx si falta openpyxl)."""
+    df = pd.read_excel(archivo, header=None)
+    for inicio in range(0, len(df), FILAS_POR_BLOQUE):
+        yield df.iloc[inicio:inicio + FILAS_POR_BLOQUE], min(1.0, (inicio + FILAS_POR_BLOQUE) / len(df))
+
+def bloques_xlsx(archivo):
+    """Lee la primera hoja fila a fila (openpyxl en modo solo lectura), sin cargarla entera."""
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        total = hoja.max_row or 0
+        leidas = [0]
+        def filas():
+            for fila in hoja.iter_rows(values_only=True):
+                leidas[0] += 1
+                yield fila
+        yield from _agrupar_filas(filas(), (lambda: min(1.0, leidas[0] / total)) if total else None)
+    finally:
+        libro.close()
+
+def bloques_csv(archivo):
+    """Lee un CSV por bloques (separador y codificación detectados al inicio)."""
+    with open(archivo, "rb") as f:
+        muestra = f.read(65536)
+    try:
+        muestra.decode('utf-8')
+        codificacion = 'utf-8-sig'
+    except UnicodeDecodeError as e:
+        # Un corte a mitad de carácter al final de la muestra no cuenta
+        codificacion = 'utf-8-sig' if e.start >= len(muestra) - 3 else 'latin-1'
+    texto = muestra.decode(codificacion, errors='ignore')
+    try:
+        dialecto = csv.Sniffer().sniff(texto, delimiters=";,\t|")
+    except csv.Error:
+        dialecto = csv.excel
+    tamano = max(1, os.path.getsize(archivo))
+    with open(archivo, "rb") as crudo:
+        f = io.TextIOWrapper(crudo, encoding=codificacion, errors='replace', newline='')
+        yield from _agrupar_filas(csv.reader(f, dialecto), lambda: min(1.0, crudo.tell() / tamano))
+
+def leer_bloques(archivo):
+    """Elige el lector según la extensión: CSV y .xlsx se leen en streaming."""
+    ext = os.path.splitext(archivo)[1].lower()
+    if ext == '.csv':
+        return bloques_csv(archivo)
+    if ext == '.xlsx' and load_workbook is not None:
+        return bloques_xlsx(archivo)
+    return bloques_excel(archivo)
+
+def importar_bloques(bloques, avisar=None):
+    """Construye {id: {nombre, stock}} localizando el encabezado sobre la marcha.
+
+    Solo se mantiene en memoria un bloque de filas crudas a la vez. Devuelve
+    (inventario, filas_de_datos), o (None, 0) si no apareció el encabezado.
+    """
+    inventario, filas, columnas = {}, 0, None
+    for bloque, avance in bloques:
+        if columnas is None:
+            encabezado = detectar_encabezado(bloque)
+            if encabezado is None:
+                continue
+            columnas = encabezado[1:]
+            bloque = bloque.iloc[encabezado[0] + 1:]
+        ancho = max(c for c in columnas if c is not None) + 1
+        if bloque.shape[1] < ancho:
+            # Filas más cortas que el encabezado (celdas finales vacías)
+            bloque = bloque.reindex(columns=range(ancho))
+        agregar_bloque(inventario, *normalizar_bloque(bloque, *columnas))
+        filas += len(bloque)
+        if avisar:
+            avisar(filas, avance)
+    if columnas is None:
+        return None, 0
+    return inventario, filas
+
 class InventoryManager(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -82,14 +274,18 @@ class InventoryManager(ctk.CTk):
         
         # Datos
         self.inventario_json = {}
+        self.indice = IndiceTexto()  # índice de búsqueda (código/nombre)
         self.items_filtrados = []
         self.pagina_actual = 0
         self.items_por_pagina = 25
+        self.filas_widgets = []  # pool de filas reutilizables [(frame, lbl_id, lbl_nombre, lbl_stock)]
+        self.filas_mostradas = []  # contenido actual de cada fila del pool (para no reconfigurar lo igual)
         self.after_id = None 
         
         self.ruta_guardado = Path.home() / "Documents" / "Yuuruii" / "AgustinaFalcon"
         self.ruta_guardado.mkdir(parents=True, exist_ok=True)
         self.archivo_json = self.ruta_guardado / "inventario_global.json"
+        self.backend = obtener_backend(str(self.ruta_guardado))
         
         self.crear_interfaz()
         threading.Thread(target=self.cargar_json_inicial, daemon=True).start()
@@ -142,6 +338,10 @@ class InventoryManager(ctk.CTk):
         self.progress_bar.pack(pady=5, padx=20)
         self.progress_bar.set(0)
 
+        # Resultado de la última importación (filas/s)
+        self.label_importacion = ctk.CTkLabel(self.sidebar, text="", font=("Arial", 11), text_color="#888", wraplength=240)
+        self.label_importacion.pack(pady=5, padx=20)
+
         # MAIN
         self.main_frame = ctk.CTkFrame(self, fg_color=COLOR_BG, corner_radius=0)
         self.main_frame.grid(row=0, column=1, sticky="nsew")
@@ -175,6 +375,16 @@ class InventoryManager(ctk.CTk):
         self.btn_next = ctk.CTkButton(self.nav_frame, text="SIGUIENTE ▶", width=120, command=self.pagina_siguiente)
         self.btn_next.pack(side="right", padx=10)
 
+        # Tamaño de página configurable
+        self.combo_por_pagina = ctk.CTkOptionMenu(self.nav_frame, values=["25", "50", "100", "200"], width=80, command=self.cambiar_por_pagina)
+        self.combo_por_pagina.set(str(self.items_por_pagina))
+        self.combo_por_pagina.pack(side="right", padx=10)
+        ctk.CTkLabel(self.nav_frame, text="Por página:", font=("Arial", 12)).pack(side="right")
+
+        # Atajos de teclado para paginar
+        self.bind('<Prior>', lambda e: self.pagina_anterior() if self.pagina_actual > 0 else None)
+        self.bind('<Next>', lambda e: self.pagina_siguiente() if (self.pagina_actual + 1) * self.items_por_pagina < len(self.items_filtrados) else None)
+
     def on_search_key(self, event):
         """Gestiona el debounce para que la búsqueda sea fluida"""
         if self.after_id:
@@ -185,36 +395,51 @@ class InventoryManager(ctk.CTk):
         self.after_id = self.after(300, self.filtrar_busqueda)
 
     def cargar_json_inicial(self):
-        if self.archivo_json.exists():
-            try:
-                with open(self.archivo_json, 'r', encoding='utf-8') as f:
-                    self.inventario_json = json.load(f)
-                self.items_filtrados = list(self.inventario_json.items())
-                self.after(0, self.actualizar_interfaz)
-            except: pass
+        try:
+            inventario = self.backend.cargar_inventario()
+            self.inventario_json, self.indice = inventario, indexar(inventario)
+            self.after(0, self.refrescar_resultados)
+        except: pass
+
+    def resultados(self, query):
+        """[(codigo, item)] que coinciden con la búsqueda, vía el índice."""
+        inv = self.inventario_json
+        return [(c, inv[c]) for c in self.indice.buscar(query) if c in inv]
+
+    def refrescar_resultados(self):
+        """Vuelve a aplicar la búsqueda actual (tras cargar o importar)"""
+        self.items_filtrados = self.resultados(self.entry_search.get())
+        self.pagina_actual = 0
+        self.actualizar_interfaz()
 
     def filtrar_busqueda(self):
-        query = self.entry_search.get().lower().strip()
+        query = self.entry_search.get()
         self.progress_bar.set(0.6) # Fase 2 de la barra
         
-        if not query:
-            self.items_filtrados = list(self.inventario_json.items())
-        else:
-            # Búsqueda optimizada
-            self.items_filtrados = [
-                (str(k), v) for k, v in self.inventario_json.items() 
-                if query in str(k).lower() or query in str(v.get('nombre', '')).lower()
-            ]
+        self.items_filtrados = self.resultados(query)
         
         self.pagina_actual = 0
         self.actualizar_interfaz()
         self.progress_bar.set(1)
         self.after(500, lambda: self.progress_bar.set(0)) # Reset barra
 
+    def crear_fila(self):
+        """Crea una fila vacía del pool (se reutiliza en todas las páginas)"""
+        f = ctk.CTkFrame(self.scrollable_frame, fg_color="#1e1e1e", height=45)
+        f.pack_propagate(False)
+        lbl_id = ctk.CTkLabel(f, text="", width=130, font=("Consolas", 13, "bold"), text_color="#888")
+        lbl_id.pack(side="left", padx=10)
+        lbl_nombre = ctk.CTkLabel(f, text="", anchor="w", font=("Arial", 12))
+        lbl_nombre.pack(side="left", padx=10, expand=True, fill="x")
+
+        # Stock con fondo sutil para resaltar
+        stk_frame = ctk.CTkFrame(f, fg_color="#282828", width=100, corner_radius=6)
+        stk_frame.pack(side="right", padx=15, pady=5)
+        lbl_stock = ctk.CTkLabel(stk_frame, text="", font=("Arial", 13, "bold"))
+        lbl_stock.pack(expand=True)
+        return f, lbl_id, lbl_nombre, lbl_stock
+
     def actualizar_interfaz(self):
-        for widget in self.scrollable_frame.winfo_children():
-            if isinstance(widget, ctk.CTkFrame): widget.destroy()
-        
         total_items = len(self.items_filtrados)
         total_paginas = max(1, (total_items + self.items_por_pagina - 1) // self.items_por_pagina)
         
@@ -223,25 +448,32 @@ class InventoryManager(ctk.CTk):
         start = self.pagina_actual * self.items_por_pagina
         end = min(start + self.items_por_pagina, total_items)
         lote = self.items_filtrados[start:end]
-        
-        for id_i, d in lote:
-            f = ctk.CTkFrame(self.scrollable_frame, fg_color="#1e1e1e", height=45)
-            f.pack(fill="x", pady=2, padx=5)
-            f.pack_propagate(False)
-            
+
+        # Las filas se crean una vez y se reconfiguran; las sobrantes se ocultan
+        # (siempre las últimas, así el orden de pack se mantiene).
+        while len(self.filas_widgets) < len(lote):
+            self.filas_widgets.append(self.crear_fila())
+            self.filas_mostradas.append(None)
+        for i, (f, lbl_id, lbl_nombre, lbl_stock) in enumerate(self.filas_widgets):
+            if i >= len(lote):
+                if self.filas_mostradas[i] is not None:
+                    f.pack_forget()
+                    self.filas_mostradas[i] = None
+                continue
+            id_i, d = lote[i]
             stk = d.get('stock', 0)
-            color_s = COLOR_PRIMARY if stk > 0 else "#FF6B6B"
-            
-            ctk.CTkLabel(f, text=f"{id_i}", width=130, font=("Consolas", 13, "bold"), text_color="#888").pack(side="left", padx=10)
-            ctk.CTkLabel(f, text=f"{str(d.get('nombre', ''))[:80]}", anchor="w", font=("Arial", 12)).pack(side="left", padx=10, expand=True, fill="x")
-            
-            # Stock con fondo sutil para resaltar
-            stk_frame = ctk.CTkFrame(f, fg_color="#282828", width=100, corner_radius=6)
-            stk_frame.pack(side="right", padx=15, pady=5)
-            ctk.CTkLabel(stk_frame, text=f"{stk}", text_color=color_s, font=("Arial", 13, "bold")).pack(expand=True)
+            contenido = (id_i, str(d.get('nombre', ''))[:80], stk)
+            previo = self.filas_mostradas[i]
+            if previo is None:
+                f.pack(fill="x", pady=2, padx=5)
+            if contenido != previo:
+                lbl_id.configure(text=f"{id_i}")
+                lbl_nombre.configure(text=contenido[1])
+                lbl_stock.configure(text=f"{stk}", text_color=COLOR_PRIMARY if stk > 0 else "#FF6B6B")
+                self.filas_mostradas[i] = contenido
 
         self.label_paginas.configure(text=f"Viendo {start+1}-{end} de {total_items} resultados")
-        self.label_stats.configure(text=f"Base de datos: {len(self.inventario_json)} items")
+        self.label_stats.configure(text=f"Base de datos: {len(self.indice)} items")
         
         self.btn_prev.configure(state="normal" if self.pagina_actual > 0 else "disabled")
         self.btn_next.configure(state="normal" if end < total_items else "disabled")
@@ -249,29 +481,45 @@ class InventoryManager(ctk.CTk):
     def pagina_siguiente(self):
         self.pagina_actual += 1
         self.actualizar_interfaz()
+        self.volver_arriba()
 
     def pagina_anterior(self):
         self.pagina_actual -= 1
         self.actualizar_interfaz()
+        self.volver_arriba()
+
+    def volver_arriba(self):
+        """Lleva el scroll de la lista al inicio de la página"""
+        try:
+            self.scrollable_frame._parent_canvas.yview_moveto(0)
+        except Exception:
+            pass
+
+    def cambiar_por_pagina(self, valor):
+        """Cambia el tamaño de página manteniendo visible el primer item actual"""
+        primero = self.pagina_actual * self.items_por_pagina
+        self.items_por_pagina = int(valor)
+        self.pagina_actual = primero // self.items_por_pagina
+        self.actualizar_interfaz()
 
     def escanear_item(self):
         cod = self.entry_scan.get().strip()
         if cod in self.inventario_json:
-            self.inventario_json[cod]['stock'] -= 1
+            # Movimiento del libro de stock (como las ventas de barcode.py); luego se
+            # traen a memoria este y los que hayan registrado otros programas
+            try:
+                self.backend.ajustar_stock({cod: -1}, origen="inventory_manager")
+                self.backend.sincronizar_inventario(self.inventario_json)
+            except Exception as e:
+                messagebox.showerror("Error", str(e))
+                return
             self.entry_scan.delete(0, 'end')
             
             # Efecto visual de "salida confirmada"
             self.entry_scan.configure(border_color="#4ecb71")
             self.after(500, lambda: self.entry_scan.configure(border_color=COLOR_PRIMARY))
             
-            # Actualizar datos sin mover la página
-            query = self.entry_search.get().lower().strip()
-            if query:
-                self.items_filtrados = [(k, v) for k, v in self.inventario_json.items() 
-                                       if query in str(k).lower() or query in str(v.get('nombre', '')).lower()]
-            else:
-                self.items_filtrados = list(self.inventario_json.items())
-            
+            # El item filtrado es el mismo dict: basta redibujar la página
             self.actualizar_interfaz()
         else:
             self.entry_scan.configure(border_color="#ff6b6b")
@@ -279,43 +527,78 @@ class InventoryManager(ctk.CTk):
             messagebox.showwarning("No encontrado", f"El código {cod} no está en la base de datos.")
 
     def iniciar_importacion(self):
-        archivo = filedialog.askopenfilename(filetypes=[("Excel", "*.xlsx")])
+        archivo = filedialog.askopenfilename(filetypes=[("Excel / CSV", "*.xlsx *.xls *.csv"), ("Excel", "*.xlsx *.xls"), ("CSV", "*.csv")])
         if not archivo: return
         self.progress_bar.set(0.1)
         threading.Thread(target=self.proceso_importacion, args=(archivo,), daemon=True).start()
 
+    def reportar_progreso(self, fraccion, texto=None):
+        """Actualiza la barra (y el texto de importación) desde el hilo de trabajo"""
+        def aplicar():
+            self.progress_bar.set(fraccion)
+            if texto is not None:
+                self.label_importacion.configure(text=texto)
+        self.after(0, aplicar)
+
     def proceso_importacion(self, archivo):
         try:
-            df_raw = pd.read_excel(archivo, header=None)
-            col_id, col_glosa, col_stock, start_row = None, None, None, None
-            for i, row in df_raw.iterrows():
-                row_list = [str(val).strip() for val in row.values]
-                if COLUMNA_ID in row_list:
-                    col_id, col_glosa, start_row = row_list.index(COLUMNA_ID), row_list.index(COLUMNA_NOMBRE), i + 1
-                if COLUMNA_STOCK in row_list: col_stock = row_list.index(COLUMNA_STOCK)
-
-            if col_id is not None:
-                new_data = {}
-                for i in range(start_row, len(df_raw)):
-                    fila = df_raw.iloc[i]
-                    id_v = str(fila[col_id]).split('.')[0].strip()
-                    if id_v == 'nan' or id_v == '': continue
-                    try: stk = int(float(fila[col_stock])) if pd.notnull(fila[col_stock]) else 0
-                    except: stk = 0
-                    new_data[id_v] = {"nombre": str(fila[col_glosa]).strip(), "stock": stk}
-                
-                self.inventario_json = new_data
-                self.items_filtrados = list(self.inventario_json.items())
-                self.pagina_actual = 0
-                self.after(0, self.actualizar_interfaz)
-                self.guardar_json(silencioso=True)
+            t0 = time.perf_counter()
+            self.reportar_progreso(0.1, f"Leyendo {os.path.basename(archivo)}...")
+
+            def avisar(filas, avance):
+                fraccion = 0.1 + 0.8 * avance if avance is not None else 0.5
+                self.reportar_progreso(fraccion, f"Procesadas {filas} filas...")
+
+            new_data, total = importar_bloques(leer_bloques(archivo), avisar)
+            if new_data is None:
+                self.reportar_progreso(0, "")
+                self.after(0, lambda: messagebox.showwarning(
+                    "Importar", f"No se encontraron las columnas '{COLUMNA_ID}' y '{COLUMNA_NOMBRE}'."))
+                return
+
+            # Aplicar solo la diferencia contra lo guardado (releído ahora, por si
+            # barcode.py o bodega.py lo cambiaron): se conservan los vínculos de
+            # códigos de barras y los demás campos de cada item.
+            self.reportar_progreso(0.92, "Comparando con el inventario actual...")
+            actual = self.backend.cargar_inventario()
+            cambios, eliminados, dif = diferencias_inventario(actual, new_data)
+            self.backend.actualizar_items(cambios, eliminados)
+            actual.update(cambios)
+            for codigo in eliminados:
+                del actual[codigo]
+            self.inventario_json = actual
+            self.actualizar_indice(actual, cambios, eliminados)
+            self.after(0, self.refrescar_resultados)
+
+            segundos = max(time.perf_counter() - t0, 1e-6)
+            resumen = (f"{dif['agregados']} nuevos, {dif['modificados']} modificados, "
+                       f"{dif['eliminados']} eliminados, {dif['sin_cambios']} sin cambios")
+            velocidad = f"{total} filas en {segundos:.1f} s ({total / segundos:,.0f} filas/s)"
+            print(f"[Importar] {resumen}; {velocidad}")
+            self.reportar_progreso(1, f"{resumen}\n{velocidad}")
+            self.after(1500, lambda: self.progress_bar.set(0))
+            self.after(0, lambda: messagebox.showinfo("Importación completada", f"{resumen}.\n\n{velocidad}"))
         except Exception as e:
-            self.after(0, lambda: messagebox.showerror("Error", str(e)))
+            self.after(0, lambda msg=str(e): messagebox.showerror("Error", msg))
+
+    def actualizar_indice(self, inventario, cambios, eliminados):
+        """Aplica al índice de búsqueda los cambios de una importación"""
+        if len(cambios) + len(eliminados) > len(self.indice) // 4:
+            # Muchos cambios: es más rápido reconstruirlo
+            self.indice = indexar(inventario)
+            return
+        for codigo, datos in cambios.items():
+            self.indice.agregar(codigo, datos.get('nombre', ''))
+        for codigo in eliminados:
+            self.indice.eliminar(codigo)
+        # Items agregados por otro programa desde la última carga
+        for codigo, datos in inventario.items():
+            if codigo not in self.indice and not codigo.startswith('_') and isinstance(datos, dict):
+                self.indice.agregar(codigo, datos.get('nombre', ''))
 
     def guardar_json(self, silencioso=False):
         try:
-            with open(self.archivo_json, 'w', encoding='utf-8') as f:
-                json.dump(self.inventario_json, f, indent=4, ensure_ascii=False)
+            self.backend.guardar_inventario(self.inventario_json)
             if not silencioso: messagebox.showinfo("Guardado", "Base de datos sincronizada.")
         except Exception as e: messagebox.showerror("Error", str(e))
 
@@ -5,6 +5,10 @@ import customtkinter as ctk
 from PIL import Image
 import shutil
 import sys
+import time
+import queue
+import argparse
+import threading
 try:
     from PIL import ImageTk
 except Exception:
@@ -15,6 +19,14 @@ from datetime import datetime
 from pathlib import Path
 import tkinter.ttk as ttk
 
+# Módulos compartidos del proyecto (common_*.py en la raíz)
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_PROYECTO not in sys.path:
+    sys.path.insert(0, RAIZ_PROYECTO)
+from common_store import obtener_backend, DOCS_PATH
+from common_search import IndiceTexto
+from common_queue import ColaEscaneos, DrenadorCola, resolver
+
 # --- CONFIGURACIÓN DLL (preferir copia local junto al exe, luego detectar) ---
 pyzbar_path = None
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -81,6 +93,317 @@ ACCENT_COLOR = "#DA9CFF"
 BG_DARK = "#121212"
 FRAME_BG = "#1E1E1E"
 
+TAM_MINIATURA = (480, 270)
+ESPERA_SCAN = 1.8  # segundos sin aceptar otro código tras un escaneo
+
+
+FILAS_POR_TANDA = 400  # filas de la tabla global adjuntadas por ciclo de Tk (población incremental)
+
+
+def poner_ultimo(cola, dato):
+    """Deja en una cola de tamaño 1 solo el dato más reciente (el anterior se descarta)."""
+    try:
+        cola.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        cola.put_nowait(dato)
+    except queue.Full:
+        pass
+
+
+class LocalizadorCodigos:
+    """Decodifica solo las zonas del frame donde puede haber un código.
+
+    Sobre una copia reducida en gris busca zonas con mucho gradiente en una
+    sola dirección (barras), y pasa a pyzbar solo esos recortes a resolución
+    completa. La zona donde se leyó el último código se prueba primero en
+    los frames siguientes. Si el frame casi no cambió desde la última
+    lectura, no se decodifica nada; un frame sin lectura no se recuerda, así
+    una etiqueta quieta que al principio salió borrosa se sigue probando. Cada `respaldo_cada` frames sin
+    candidatos se decodifica el frame completo a media resolución (códigos
+    QR o muy grandes).
+    """
+
+    def __init__(self, escala=0.25, umbral_cambio=2.0, respaldo_cada=8, max_regiones=3):
+        self.escala = escala
+        self.umbral_cambio = umbral_cambio  # diferencia media (0-255) para considerar que el frame cambió
+        self.respaldo_cada = respaldo_cada
+        self.max_regiones = max_regiones
+        self._huella = None      # miniatura gris del último frame con lectura
+        self._roi = None         # (x, y, w, h) a resolución completa de la última lectura
+        self._frames_sin_roi = 0
+        self._sin_lectura = 0
+
+    def regiones(self, gris, ancho, alto, max_regiones=None):
+        """Rectángulos candidatos (resolución completa) a partir del frame reducido."""
+        gx = cv2.Sobel(gris, cv2.CV_32F, 1, 0, ksize=-1)
+        gy = cv2.Sobel(gris, cv2.CV_32F, 0, 1, ksize=-1)
+        # Barras verticales u horizontales: gradiente fuerte en un solo eje
+        grad = cv2.absdiff(cv2.convertScaleAbs(gx), cv2.convertScaleAbs(gy))
+        grad = cv2.blur(grad, (5, 5))
+        umbral, binaria = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        if umbral < 40:
+            _, binaria = cv2.threshold(grad, 40, 255, cv2.THRESH_BINARY)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+        binaria = cv2.morphologyEx(binaria, cv2.MORPH_CLOSE, kernel)
+        binaria = cv2.dilate(cv2.erode(binaria, None, iterations=2), None, iterations=2)
+        contornos = cv2.findContours(binaria, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        area_min = 0.002 * gris.shape[0] * gris.shape[1]
+        cajas = sorted((cv2.boundingRect(c) for c in contornos if cv2.contourArea(c) >= area_min),
+                       key=lambda r: r[2] * r[3], reverse=True)[:max_regiones or self.max_regiones]
+        return [self._ampliar((x / self.escala, y / self.escala, w / self.escala, h / self.escala), ancho, alto)
+                for x, y, w, h in cajas]
+
+    @staticmethod
+    def _ampliar(rect, ancho, alto, margen=0.15):
+        x, y, w, h = rect
+        mx, my = w * margen + 8, h * margen + 8
+        x0, y0 = max(0, int(x - mx)), max(0, int(y - my))
+        x1, y1 = min(ancho, int(x + w + mx)), min(alto, int(y + h + my))
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def decodificar(self, frame, todos=False):
+        """Símbolos de pyzbar encontrados, o None si el frame no cambió y no se analizó.
+
+        Con `todos` se decodifican todas las regiones candidatas (varias
+        etiquetas en el mismo frame) en vez de parar en la primera lectura.
+        """
+        gris = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        alto, ancho = gris.shape[:2]
+        reducido = cv2.resize(gris, None, fx=self.escala, fy=self.escala, interpolation=cv2.INTER_AREA)
+        huella = cv2.resize(reducido, (64, 36), interpolation=cv2.INTER_AREA)
+        if self._huella is not None and float(cv2.absdiff(huella, self._huella).mean()) < self.umbral_cambio:
+            return None
+
+        candidatos = [self._roi] if self._roi else []
+        candidatos += self.regiones(reducido, ancho, alto, max_regiones=12 if todos else None)
+        encontrados = []
+        for x, y, w, h in candidatos:
+            if w < 8 or h < 8:
+                continue
+            simbolos = decode(gris[y:y + h, x:x + w])
+            if simbolos:
+                self._roi = self._ampliar((x, y, w, h), ancho, alto, margen=0.1)
+                self._frames_sin_roi = 0
+                self._sin_lectura = 0
+                encontrados.extend(simbolos)
+                if not todos:
+                    break
+        if encontrados:
+            self._huella = huella
+            return encontrados
+        if self._roi:
+            self._frames_sin_roi += 1
+            if self._frames_sin_roi > 15:
+                self._roi = None
+
+        self._sin_lectura += 1
+        if self._sin_lectura % self.respaldo_cada == 0:
+            simbolos = decode(cv2.resize(gris, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA))
+            if simbolos:
+                self._huella = huella
+            return simbolos
+        return []
+
+
+class PipelineCamara:
+    """Captura y decodificación de la cámara fuera del hilo de Tk.
+
+    Un hilo lee frames y prepara la miniatura; otro decodifica con pyzbar.
+    Se comunican por colas de tamaño 1 en las que el último frame gana, así
+    una decodificación lenta nunca retrasa la imagen ni acumula frames
+    viejos. Al hilo de Tk solo llegan miniaturas terminadas (PIL) y códigos.
+    """
+
+    def __init__(self, cap, espera_scan=ESPERA_SCAN):
+        self.cap = cap
+        self.espera_scan = espera_scan
+        # Modo ráfaga: todos los códigos distintos del frame, con espera por código
+        self.modo_rafaga = False
+        self.localizador = LocalizadorCodigos()
+        self.frames = queue.Queue(maxsize=1)      # último frame a decodificar
+        self.miniaturas = queue.Queue(maxsize=1)  # última miniatura lista para mostrar
+        self.codigos = queue.Queue(maxsize=64)    # lotes [códigos] decodificados pendientes para Tk (uno por frame)
+        self._detener = threading.Event()
+        self._lock = threading.Lock()
+        self._hilos = []
+        self._contadores = {'capturados': 0, 'decodificados': 0, 'omitidos': 0, 'latencia_total': 0.0}
+        self._desde = time.monotonic()
+
+    def iniciar(self):
+        for destino, nombre in ((self._capturar, "Captura"), (self._decodificar, "Decodificador")):
+            hilo = threading.Thread(target=destino, name=nombre, daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self):
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout=2)
+
+    def medir(self):
+        """(fps de captura, fps de decodificación, latencia media en ms, frames sin cambios) desde la última medición."""
+        with self._lock:
+            ahora = time.monotonic()
+            dt = max(ahora - self._desde, 1e-6)
+            c = self._contadores
+            res = (c['capturados'] / dt, c['decodificados'] / dt,
+                   c['latencia_total'] * 1000 / c['decodificados'] if c['decodificados'] else 0.0,
+                   c['omitidos'])
+            self._contadores = {'capturados': 0, 'decodificados': 0, 'omitidos': 0, 'latencia_total': 0.0}
+            self._desde = ahora
+            return res
+
+    def _capturar(self):
+        while not self._detener.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.05)
+                continue
+            poner_ultimo(self.frames, frame)
+            frame_disp = cv2.resize(frame, TAM_MINIATURA)
+            poner_ultimo(self.miniaturas, Image.fromarray(cv2.cvtColor(frame_disp, cv2.COLOR_BGR2RGB)))
+            with self._lock:
+                self._contadores['capturados'] += 1
+
+    def _decodificar(self):
+        ultimo_scan = 0.0
+        aceptados = {}  # {codigo: momento en que se aceptó} (modo ráfaga)
+        while not self._detener.is_set():
+            try:
+                frame = self.frames.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            rafaga = self.modo_rafaga
+            if not rafaga and time.monotonic() - ultimo_scan < self.espera_scan:
+                continue
+            t0 = time.perf_counter()
+            simbolos = self.localizador.decodificar(frame, todos=rafaga)
+            latencia = time.perf_counter() - t0
+            with self._lock:
+                if simbolos is None:
+                    self._contadores['omitidos'] += 1
+                    continue
+                self._contadores['decodificados'] += 1
+                self._contadores['latencia_total'] += latencia
+            ahora = time.monotonic()
+            lote = []
+            for obj in simbolos:
+                codigo = obj.data.decode('utf-8')
+                if not rafaga:
+                    lote.append(codigo)
+                    ultimo_scan = ahora
+                    break
+                # Cada código tiene su propia ventana de espera
+                if codigo not in lote and ahora - aceptados.get(codigo, 0.0) >= self.espera_scan:
+                    aceptados[codigo] = ahora
+                    lote.append(codigo)
+            if rafaga and len(aceptados) > 500:
+                aceptados = {c: t for c, t in aceptados.items() if ahora - t < self.espera_scan}
+            if lote:
+                try:
+                    self.codigos.put_nowait(lote)
+                except queue.Full:
+                    print(f"[Cámara] Cola de códigos llena; se descartan {len(lote)} escaneos")
+
+class EstacionSinInterfaz:
+    """Estación de escaneo sin ventana para terminales baratas.
+
+    Lee códigos de una cámara, de un archivo de video o de stdin (lectores
+    tipo teclado, un código por línea), los resuelve con `_mapeo_barras` y
+    los deja en la cola durable (common_queue.ColaEscaneos). El inventario
+    los recibe por lotes desde el drenador (`--drenar` o
+    `python common_queue.py drenar 2`), así varias estaciones comparten una
+    sola máquina y un solo inventario. Los códigos aún no vinculados quedan
+    en la cola y se resuelven al drenar cuando alguien los vincule.
+    """
+
+    def __init__(self, backend, cola, modo="venta", estacion=None, espera_scan=ESPERA_SCAN):
+        self.backend = backend
+        self.cola = cola
+        self.modo = modo
+        self.estacion = estacion or f"estacion-{os.getpid()}"
+        self.espera_scan = espera_scan
+        # Índice de códigos de barras (se relee solo si cambia): sin cargar el catálogo
+        self.barras = backend.indice_barras()
+        self.aceptados = {}  # {barcode: momento aceptado} (espera por código)
+
+    def registrar(self, barcode):
+        """Encola un escaneo (resuelto si el código ya está vinculado)"""
+        codigo, factor = resolver(self.barras, barcode)
+        self.cola.agregar(barcode, self.modo, codigo, factor, self.estacion)
+        print(f"[{self.estacion}] {barcode} -> {codigo or 'SIN VINCULAR'} x{factor} ({self.modo})")
+
+    def aceptar(self, barcode, ahora):
+        """Espera por código: el mismo código no se repite antes de `espera_scan` segundos"""
+        if ahora - self.aceptados.get(barcode, float("-inf")) < self.espera_scan:
+            return False
+        self.aceptados[barcode] = ahora
+        if len(self.aceptados) > 500:
+            self.aceptados = {c: t for c, t in self.aceptados.items() if ahora - t < self.espera_scan}
+        return True
+
+    def desde_stdin(self):
+        """Un código por línea (lector tipo teclado o tubería); termina con EOF"""
+        for linea in sys.stdin:
+            barcode = linea.strip()
+            if barcode:
+                self.registrar(barcode)
+
+    def desde_video(self, fuente):
+        """Cámara (índice) o archivo de video; en archivos la espera usa el tiempo del video"""
+        es_archivo = not isinstance(fuente, int)
+        cap = cv2.VideoCapture(fuente)
+        if not cap.isOpened():
+            print(f"[Estación] No se pudo abrir la fuente de video {fuente}")
+            return
+        localizador = LocalizadorCodigos()
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    if es_archivo:
+                        break
+                    time.sleep(0.05)
+                    continue
+                ahora = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 if es_archivo else time.monotonic()
+                for obj in localizador.decodificar(frame, todos=True) or []:
+                    barcode = obj.data.decode('utf-8')
+                    if self.aceptar(barcode, ahora):
+                        self.registrar(barcode)
+        finally:
+            cap.release()
+
+
+def main_sin_interfaz(args):
+    backend = obtener_backend(DOCS_PATH)
+    cola = ColaEscaneos()
+    drenador = None
+    if args.drenar:
+        drenador = DrenadorCola(cola, backend, intervalo=args.drenar)
+        drenador.start()
+    estacion = EstacionSinInterfaz(backend, cola, modo=args.modo, estacion=args.estacion)
+    print(f"[Estación] {estacion.estacion} leyendo de {args.fuente} ({args.modo})")
+    try:
+        if args.fuente == "stdin":
+            estacion.desde_stdin()
+        else:
+            estacion.desde_video(int(args.fuente) if args.fuente.isdigit() else args.fuente)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if drenador:
+            drenador.detener()
+            drenador.join(5.0)
+            # Último drenado con lo que haya quedado en la cola
+            cola.drenar(backend)
+            backend.compactar()
+        estados, sin_resolver = cola.resumen()
+        print(f"[Estación] Pendientes en cola: {estados.get(0, 0)} ({sin_resolver} sin vincular), "
+              f"apartados sin item: {estados.get(3, 0)}")
+
+
 class BodegaStorageMap(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -133,13 +456,33 @@ class BodegaStorageMap(ctk.CTk):
         storage_dir = Path.home() / "Documents" / "Yuuruii" / "AgustinaFalcon"
         storage_dir.mkdir(parents=True, exist_ok=True)
         self.ruta_json = storage_dir / "inventario_global.json"
-        self.inventario = self.cargar_datos()
+        self.backend = obtener_backend(str(storage_dir))
+        # Códigos de barras desde su propio índice: se puede escanear antes de
+        # que termine de cargarse el catálogo completo (hilo de fondo)
+        self.barras = self.backend.indice_barras()
+        self.inventario = {"_mapeo_barras": {}}
+        self.inventario_listo = False
+        self.inventario_cargado = queue.Queue(maxsize=1)
+        self.indice = IndiceTexto()  # búsqueda por código/nombre de la tabla global
         self.carrito = {} 
-        self.ultimo_scan_time = 0
+        # Filas de las tablas por clave (iid = ID interno) con sus valores actuales
+        self.filas_global = {}
+        self.filas_carrito = {}
+        self.visibles_global = []     # códigos adjuntos en la tabla global, en orden
+        self.pendientes_global = None  # resultados aún por adjuntar (None = completo)
+        self.after_filtro = None
+        self.after_poblado = None
+        self.img_camara = None
+        self.procesando_scan = False
+        self.ultimo_stats = time.monotonic()
 
         self.setup_ui()
         
         self.cap = cv2.VideoCapture(1)
+        self.pipeline = PipelineCamara(self.cap)
+        self.pipeline.iniciar()
+        self.protocol("WM_DELETE_WINDOW", self.cerrar)
+        threading.Thread(target=self.cargar_inventario_fondo, daemon=True).start()
         self.bucle_video()
 
     def setup_ui(self):
@@ -154,6 +497,10 @@ class BodegaStorageMap(ctk.CTk):
         self.lbl_camara = ctk.CTkLabel(self.panel_izq, text="")
         self.lbl_camara.pack(pady=10)
 
+        # Estadísticas de cámara sobre la imagen
+        self.lbl_stats_camara = ctk.CTkLabel(self.panel_izq, text="", font=("Consolas", 10), text_color=ACCENT_COLOR, fg_color="#000000", corner_radius=4)
+        self.lbl_stats_camara.place(in_=self.lbl_camara, x=6, y=6)
+
         self.busqueda_var = ctk.StringVar()
         self.busqueda_var.trace_add("write", self.filtrar_tabla_global)
         self.entry_busqueda = ctk.CTkEntry(self.panel_izq, placeholder_text=" 🔍 Buscar...", height=40, border_color=ACCENT_COLOR, textvariable=self.busqueda_var)
@@ -168,6 +515,10 @@ class BodegaStorageMap(ctk.CTk):
         self.panel_der.grid(row=0, column=1, sticky="nsew", padx=20, pady=20)
 
         ctk.CTkLabel(self.panel_der, text="LISTA DE ESCANEO", font=("Segoe UI", 22, "bold"), text_color=ACCENT_COLOR).pack(pady=15)
+
+        # Modo ráfaga para recepción: varios códigos por frame
+        self.switch_rafaga = ctk.CTkSwitch(self.panel_der, text="Modo ráfaga (varios códigos a la vez)", progress_color=ACCENT_COLOR, command=self.cambiar_modo_rafaga)
+        self.switch_rafaga.pack(pady=(0, 5))
         
         self.tabla_carrito = self.crear_tabla(self.panel_der, ["ID Interno", "Producto", "Cant."])
         self.tabla_carrito.pack(fill="both", expand=True, padx=20, pady=10)
@@ -248,7 +599,7 @@ class BodegaStorageMap(ctk.CTk):
         self.btn_in.pack(side="left", fill="both", expand=True, padx=3)
         
         # Cargar inventario en la UI al inicio
-        self.filtrar_tabla_global()
+        self.aplicar_filtro_global()
 
     def estilizar_tablas(self):
         style = ttk.Style()
@@ -266,49 +617,114 @@ class BodegaStorageMap(ctk.CTk):
 
     def cargar_datos(self):
         try:
-            if os.path.exists(self.ruta_json):
-                with open(self.ruta_json, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if "_mapeo_barras" not in data: data["_mapeo_barras"] = {}
-                    return data
-            return {"_mapeo_barras": {}}
+            data = self.backend.cargar_inventario()
+            if "_mapeo_barras" not in data: data["_mapeo_barras"] = {}
+            return data
         except: return {"_mapeo_barras": {}}
 
-    def guardar_datos(self):
-        with open(self.ruta_json, 'w', encoding='utf-8') as f:
-            json.dump(self.inventario, f, indent=4, ensure_ascii=False)
-        self.filtrar_tabla_global()
+    def cargar_inventario_fondo(self):
+        """Carga e indexa el catálogo fuera del hilo de Tk (lo recibe bucle_video)"""
+        t0 = time.perf_counter()
+        data = self.cargar_datos()
+        indice = IndiceTexto()
+        indice.cargar((k, v.get('nombre', '')) for k, v in data.items()
+                      if not k.startswith('_') and isinstance(v, dict))
+        print(f"[Inventario] {len(indice)} items cargados en {time.perf_counter() - t0:.2f} s")
+        self.inventario_cargado.put((data, indice))
+
+    def recibir_inventario(self, data, indice):
+        """Reemplaza el inventario provisorio por el cargado (conserva lo creado mientras tanto)"""
+        for id_int, item in self.inventario.items():
+            if not id_int.startswith("_") and id_int not in data:
+                data[id_int] = item
+                indice.agregar(id_int, item.get('nombre', ''))
+        self.inventario = data
+        self.indice = indice
+        self.inventario_listo = True
+        self.aplicar_filtro_global()
 
     def bucle_video(self):
-        ret, frame = self.cap.read()
-        if ret:
-            ahora = datetime.now().timestamp()
-            if ahora - self.ultimo_scan_time > 1.8:
-                for obj in decode(frame):
-                    barcode = obj.data.decode('utf-8')
-                    self.procesar_barcode(barcode)
-                    self.ultimo_scan_time = ahora
-                    break
-            frame_disp = cv2.resize(frame, (480, 270))
-            img = Image.fromarray(cv2.cvtColor(frame_disp, cv2.COLOR_BGR2RGB))
-            ctk_img = ctk.CTkImage(img, size=(480, 270))
-            self.lbl_camara.configure(image=ctk_img, text="")
-        self.after(10, self.bucle_video)
-
-    def procesar_barcode(self, barcode):
-        mapeo = self.inventario.get("_mapeo_barras", {})
+        """Muestra la última miniatura y procesa los códigos recibidos (hilo de Tk)"""
+        try:
+            img = self.pipeline.miniaturas.get_nowait()
+        except queue.Empty:
+            img = None
+        if img is not None:
+            if self.img_camara is None:
+                self.img_camara = ctk.CTkImage(img, size=TAM_MINIATURA)
+                self.lbl_camara.configure(image=self.img_camara, text="")
+            else:
+                self.img_camara.configure(light_image=img)
+
+        if not self.inventario_listo:
+            try:
+                self.recibir_inventario(*self.inventario_cargado.get_nowait())
+            except queue.Empty:
+                pass
+
+        # Un diálogo abierto por procesar_barcode no debe abrir otro encima
+        if not self.procesando_scan:
+            self.procesando_scan = True
+            hubo_cambios = False
+            try:
+                while True:
+                    try:
+                        lote = self.pipeline.codigos.get_nowait()
+                    except queue.Empty:
+                        break
+                    for barcode in lote:
+                        hubo_cambios |= self.procesar_barcode(barcode, redibujar=False)
+            finally:
+                self.procesando_scan = False
+                # Un solo redibujado del carrito por todos los códigos recibidos
+                if hubo_cambios:
+                    self.actualizar_carrito_visual()
+
+        ahora = time.monotonic()
+        if ahora - self.ultimo_stats >= 0.5:
+            self.ultimo_stats = ahora
+            fps_cap, fps_dec, latencia, omitidos = self.pipeline.medir()
+            self.lbl_stats_camara.configure(text=f" Captura {fps_cap:4.1f} fps | Decod. {fps_dec:4.1f} fps | {latencia:5.1f} ms | {omitidos} sin cambios ")
+        self.after(15, self.bucle_video)
+
+    def cambiar_modo_rafaga(self):
+        """Activa/desactiva la lectura de todos los códigos del frame"""
+        self.pipeline.modo_rafaga = bool(self.switch_rafaga.get())
+        print(f"[Cámara] Modo ráfaga {'activado' if self.pipeline.modo_rafaga else 'desactivado'}")
+
+    def cerrar(self):
+        """Detiene los hilos de cámara y libera el dispositivo"""
+        try:
+            self.pipeline.detener()
+            self.cap.release()
+        except Exception as e:
+            print(f"[Cámara] Error al cerrar: {e}")
+        try:
+            self.backend.compactar()
+        except Exception as e:
+            print(f"[Store] Error al compactar movimientos de stock: {e}")
+        self.destroy()
+
+    def procesar_barcode(self, barcode, redibujar=True):
+        """Suma el código al carrito; devuelve True si el carrito cambió sin redibujarse"""
+        vinculo = self.barras.get(barcode)
         
-        if barcode in mapeo:
-            vinculo = mapeo[barcode]
+        if vinculo:
             id_int = vinculo["id_interno"]
             factor = vinculo["factor"]
             
-            nombre = self.inventario[id_int]['nombre']
+            # El nombre viene en el índice; el del catálogo (si ya cargó) es el más reciente
+            item = self.inventario.get(id_int)
+            nombre = item['nombre'] if isinstance(item, dict) else (vinculo.get("nombre") or id_int)
             if id_int in self.carrito: self.carrito[id_int]['cant'] += factor
             else: self.carrito[id_int] = {'nombre': nombre, 'cant': factor}
-            self.actualizar_carrito_visual()
+            if redibujar:
+                self.actualizar_carrito_visual()
+                return False
+            return True
         else:
             self.gestionar_nuevo_desconocido(barcode)
+            return False
 
     def gestionar_nuevo_desconocido(self, barcode):
         # Opción 1: Vincular a existente o crear nuevo item
@@ -316,7 +732,9 @@ class BodegaStorageMap(ctk.CTk):
         
         if opcion == "1":
             id_int = ctk.CTkInputDialog(text="Ingrese el ID Interno existente:", title="Vincular").get_input()
-            if id_int in self.inventario:
+            if not self.inventario_listo:
+                print("El inventario aún se está cargando; intente de nuevo en unos segundos.")
+            elif id_int in self.inventario:
                 self.vincular_barras_a_id(barcode, id_int)
             else:
                 print("ID no encontrado.")
@@ -327,19 +745,34 @@ class BodegaStorageMap(ctk.CTk):
                 nombre = ctk.CTkInputDialog(text="Nombre del nuevo producto:", title="Nombre").get_input()
                 if nombre:
                     self.inventario[id_int] = {"nombre": nombre, "stock": 0}
+                    self.backend.actualizar_item(id_int, self.inventario[id_int])
+                    self.indice.agregar(id_int, nombre)
+                    self.aplicar_filtro_global()
                     self.vincular_barras_a_id(barcode, id_int)
 
     def vincular_barras_a_id(self, barcode, id_int):
         factor = ctk.CTkInputDialog(text=f"¿Cuántas unidades representa este código de barras para el ID {id_int}?\n(Ej: 1 unidad, 50 para caja, 1000 para bulto):", title="Factor").get_input()
         if factor and factor.isdigit():
             self.inventario["_mapeo_barras"][barcode] = {"id_interno": id_int, "factor": int(factor)}
-            self.guardar_datos()
+            self.backend.guardar_mapeo_barra(barcode, id_int, int(factor))
+            self.barras.agregar(barcode, id_int, int(factor), self.inventario.get(id_int, {}).get('nombre', ''))
             self.procesar_barcode(barcode)
 
     def actualizar_carrito_visual(self):
-        for i in self.tabla_carrito.get_children(): self.tabla_carrito.delete(i)
+        """Sincroniza la tabla del carrito por clave: solo toca las filas que cambiaron"""
+        tabla, filas = self.tabla_carrito, self.filas_carrito
+        quitados = [id_int for id_int in filas if id_int not in self.carrito]
+        if quitados:
+            tabla.delete(*quitados)
+            for id_int in quitados: del filas[id_int]
         for id_int, info in self.carrito.items():
-            self.tabla_carrito.insert("", "end", values=(id_int, info['nombre'], info['cant']))
+            valores = (id_int, info['nombre'], info['cant'])
+            previo = filas.get(id_int)
+            if previo is None:
+                tabla.insert("", "end", iid=id_int, values=valores)
+            elif previo != valores:
+                tabla.item(id_int, values=valores)
+            filas[id_int] = valores
 
     def eliminar_del_carrito(self):
         """Elimina el item seleccionado del carrito sin afectar el inventario"""
@@ -401,22 +834,108 @@ class BodegaStorageMap(ctk.CTk):
                     print(f"Cantidad actualizada a {nueva_cant} para {valores[1]}")
 
     def filtrar_tabla_global(self, *args):
-        query = self.busqueda_var.get().lower()
-        for i in self.tabla_global.get_children(): self.tabla_global.delete(i)
-        for id_int, data in self.inventario.items():
-            if id_int.startswith("_"): continue
-            if query in id_int.lower() or query in data.get('nombre', '').lower():
-                self.tabla_global.insert("", "end", values=(id_int, data['nombre'], data.get('stock', 0)))
+        """Al escribir: espera una pausa breve antes de filtrar"""
+        if self.after_filtro:
+            self.after_cancel(self.after_filtro)
+        self.after_filtro = self.after(120, self.aplicar_filtro_global)
+
+    def aplicar_filtro_global(self):
+        """Muestra en la tabla global los resultados de la búsqueda actual.
+
+        Las filas se crean una vez por ID interno y luego solo se separan
+        (detach) o vuelven a adjuntar (move). Si la nueva búsqueda restringe
+        la anterior (se siguió escribiendo), basta con separar las que sobran;
+        si no, los resultados se adjuntan por tandas sin bloquear la interfaz.
+        """
+        self.after_filtro = None
+        if self.after_poblado:
+            self.after_cancel(self.after_poblado)
+            self.after_poblado = None
+        codigos = [c for c in self.indice.buscar(self.busqueda_var.get()) if c in self.inventario]
+        tabla = self.tabla_global
+        if self.pendientes_global is None:
+            nuevos = set(codigos)
+            visibles = set(self.visibles_global)
+            if nuevos <= visibles:
+                sobran = [c for c in self.visibles_global if c not in nuevos]
+                if sobran:
+                    tabla.detach(*sobran)
+                self.visibles_global = codigos
+                return
+        if self.visibles_global:
+            tabla.detach(*self.visibles_global)
+        self.visibles_global = []
+        self.pendientes_global = codigos
+        self.poblar_tabla_global()
+
+    def poblar_tabla_global(self):
+        """Adjunta la siguiente tanda de resultados pendientes"""
+        self.after_poblado = None
+        pendientes = self.pendientes_global
+        if pendientes is None:
+            return
+        inicio = len(self.visibles_global)
+        tanda = pendientes[inicio:inicio + FILAS_POR_TANDA]
+        for id_int in tanda:
+            self.mostrar_fila_global(id_int)
+        self.visibles_global.extend(tanda)
+        if len(self.visibles_global) < len(pendientes):
+            self.after_poblado = self.after(1, self.poblar_tabla_global)
+        else:
+            self.pendientes_global = None
+
+    def valores_global(self, id_int):
+        data = self.inventario[id_int]
+        return (id_int, data.get('nombre', ''), data.get('stock', 0))
+
+    def mostrar_fila_global(self, id_int):
+        """Crea la fila del item o la vuelve a adjuntar al final (actualizada)"""
+        tabla = self.tabla_global
+        valores = self.valores_global(id_int)
+        previo = self.filas_global.get(id_int)
+        if previo is None:
+            tabla.insert("", "end", iid=id_int, values=valores)
+        else:
+            if previo != valores:
+                tabla.item(id_int, values=valores)
+            tabla.move(id_int, "", "end")
+        self.filas_global[id_int] = valores
+
+    def actualizar_filas_global(self, codigos):
+        """Refresca en su lugar las filas ya creadas de esos items"""
+        for id_int in codigos:
+            previo = self.filas_global.get(id_int)
+            if previo is None or id_int not in self.inventario:
+                continue
+            valores = self.valores_global(id_int)
+            if valores != previo:
+                self.tabla_global.item(id_int, values=valores)
+                self.filas_global[id_int] = valores
 
     def finalizar(self, modo):
         if not self.carrito: return
-        for id_int, info in self.carrito.items():
-            stock_actual = self.inventario[id_int].get('stock', 0)
-            if modo == "venta": self.inventario[id_int]['stock'] = stock_actual - info['cant']
-            else: self.inventario[id_int]['stock'] = stock_actual + info['cant']
-        self.guardar_datos()
+        # Un solo ajuste relativo de stock por item (UPDATE por fila en SQLite)
+        signo = -1 if modo == "venta" else 1
+        deltas = {id_int: signo * info['cant'] for id_int, info in self.carrito.items()}
+        # Un movimiento en el libro de stock (o una transacción SQLite), sin reescribir el inventario
+        nuevos = self.backend.ajustar_stock(deltas, origen=f"barcode:{modo}")
+        for id_int, stock in nuevos.items():
+            if id_int in self.inventario:
+                self.inventario[id_int]['stock'] = stock
+        self.actualizar_filas_global(nuevos)
         self.carrito = {}; self.actualizar_carrito_visual()
 
 if __name__ == "__main__":
-    app = BodegaStorageMap()
-    app.mainloop()
\ No newline at end of file
+    # Uso: barcode.py [--sin-gui --fuente stdin|<índice cámara>|<video> --modo venta|entrada --estacion NOMBRE --drenar SEG]
+    parser = argparse.ArgumentParser(description="Agustina Falcon | Escaneo de códigos de barras")
+    parser.add_argument("--sin-gui", action="store_true", help="estación de escaneo sin ventana (cola durable)")
+    parser.add_argument("--fuente", default="stdin", help="stdin, índice de cámara o ruta de un video")
+    parser.add_argument("--modo", choices=["venta", "entrada"], default="venta")
+    parser.add_argument("--estacion", default=None, help="nombre de la estación en la cola")
+    parser.add_argument("--drenar", type=float, default=0, help="drenar también la cola al inventario cada SEG segundos")
+    args = parser.parse_args()
+    if args.sin_gui:
+        main_sin_interfaz(args)
+    else:
+        app = BodegaStorageMap()
+        app.mainloop()
\ No newline at end of file
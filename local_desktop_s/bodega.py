@@ -2,15 +2,27 @@ import sys
 import json
 import os
 import shutil
+import bisect
+import threading
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QGraphicsView, QGraphicsScene, 
                              QGraphicsEllipseItem, QVBoxLayout, QHBoxLayout, QWidget, 
                              QPushButton, QInputDialog, QLineEdit, QLabel, QListWidget, 
                              QMessageBox, QCompleter, QFileDialog, QSpinBox, QComboBox,
-                             QDialog, QFormLayout, QTabWidget, QListWidgetItem)
-from PyQt6.QtGui import QPixmap, QPainter, QColor, QWheelEvent, QIcon
-from PyQt6.QtCore import Qt, QRectF, QStringListModel, QPoint, QPointF
+                             QDialog, QFormLayout, QTabWidget, QListWidgetItem, QListView,
+                             QGraphicsPathItem, QGraphicsSimpleTextItem)
+from PyQt6.QtGui import QPixmap, QPainter, QColor, QWheelEvent, QIcon, QPainterPath, QPen
+from PyQt6.QtCore import (Qt, QRectF, QStringListModel, QPoint, QPointF,
+                          QAbstractListModel, QModelIndex)
 from datetime import datetime
 
+# Módulos compartidos del proyecto (common_*.py en la raíz)
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_PROYECTO not in sys.path:
+    sys.path.insert(0, RAIZ_PROYECTO)
+from common_store import AlmacenBodegas, ColaGuardado, obtener_backend, escribir_json_atomico
+from common_tiles import asegurar_piramide
+from common_route import planificar_recorrido, ubicaciones_desde_almacen
+
 # --- CONFIGURACIÓN DE RUTAS ---
 DOCS_PATH = os.path.join(os.path.expanduser("~"), "Documents", "Yuuruii", "AgustinaFalcon")
 GRAPHICS_PATH = os.path.join(DOCS_PATH, "graphics")
@@ -60,6 +72,126 @@ class EstantePoint(QGraphicsEllipseItem):
         self.radio = nuevo_radio
         self.setRect(-nuevo_radio, -nuevo_radio, nuevo_radio*2, nuevo_radio*2)
 
+class ModeloInventario(QAbstractListModel):
+    """Modelo virtual del inventario general para un QListView.
+
+    La vista solo pide las filas visibles y el texto de cada fila se calcula
+    al pintarla (y se cachea). La asignación a repisas sale del índice del
+    almacén; `actualizar()` emite dataChanged solo para las filas ya
+    mostradas cuyo nombre, stock o repisas cambiaron.
+    """
+
+    def __init__(self, inventario, almacen, parent=None):
+        super().__init__(parent)
+        self.inventario = inventario
+        self.almacen = almacen
+        self._codigos = []      # códigos ordenados (una fila por código)
+        self._cache = {}        # {codigo: (firma, display, tooltip)}
+        self._marcados = set()  # códigos editados en el inventario desde la última actualización
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._codigos)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._codigos):
+            return None
+        if role not in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole):
+            return None
+        code = self._codigos[index.row()]
+        entrada = self._cache.get(code)
+        if entrada is None:
+            entrada = self._renderizar(code)
+            self._cache[code] = entrada
+        return entrada[1] if role == Qt.ItemDataRole.DisplayRole else entrada[2]
+
+    def _firma(self, code):
+        data = self.inventario.get(code, {})
+        repisas = tuple(est for _, _, est in self.almacen.ubicaciones_codigo(code, refrescar=False))
+        return (data.get('nombre', ''), data.get('stock', 0), repisas)
+
+    def _renderizar(self, code, firma=None):
+        nombre, stock, repisas = firma or self._firma(code)
+        if repisas:
+            estado = f"✓ Asignado ({len(repisas)} repisa/s)"
+            tooltip = f"{code} | {nombre} | Stock: {stock}\nAsignado a: {', '.join(r or 'desconocida' for r in repisas)}"
+        else:
+            estado = "⊘ Por asignar"
+            tooltip = f"{code} | {nombre} | Stock: {stock}\nNo asignado a ninguna repisa"
+        return ((nombre, stock, repisas), f"{code} | {nombre} | {stock} | {estado}", tooltip)
+
+    def codigo_en(self, fila):
+        """Código mostrado en una fila (None si la fila no existe)."""
+        return self._codigos[fila] if 0 <= fila < len(self._codigos) else None
+
+    def fila_de(self, code):
+        i = bisect.bisect_left(self._codigos, code)
+        return i if i < len(self._codigos) and self._codigos[i] == code else None
+
+    def recargar(self, inventario=None):
+        """Reconstruye el modelo completo (al inicio o con el botón Actualizar)."""
+        self.beginResetModel()
+        if inventario is not None:
+            self.inventario = inventario
+        self._codigos = sorted(k for k in self.inventario if not str(k).startswith('_'))
+        self._cache.clear()
+        self._marcados.clear()
+        self.almacen.refrescar()
+        self.almacen.tomar_codigos_tocados()
+        self.endResetModel()
+
+    def insertar(self, code):
+        """Agrega la fila de un item nuevo en su posición ordenada."""
+        if str(code).startswith('_') or self.fila_de(code) is not None:
+            return
+        i = bisect.bisect_left(self._codigos, code)
+        self.beginInsertRows(QModelIndex(), i, i)
+        self._codigos.insert(i, code)
+        self.endInsertRows()
+
+    def eliminar(self, code):
+        """Quita la fila de un item eliminado del inventario."""
+        i = self.fila_de(code)
+        if i is None:
+            return
+        self.beginRemoveRows(QModelIndex(), i, i)
+        self._codigos.pop(i)
+        self._cache.pop(code, None)
+        self.endRemoveRows()
+
+    def marcar(self, code):
+        """Indica que el nombre o stock de un item cambió."""
+        self._marcados.add(code)
+
+    def actualizar(self):
+        """Refresca solo las filas afectadas; devuelve cuántas cambiaron."""
+        self.almacen.refrescar()
+        tocados = self.almacen.tomar_codigos_tocados() | self._marcados
+        self._marcados = set()
+        filas = []
+        for code in tocados:
+            entrada = self._cache.get(code)
+            if entrada is None:
+                # Nunca se mostró: se calculará cuando la vista la pida
+                continue
+            firma = self._firma(code)
+            if firma != entrada[0]:
+                self._cache[code] = self._renderizar(code, firma)
+                fila = self.fila_de(code)
+                if fila is not None:
+                    filas.append(fila)
+        # Emitir un dataChanged por cada tramo contiguo de filas
+        filas.sort()
+        roles = [Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ToolTipRole]
+        inicio = None
+        for i, fila in enumerate(filas):
+            if inicio is None:
+                inicio = fila
+            if i + 1 == len(filas) or filas[i + 1] != fila + 1:
+                self.dataChanged.emit(self.index(inicio), self.index(fila), roles)
+                inicio = None
+        return len(filas)
+
+
 class MapaView(QGraphicsView):
     def __init__(self, scene, parent=None):
         super().__init__(scene, parent)
@@ -100,6 +232,7 @@ class VentanaBodega(QMainWindow):
 
         self.nivel_actual = None
         self.puntos_graficos = []
+        self.items_ruta = []  # línea y números de la última ruta de picking dibujada
         self.completer = QCompleter()
         self.completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
         self.pixel_step = 1  # Control de movimiento de píxeles
@@ -120,6 +253,14 @@ class VentanaBodega(QMainWindow):
             print(f"[Changelog] No se pudo crear Changelog: {e}")
 
         self.cargar_bodegas()
+        # Backend de datos (JSON o SQLite) y almacén residente con índices
+        # (código/nombre -> estantes, estante -> bodega)
+        self.backend = obtener_backend(DOCS_PATH)
+        self.almacen = AlmacenBodegas(ARCHIVOS_BODEGA, DOCS_PATH, self.backend)
+        # Cada cambio se anota en el diario de la bodega (un append pequeño);
+        # la instantánea completa se reescribe en segundo plano tras una pausa
+        # de edición o cada 200 cambios (compactación).
+        self.cola_guardado = ColaGuardado(self.almacen, espera=10.0, espera_maxima=120.0, max_cambios=200)
         self.cargar_inventario_global()
         self.init_ui()
         
@@ -161,16 +302,12 @@ class VentanaBodega(QMainWindow):
 
     def cargar_inventario_global(self):
         """Carga el inventario global de items desde archivo."""
-        inventario_path = os.path.join(DOCS_PATH, "inventario_global.json")
         self.inventario_global = {}
-        
-        if os.path.exists(inventario_path):
-            try:
-                with open(inventario_path, "r", encoding='utf-8') as f:
-                    self.inventario_global = json.load(f)
-            except Exception as e:
-                print(f"[Inventario] Error al cargar: {e}")
-                self.inventario_global = {}
+        try:
+            self.inventario_global = self.backend.cargar_inventario()
+        except Exception as e:
+            print(f"[Inventario] Error al cargar: {e}")
+            self.inventario_global = {}
         try:
             self.log_action(f"Inventario global cargado: {len(self.inventario_global)} items")
         except Exception:
@@ -178,10 +315,8 @@ class VentanaBodega(QMainWindow):
 
     def guardar_inventario_global(self):
         """Guarda el inventario global de items."""
-        inventario_path = os.path.join(DOCS_PATH, "inventario_global.json")
         try:
-            with open(inventario_path, "w", encoding='utf-8') as f:
-                json.dump(self.inventario_global, f, indent=4, ensure_ascii=False)
+            self.backend.guardar_inventario(self.inventario_global)
             try:
                 self.log_action(f"Inventario global guardado: {len(self.inventario_global)} items")
             except Exception:
@@ -189,6 +324,40 @@ class VentanaBodega(QMainWindow):
         except Exception as e:
             print(f"[Inventario] Error al guardar: {e}")
 
+    def sincronizar_stock(self):
+        """Trae al inventario en memoria las ventas/ingresos que otros programas registraron."""
+        try:
+            self.backend.sincronizar_inventario(self.inventario_global)
+        except Exception as e:
+            print(f"[Inventario] Error al sincronizar el stock: {e}")
+
+    def guardar_item_inventario(self, codigo, stock_previo=None):
+        """Guarda un solo item del inventario global (una fila en SQLite).
+
+        El backend conserva el stock guardado de un item existente; si el
+        usuario lo cambió (`stock_previo` = valor que se le mostró), la
+        diferencia se registra como un movimiento, sin pisar otras ventas.
+        """
+        try:
+            # Mantener al día la fila correspondiente de la lista de inventario
+            modelo = getattr(self, 'modelo_inventario', None)
+            if codigo in self.inventario_global:
+                if modelo is not None:
+                    modelo.insertar(codigo)
+                    modelo.marcar(codigo)
+                datos = self.inventario_global[codigo]
+                stock = self.backend.actualizar_item(codigo, datos)
+                delta = (datos.get('stock', 0) or 0) - stock_previo if stock_previo is not None else 0
+                if delta:
+                    stock = self.backend.ajustar_stock({codigo: delta}, origen="bodega").get(codigo, stock)
+                datos['stock'] = stock
+            else:
+                if modelo is not None:
+                    modelo.eliminar(codigo)
+                self.backend.eliminar_item(codigo)
+        except Exception as e:
+            print(f"[Inventario] Error al guardar item {codigo}: {e}")
+
     def log_action(self, message: str):
         """Registra una acción en el archivo de changelog con timestamp."""
         try:
@@ -270,6 +439,10 @@ class VentanaBodega(QMainWindow):
         btn_search_code.clicked.connect(self.buscar_por_codigo)
         search_layout.addWidget(self.search_code_input)
         search_layout.addWidget(btn_search_code)
+        btn_ruta = QPushButton("🧭 Ruta")
+        btn_ruta.setToolTip("Ruta de picking para una lista de códigos")
+        btn_ruta.clicked.connect(self.calcular_ruta_picking)
+        search_layout.addWidget(btn_ruta)
         map_layout.addLayout(search_layout)
 
         # --- VISTA GRÁFICA ---
@@ -425,7 +598,11 @@ class VentanaBodega(QMainWindow):
         inv_layout.addWidget(QLabel("<b>Inventario General</b>"))
         inv_layout.addWidget(QLabel("Items disponibles para asignar a repisas"))
         
-        self.lista_inventario = QListWidget()
+        # Vista virtualizada: solo se consultan/pintan las filas visibles
+        self.modelo_inventario = ModeloInventario(self.inventario_global, self.almacen, self)
+        self.lista_inventario = QListView()
+        self.lista_inventario.setModel(self.modelo_inventario)
+        self.lista_inventario.setUniformItemSizes(True)
         self.lista_inventario.setMinimumHeight(150)
         self.lista_inventario.setMaximumHeight(300)  # Limitar expansión máxima
         inv_layout.addWidget(self.lista_inventario)
@@ -447,7 +624,7 @@ class VentanaBodega(QMainWindow):
         
         btn_inv_refresh = QPushButton("🔄 Actualizar")
         btn_inv_refresh.setStyleSheet("background-color: #1a7a5a;")
-        btn_inv_refresh.clicked.connect(self.actualizar_lista_inventario)
+        btn_inv_refresh.clicked.connect(self.recargar_lista_inventario)
         inv_layout.addWidget(btn_inv_refresh)
         
         tab_inventario.setLayout(inv_layout)
@@ -468,7 +645,7 @@ class VentanaBodega(QMainWindow):
         self.scene.mousePressEvent = self.evento_click_escena
         
         # Cargar inventario en la UI al inicio
-        self.actualizar_lista_inventario()
+        self.recargar_lista_inventario()
 
     def obtener_ruta_archivo(self, nivel):
         """Obtiene la ruta completa del archivo JSON"""
@@ -516,12 +693,14 @@ class VentanaBodega(QMainWindow):
         if self.puntos_graficos and self.nivel_actual and self.nivel_actual in ARCHIVOS_BODEGA:
             try:
                 self.guardar_datos_a_disco(self.nivel_actual)
+                self.cola_guardado.vaciar(self.nivel_actual)
             except Exception as e:
                 print(f"Error al guardar datos del nivel anterior: {e}")
 
         self.nivel_actual = nivel
         self.scene.clear()
         self.puntos_graficos = []
+        self.items_ruta = []
         
         # Actualizar combo box
         if self.combo_bodegas.currentText() != nivel:
@@ -550,15 +729,8 @@ class VentanaBodega(QMainWindow):
         else:
             self.scene.addText(f"Imagen no encontrada:\n{ruta_img}")
 
-        # Cargar datos
-        ruta_json = self.obtener_ruta_archivo(nivel)
-        datos = []
-        if os.path.exists(ruta_json):
-            try:
-                with open(ruta_json, "r", encoding='utf-8') as f:
-                    datos = json.load(f)
-            except Exception as e:
-                print(f"Error al cargar {nivel}: {e}")
+        # Cargar datos (copia residente del almacén, sin releer el disco)
+        datos = self.almacen.estantes(nivel)
 
         if isinstance(datos, list):
             for p_data in datos:
@@ -577,7 +749,7 @@ class VentanaBodega(QMainWindow):
         self.actualizar_lista_inventario()
 
     def guardar_datos_a_disco(self, nivel):
-        """Guarda los datos en disco"""
+        """Guarda los datos (en memoria al instante, en disco vía la cola de guardado)"""
         if not nivel or nivel not in ARCHIVOS_BODEGA:
             print(f"Error: Nivel '{nivel}' no válido para guardar")
             return
@@ -587,21 +759,36 @@ class VentanaBodega(QMainWindow):
             print(f"Error: No se pudo obtener ruta para el nivel '{nivel}'")
             return
             
-        lista_puntos = [
-            {
-                'x': p.pos().x(),
-                'y': p.pos().y(),
-                'nombre': p.nombre_estante,
-                'radio': p.radio,
-                'suplementos': p.suplementos,
-                'encargado': getattr(p, 'encargado', ''),
-                'codigo': getattr(p, 'codigo', '')
-            }
-            for p in self.puntos_graficos
-        ]
+        lista_puntos = [self.serializar_punto(p) for p in self.puntos_graficos]
         try:
-            with open(ruta_json, "w", encoding='utf-8') as f:
-                json.dump(lista_puntos, f, indent=4, ensure_ascii=False)
+            self.almacen.actualizar(nivel, lista_puntos)
+            self.cola_guardado.encolar(nivel)
+        except Exception as e:
+            print(f"Error al guardar: {e}")
+
+    def serializar_punto(self, p):
+        """Convierte un EstantePoint al dict que se guarda en yrz_*.json"""
+        return {
+            'x': p.pos().x(),
+            'y': p.pos().y(),
+            'nombre': p.nombre_estante,
+            'radio': p.radio,
+            'suplementos': p.suplementos,
+            'encargado': getattr(p, 'encargado', ''),
+            'codigo': getattr(p, 'codigo', '')
+        }
+
+    def guardar_estante_a_disco(self, punto):
+        """Guarda solo el estante indicado del nivel actual (una fila en SQLite)."""
+        nivel = self.nivel_actual
+        if punto not in self.puntos_graficos or len(self.almacen.estantes(nivel)) != len(self.puntos_graficos):
+            # La copia guardada no está alineada con la escena: guardar todo
+            self.guardar_datos_a_disco(nivel)
+            return
+        try:
+            pos = self.puntos_graficos.index(punto)
+            if self.almacen.actualizar_estante(nivel, pos, self.serializar_punto(punto)):
+                self.cola_guardado.encolar(nivel, [pos])
         except Exception as e:
             print(f"Error al guardar: {e}")
 
@@ -616,20 +803,12 @@ class VentanaBodega(QMainWindow):
                     max_val = c
             except Exception:
                 pass
-        # revisar datos en disco para este nivel
-        ruta_json = self.obtener_ruta_archivo(self.nivel_actual)
-        if os.path.exists(ruta_json):
+        # revisar datos guardados para este nivel
+        for item in self.almacen.estantes(self.nivel_actual):
             try:
-                with open(ruta_json, 'r', encoding='utf-8') as f:
-                    datos = json.load(f)
-                    if isinstance(datos, list):
-                        for item in datos:
-                            try:
-                                c = int(str(item.get('codigo', '')).lstrip('0') or 0)
-                                if c > max_val:
-                                    max_val = c
-                            except Exception:
-                                pass
+                c = int(str(item.get('codigo', '')).lstrip('0') or 0)
+                if c > max_val:
+                    max_val = c
             except Exception:
                 pass
         nuevo = max_val + 1
@@ -668,6 +847,14 @@ class VentanaBodega(QMainWindow):
             QMessageBox.critical(self, "Error", f"No se pudo copiar la imagen: {e}")
             return
         
+        # Pirámide de teselas para el mapa web, en segundo plano (planos grandes tardan)
+        def generar_teselas():
+            try:
+                asegurar_piramide(GRAPHICS_PATH, ruta_dest)
+            except Exception as e:
+                print(f"[Teselas] No se pudo generar la pirámide de {ruta_dest}: {e}")
+        threading.Thread(target=generar_teselas, daemon=True).start()
+        
         # Agregar a configuración
         nombre_json = f"yrz_{nombre.lower().replace(' ', '_')}.json"
         ARCHIVOS_BODEGA[nombre] = nombre_json
@@ -710,6 +897,7 @@ class VentanaBodega(QMainWindow):
                     self.guardar_datos_a_disco(self.nivel_actual)
                 except Exception as e:
                     print(f"Error al guardar datos antes de eliminar bodega: {e}")
+            self.cola_guardado.vaciar(nombre)
             
             # Eliminar de configuración
             del ARCHIVOS_BODEGA[nombre]
@@ -728,6 +916,7 @@ class VentanaBodega(QMainWindow):
                 self.nivel_actual = None
                 self.scene.clear()
                 self.puntos_graficos = []
+                self.items_ruta = []
                 self.lbl_estante.setText("No hay bodegas disponibles")
                 self.lista_suplementos.clear()
             
@@ -740,15 +929,16 @@ class VentanaBodega(QMainWindow):
     def exportar_datos(self):
         """Exporta los datos de la bodega actual"""
         self.guardar_datos_a_disco(self.nivel_actual)
-        ruta_json_origen = self.obtener_ruta_archivo(self.nivel_actual)
+        self.cola_guardado.vaciar(self.nivel_actual)
         
-        if not os.path.exists(ruta_json_origen):
+        if self.nivel_actual not in ARCHIVOS_BODEGA:
             QMessageBox.warning(self, "Exportar", "No hay datos grabados")
             return
 
         file_path, _ = QFileDialog.getSaveFileName(self, "Exportar Bodega como...", f"Copia_{ARCHIVOS_BODEGA[self.nivel_actual]}", "JSON Files (*.json)")
         if file_path:
-            shutil.copy2(ruta_json_origen, file_path)
+            # Exportar desde la copia residente (sirve igual con backend JSON o SQLite)
+            escribir_json_atomico(file_path, self.almacen.estantes(self.nivel_actual))
             QMessageBox.information(self, "Exportar", "Archivo exportado con éxito.")
             try:
                 self.log_action(f"Exportado JSON de '{self.nivel_actual}' a '{file_path}'")
@@ -796,9 +986,8 @@ class VentanaBodega(QMainWindow):
             )
             
             if ok and destino:
-                ruta_destino = self.obtener_ruta_archivo(destino)
-                with open(ruta_destino, "w", encoding='utf-8') as f:
-                    json.dump(datos_finales, f, indent=4, ensure_ascii=False)
+                self.cola_guardado.vaciar(destino)
+                self.almacen.guardar(destino, datos_finales if isinstance(datos_finales, list) else [])
                 
                 if destino == self.nivel_actual:
                     self.cargar_nivel(destino)
@@ -823,7 +1012,7 @@ class VentanaBodega(QMainWindow):
                 if ok: 
                     item.nombre_estante = nom
                     self.lbl_estante.setText(f"Estante: {nom}")
-                    self.guardar_datos_a_disco(self.nivel_actual)
+                    self.guardar_estante_a_disco(item)
             else:
                 if self.scene.sceneRect().contains(pos):
                     nom, ok = QInputDialog.getText(self, "Nuevo", "Nombre Estante:")
@@ -1005,7 +1194,7 @@ class VentanaBodega(QMainWindow):
                     'nombre': nombre.strip(),
                     'stock': int(stock_str)
                 }
-                self.guardar_inventario_global()
+                self.guardar_item_inventario(codigo)
                 sup_code = codigo
                 
                 try:
@@ -1029,7 +1218,7 @@ class VentanaBodega(QMainWindow):
                 'gaveta': gaveta_val if gaveta_val > 0 else None
             }
             self.estante_seleccionado.suplementos.append(nuevo)
-            self.guardar_datos_a_disco(self.nivel_actual)
+            self.guardar_estante_a_disco(self.estante_seleccionado)
             self.mostrar_detalles(self.estante_seleccionado)
             
             try:
@@ -1072,7 +1261,10 @@ class VentanaBodega(QMainWindow):
             QMessageBox.warning(self, "Error", "No se pudo leer el item seleccionado")
             return
 
+        # El stock del diálogo parte del valor actual (con las ventas de otros programas)
+        self.sincronizar_stock()
         item_data = self.inventario_global[code]
+        stock_previo = item_data.get('stock', 0)
         
         # Diálogo de edición
         dlg = QDialog(self)
@@ -1110,8 +1302,8 @@ class VentanaBodega(QMainWindow):
             sup_obj['nombre'] = new_name
             sup_obj['gaveta'] = new_gaveta
             
-            self.guardar_inventario_global()
-            self.guardar_datos_a_disco(self.nivel_actual)
+            self.guardar_item_inventario(code, stock_previo)
+            self.guardar_estante_a_disco(self.estante_seleccionado)
             self.mostrar_detalles(self.estante_seleccionado)
             
             try:
@@ -1163,7 +1355,7 @@ class VentanaBodega(QMainWindow):
                 punto.nombre_estante = nuevo_nombre
             punto.encargado = nuevo_enc
             punto.actualizar_tamano(nuevo_radio)
-            self.guardar_datos_a_disco(self.nivel_actual)
+            self.guardar_estante_a_disco(punto)
             self.mostrar_detalles(punto)
             dlg.accept()
             try:
@@ -1269,7 +1461,7 @@ class VentanaBodega(QMainWindow):
             
             if reply == QMessageBox.StandardButton.Yes:
                 self.estante_seleccionado.suplementos.pop(row)
-                self.guardar_datos_a_disco(self.nivel_actual)
+                self.guardar_estante_a_disco(self.estante_seleccionado)
                 self.mostrar_detalles(self.estante_seleccionado)
                 try:
                     self.log_action(f"Desasignado item '{sup_display_name}' ({code}) de estante '{self.estante_seleccionado.nombre_estante}'")
@@ -1294,7 +1486,7 @@ class VentanaBodega(QMainWindow):
             pass
         nueva_pos = QPointF(nueva_x, nueva_y)
         self.estante_seleccionado.setPos(nueva_pos)
-        self.guardar_datos_a_disco(self.nivel_actual)
+        self.guardar_estante_a_disco(self.estante_seleccionado)
         try:
             self.log_action(f"MoverEstante: '{getattr(self.estante_seleccionado, 'nombre_estante', '')}' de ({pos_actual.x():.1f},{pos_actual.y():.1f}) a ({nueva_x:.1f},{nueva_y:.1f})")
         except Exception:
@@ -1312,7 +1504,7 @@ class VentanaBodega(QMainWindow):
         )
         if ok:
             self.estante_seleccionado.actualizar_tamano(r)
-            self.guardar_datos_a_disco(self.nivel_actual)
+            self.guardar_estante_a_disco(self.estante_seleccionado)
 
     def eliminar_estante(self):
         """Elimina el estante seleccionado y desasigna sus items (no los elimina del inventario)"""
@@ -1357,83 +1549,23 @@ class VentanaBodega(QMainWindow):
 
     def actualizar_sugerencias_globales(self):
         """Actualiza las sugerencias de autocompletado"""
-        sups = set()
-        for nivel in ARCHIVOS_BODEGA.keys():
-            ruta = self.obtener_ruta_archivo(nivel)
-            if os.path.exists(ruta):
-                try:
-                    with open(ruta, "r", encoding='utf-8') as f:
-                        datos = json.load(f)
-                        if isinstance(datos, list):
-                            for est in datos:
-                                for s in est.get('suplementos', []):
-                                    if isinstance(s, dict):
-                                        sups.add(s.get('nombre', ''))
-                                    else:
-                                        sups.add(str(s))
-                except:
-                    pass
-        self.completer.setModel(QStringListModel(sorted(list(sups))))
+        self.completer.setModel(QStringListModel(self.almacen.nombres_suplementos()))
 
     # ==================== GESTIÓN DE INVENTARIO GENERAL ====================
     
     def actualizar_lista_inventario(self):
-        """Actualiza la lista visual del inventario mostrando TODOS los items con su estado de asignación"""
-        self.lista_inventario.clear()
-        
-        # Crear un set de todos los códigos que están en alguna repisa
-        codigos_asignados = set()
-        for nivel in ARCHIVOS_BODEGA.keys():
-            ruta = self.obtener_ruta_archivo(nivel)
-            if os.path.exists(ruta):
-                try:
-                    with open(ruta, "r", encoding='utf-8') as f:
-                        estantes = json.load(f)
-                        for est in estantes:
-                            for s in est.get('suplementos', []):
-                                if isinstance(s, dict):
-                                    codigos_asignados.add(s.get('codigo', ''))
-                except Exception:
-                    pass
-        
-        # Mostrar todos los items del inventario
-        for code in sorted(self.inventario_global.keys()):
-            data = self.inventario_global[code]
-            nombre = data.get('nombre', '')
-            stock = data.get('stock', 0)
-            
-            # Verificar si está asignado
-            if code in codigos_asignados:
-                # Contar cuántas repisas lo tienen
-                asignaciones = 0
-                repisas_info = []
-                for nivel in ARCHIVOS_BODEGA.keys():
-                    ruta = self.obtener_ruta_archivo(nivel)
-                    if os.path.exists(ruta):
-                        try:
-                            with open(ruta, "r", encoding='utf-8') as f:
-                                estantes = json.load(f)
-                                for est in estantes:
-                                    for s in est.get('suplementos', []):
-                                        if isinstance(s, dict) and s.get('codigo', '') == code:
-                                            asignaciones += 1
-                                            repisas_info.append(f"{est.get('nombre', 'desconocida')}")
-                        except Exception:
-                            pass
-                
-                estado = f"✓ Asignado ({asignaciones} repisa/s)"
-                tooltip_text = f"{code} | {nombre} | Stock: {stock}\nAsignado a: {', '.join(repisas_info)}"
-            else:
-                estado = "⊘ Por asignar"
-                tooltip_text = f"{code} | {nombre} | Stock: {stock}\nNo asignado a ninguna repisa"
-            
-            display = f"{code} | {nombre} | {stock} | {estado}"
-            item_widget = QListWidgetItem(display)
-            item_widget.setToolTip(tooltip_text)
-            self.lista_inventario.addItem(item_widget)
-        
+        """Actualiza el estado de asignación de la lista de inventario (solo filas que cambiaron)"""
+        cambiadas = self.modelo_inventario.actualizar()
+        try:
+            self.log_action(f"Lista de inventario actualizada: {len(self.inventario_global)} items ({cambiadas} filas cambiaron)")
+        except Exception:
+            pass
+
+    def recargar_lista_inventario(self):
+        """Reconstruye la lista de inventario completa"""
+        self.modelo_inventario.recargar(self.inventario_global)
         try:
-            self.log_action(f"Lista de inventario actualizada: {len(self.inventario_global)} items")
+            self.log_action(f"Lista de inventario recargada: {self.modelo_inventario.rowCount()} items")
         except Exception:
             pass
     
@@ -1475,7 +1607,7 @@ class VentanaBodega(QMainWindow):
             'stock': int(stock_str),
             'asignable': True  # True = sin repisa, False = en una repisa
         }
-        self.guardar_inventario_global()
+        self.guardar_item_inventario(codigo)
         self.actualizar_lista_inventario()
         
         try:
@@ -1487,15 +1619,15 @@ class VentanaBodega(QMainWindow):
     
     def editar_item_inventario(self):
         """Edita nombre y stock de un item del inventario"""
-        row = self.lista_inventario.currentRow()
-        if row < 0:
+        row = self.lista_inventario.currentIndex().row()
+        codigo = self.modelo_inventario.codigo_en(row)
+        if codigo is None:
             QMessageBox.warning(self, "Error", "Selecciona un item para editar")
             return
         
-        # Obtener código del item seleccionado
-        codigos = sorted(self.inventario_global.keys())
-        codigo = codigos[row]
+        self.sincronizar_stock()
         item_data = self.inventario_global[codigo]
+        stock_previo = item_data.get('stock', 0)
         
         # Editar nombre
         new_nombre, ok1 = QInputDialog.getText(
@@ -1521,7 +1653,7 @@ class VentanaBodega(QMainWindow):
         # Actualizar
         self.inventario_global[codigo]['nombre'] = new_nombre.strip()
         self.inventario_global[codigo]['stock'] = int(new_stock)
-        self.guardar_inventario_global()
+        self.guardar_item_inventario(codigo, stock_previo)
         self.actualizar_lista_inventario()
         self.mostrar_detalles(self.estante_seleccionado) if hasattr(self, 'estante_seleccionado') else None
         
@@ -1532,32 +1664,17 @@ class VentanaBodega(QMainWindow):
     
     def eliminar_item_inventario(self):
         """Elimina un item del inventario (solo si asignable=True, es decir, sin repisa)"""
-        row = self.lista_inventario.currentRow()
-        if row < 0:
+        row = self.lista_inventario.currentIndex().row()
+        codigo = self.modelo_inventario.codigo_en(row)
+        if codigo is None:
             QMessageBox.warning(self, "Error", "Selecciona un item para eliminar")
             return
         
-        # Obtener código del item seleccionado
-        codigos = sorted(self.inventario_global.keys())
-        codigo = codigos[row]
         item_data = self.inventario_global[codigo]
         nombre = item_data.get('nombre', '')
         
         # Verificar que esté asignable (no esté en ninguna repisa)
-        esta_en_repisa = False
-        for nivel in ARCHIVOS_BODEGA.keys():
-            ruta = self.obtener_ruta_archivo(nivel)
-            if os.path.exists(ruta):
-                try:
-                    with open(ruta, "r", encoding='utf-8') as f:
-                        estantes = json.load(f)
-                        for est in estantes:
-                            for s in est.get('suplementos', []):
-                                if isinstance(s, dict) and s.get('codigo', '') == codigo:
-                                    esta_en_repisa = True
-                                    break
-                except Exception:
-                    pass
+        esta_en_repisa = bool(self.almacen.ubicaciones_codigo(codigo))
         
         if esta_en_repisa:
             QMessageBox.warning(
@@ -1576,7 +1693,7 @@ class VentanaBodega(QMainWindow):
         
         if res == QMessageBox.StandardButton.Yes:
             del self.inventario_global[codigo]
-            self.guardar_inventario_global()
+            self.guardar_item_inventario(codigo)
             self.actualizar_lista_inventario()
             
             try:
@@ -1594,48 +1711,32 @@ class VentanaBodega(QMainWindow):
         for p in self.puntos_graficos:
             p.setBrush(QColor("red"))
 
-        found_any = False
-        for nivel in ARCHIVOS_BODEGA.keys():
-            ruta = self.obtener_ruta_archivo(nivel)
-            if os.path.exists(ruta):
-                try:
-                    with open(ruta, "r", encoding='utf-8') as f:
-                        estantes = json.load(f)
-                        for est in estantes:
-                            # soportar formatos antiguos (strings) y nuevos (dicts)
-                            found = False
-                            for s in est.get('suplementos', []):
-                                name = s.get('nombre','').lower() if isinstance(s, dict) else str(s).lower()
-                                if t in name:
-                                    found = True
-                                    break
-                            if found:
-                                found_any = True
-                                if nivel == self.nivel_actual:
-                                    for p in self.puntos_graficos:
-                                        if p.nombre_estante == est['nombre']:
-                                            p.setBrush(QColor("#DA9CFF"))
-                                            self.view.centerOn(p)
-                                            try:
-                                                self.log_action(f"Buscar suplemento: encontrado '{t}' en estante '{p.nombre_estante}' nivel='{nivel}'")
-                                            except Exception:
-                                                pass
-                                            return
-                                else:
-                                    res = QMessageBox.question(
-                                        self, "Ubicación", 
-                                        f"Está en: {nivel}. ¿Cambiar de mapa?", 
-                                        QMessageBox.StandardButton.Yes | 
-                                        QMessageBox.StandardButton.No
-                                    )
-                                    if res == QMessageBox.StandardButton.Yes:
-                                        self.cargar_nivel(nivel)
-                                        self.buscar_suplemento()
-                                    return
-                except:
-                    pass
+        # El índice devuelve las coincidencias en orden de bodega y de estante
+        resultados = self.almacen.buscar_nombre(t)
+        for nivel, _, nombre_est in resultados:
+            if nivel == self.nivel_actual:
+                for p in self.puntos_graficos:
+                    if p.nombre_estante == nombre_est:
+                        p.setBrush(QColor("#DA9CFF"))
+                        self.view.centerOn(p)
+                        try:
+                            self.log_action(f"Buscar suplemento: encontrado '{t}' en estante '{p.nombre_estante}' nivel='{nivel}'")
+                        except Exception:
+                            pass
+                        return
+            else:
+                res = QMessageBox.question(
+                    self, "Ubicación", 
+                    f"Está en: {nivel}. ¿Cambiar de mapa?", 
+                    QMessageBox.StandardButton.Yes | 
+                    QMessageBox.StandardButton.No
+                )
+                if res == QMessageBox.StandardButton.Yes:
+                    self.cargar_nivel(nivel)
+                    self.buscar_suplemento()
+                return
 
-        if not found_any:
+        if not resultados:
             QMessageBox.warning(self, "No encontrado", f"No se encontraron suplementos que coincidan con '{t}'")
             try:
                 self.log_action(f"Buscar suplemento: no se encontraron resultados para '{t}'")
@@ -1654,69 +1755,113 @@ class VentanaBodega(QMainWindow):
         for p in self.puntos_graficos:
             p.setBrush(QColor("red"))
 
-        found_any = False
-
-        # Buscar en archivos (solo códigos de items en suplementos)
-        for nivel in ARCHIVOS_BODEGA.keys():
-            ruta = self.obtener_ruta_archivo(nivel)
-            if not os.path.exists(ruta):
-                continue
-            try:
-                with open(ruta, "r", encoding='utf-8') as f:
-                    estantes = json.load(f)
-            except Exception:
-                continue
-
-            for est in estantes:
-                found = False
-                # Buscar en items del estante (solo por código)
-                for s in est.get('suplementos', []):
-                    if isinstance(s, dict):
-                        s_code = str(s.get('codigo', '') or '')
-                        if s_code and s_code == code_raw:
-                            found = True
-                            break
-
-                if found:
-                    found_any = True
-                    # si está en el nivel cargado, resaltar el estante correspondiente
-                    if nivel == self.nivel_actual:
-                        for p in self.puntos_graficos:
-                            if p.nombre_estante == est.get('nombre'):
-                                p.setBrush(QColor("yellow"))
-                                self.view.centerOn(p)
-                                try:
-                                    item_name = self.inventario_global.get(code_raw, {}).get('nombre', code_raw)
-                                    self.log_action(f"Buscar código: encontrado item '{item_name}' ({code}) en estante '{p.nombre_estante}' (nivel='{nivel}')")
-                                except Exception:
-                                    pass
-                                return
-                        # si no encontramos punto cargado (inconsistencia), informar
-                        QMessageBox.information(self, "Encontrado", f"Item '{code}' pertenece a estante '{est.get('nombre')}' pero no está cargado como punto visual.")
+        # Consultar el índice código -> estantes (solo códigos de items en suplementos)
+        ubicaciones = self.almacen.ubicaciones_codigo(code_raw)
+        if ubicaciones:
+            nivel, _, nombre_est = ubicaciones[0]
+            # si está en el nivel cargado, resaltar el estante correspondiente
+            if nivel == self.nivel_actual:
+                for p in self.puntos_graficos:
+                    if p.nombre_estante == nombre_est:
+                        p.setBrush(QColor("yellow"))
+                        self.view.centerOn(p)
                         try:
-                            self.log_action(f"Buscar código: encontrado item '{code}' en estante '{est.get('nombre')}' nivel='{nivel}', pero no está en puntos cargados")
+                            item_name = self.inventario_global.get(code_raw, {}).get('nombre', code_raw)
+                            self.log_action(f"Buscar código: encontrado item '{item_name}' ({code}) en estante '{p.nombre_estante}' (nivel='{nivel}')")
                         except Exception:
                             pass
                         return
+                # si no encontramos punto cargado (inconsistencia), informar
+                QMessageBox.information(self, "Encontrado", f"Item '{code}' pertenece a estante '{nombre_est}' pero no está cargado como punto visual.")
+                try:
+                    self.log_action(f"Buscar código: encontrado item '{code}' en estante '{nombre_est}' nivel='{nivel}', pero no está en puntos cargados")
+                except Exception:
+                    pass
+                return
 
-                    # si pertenece a otra bodega preguntar si cambiar
-                    res = QMessageBox.question(
-                        self, "Ubicación",
-                        f"El item '{code}' está en: {nivel}. ¿Cambiar de mapa?",
-                        QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
-                    )
-                    if res == QMessageBox.StandardButton.Yes:
-                        self.cargar_nivel(nivel)
-                        # repetir búsqueda en el nuevo nivel (llamada recursiva)
-                        self.buscar_por_codigo()
-                    return
+            # si pertenece a otra bodega preguntar si cambiar
+            res = QMessageBox.question(
+                self, "Ubicación",
+                f"El item '{code}' está en: {nivel}. ¿Cambiar de mapa?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+            )
+            if res == QMessageBox.StandardButton.Yes:
+                self.cargar_nivel(nivel)
+                # repetir búsqueda en el nuevo nivel (llamada recursiva)
+                self.buscar_por_codigo()
+            return
 
-        if not found_any:
-            QMessageBox.warning(self, "No encontrado", f"No se encontraron resultados para el código '{code}'")
-            try:
-                self.log_action(f"Buscar código: no se encontraron resultados para '{code}'")
-            except Exception:
-                pass
+        QMessageBox.warning(self, "No encontrado", f"No se encontraron resultados para el código '{code}'")
+        try:
+            self.log_action(f"Buscar código: no se encontraron resultados para '{code}'")
+        except Exception:
+            pass
+
+    def calcular_ruta_picking(self):
+        """Pide una lista de códigos y dibuja el orden de visita de los estantes (common_route)."""
+        texto, ok = QInputDialog.getMultiLineText(self, "Ruta de picking",
+                                                  "Códigos de items (uno por línea o separados por comas):")
+        if not ok:
+            return
+        codigos = list(dict.fromkeys(c for c in texto.replace(",", " ").split() if c))
+        if not codigos:
+            return
+        plan = planificar_recorrido(ubicaciones_desde_almacen(self.almacen, codigos, self.inventario_global))
+        self.dibujar_ruta(next((t for t in plan["tramos"] if t["bodega"] == self.nivel_actual), None))
+
+        lineas = []
+        for tramo in plan["tramos"]:
+            lineas.append(f"{tramo['bodega']}: {len(tramo['paradas'])} paradas ({tramo['distancia']:.0f} px)")
+            for i, parada in enumerate(tramo["paradas"], 1):
+                items = ", ".join(f"{it['codigo']}" + (f" (gaveta {it['gaveta']})" if it.get('gaveta') else "")
+                                  for it in parada["items"])
+                lineas.append(f"   {i}. {parada['estante']}: {items}")
+        sin_ubicar = plan["no_encontrados"] + plan["sin_coordenadas"]
+        if sin_ubicar:
+            lineas.append(f"Sin ubicar: {', '.join(sin_ubicar)}")
+        if plan["tramos"] and all(t["bodega"] != self.nivel_actual for t in plan["tramos"]):
+            lineas.append(f"\nNinguna parada en '{self.nivel_actual}': cambie a {plan['tramos'][0]['bodega']} para ver la ruta.")
+        QMessageBox.information(self, "Ruta de picking", "\n".join(lineas) or "Sin paradas")
+        try:
+            self.log_action(f"Ruta de picking: {len(codigos)} códigos, "
+                            f"{sum(len(t['paradas']) for t in plan['tramos'])} paradas en {plan['ms']} ms")
+        except Exception:
+            pass
+
+    def dibujar_ruta(self, tramo):
+        """Dibuja (o borra, con None) el recorrido sobre el plano con el número de cada parada."""
+        for item in self.items_ruta:
+            self.scene.removeItem(item)
+        self.items_ruta = []
+        if not tramo or not tramo["paradas"]:
+            return
+        paradas = tramo["paradas"]
+        camino = QPainterPath(QPointF(paradas[0]["x"], paradas[0]["y"]))
+        for parada in paradas[1:]:
+            camino.lineTo(QPointF(parada["x"], parada["y"]))
+        linea = QGraphicsPathItem(camino)
+        pen = QPen(QColor(0, 170, 255, 200), 4)
+        pen.setCosmetic(True)  # mismo grosor con cualquier zoom
+        linea.setPen(pen)
+        linea.setZValue(5)
+        self.scene.addItem(linea)
+        self.items_ruta.append(linea)
+        for i, parada in enumerate(paradas, 1):
+            numero = QGraphicsSimpleTextItem(str(i))
+            numero.setBrush(QColor("white"))
+            numero.setPos(parada["x"] + 10, parada["y"] - 24)
+            numero.setZValue(6)
+            self.scene.addItem(numero)
+            self.items_ruta.append(numero)
+
+    def closeEvent(self, event):
+        """Escribe los cambios pendientes de la cola de guardado antes de cerrar"""
+        try:
+            self.cola_guardado.detener()
+            self.log_action(f"Cola de guardado: {self.cola_guardado.resumen()}")
+        except Exception as e:
+            print(f"[ColaGuardado] Error al vaciar al cerrar: {e}")
+        super().closeEvent(event)
 
     # -------------------- Controles de Zoom --------------------
     def zoom_in(self):
@@ -1783,7 +1928,7 @@ if __name__ == "__main__":
     QPushButton { background-color: #151618; border: 1px solid #222; padding: 6px; border-radius: 6px; }
     QPushButton:hover { border-color: #3b2a66; }
     QLabel { color: #e8e8e8; }
-    QListWidget { background-color: #0b0c0d; border: 1px solid #222; color: #e8e8e8; }
+    QListWidget, QListView { background-color: #0b0c0d; border: 1px solid #222; color: #e8e8e8; }
     QLineEdit { background-color: #0b0c0d; border: 1px solid #222; color: #e8e8e8; padding: 4px; }
     QComboBox { background-color: #0b0c0d; border: 1px solid #222; color: #e8e8e8; }
     QSpinBox { background-color: #0b0c0d; border: 1px solid #222; color: #e8e8e8; }
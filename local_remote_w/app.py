@@ -1,6 +1,11 @@
 import os
+import re
 import json
+import gzip
+import asyncio
+import hashlib
 import socket
+import tempfile
 import threading
 import webbrowser
 import time
@@ -11,11 +16,31 @@ import shutil
 import pystray
 from pystray import MenuItem as item
 import uvicorn
-from fastapi import FastAPI, HTTPException
+import anyio
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 import customtkinter as ctk
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# Módulos compartidos del proyecto (common_*.py en la raíz)
+RAIZ_PROYECTO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ_PROYECTO not in sys.path:
+    sys.path.insert(0, RAIZ_PROYECTO)
+from common_store import obtener_backend, leer_json, escribir_json_atomico
+from common_journal import DiarioBodegas, diferencias
+from common_tiles import asegurar_piramide, carpeta_piramide
+from common_catalog import CatalogoBodegas, VigilanteCatalogo, archivos_bodegas
+from common_route import planificar_recorrido
 
 # --- FUNCIÓN CRÍTICA PARA PYINSTALLER ---
 def get_resource_path(relative_path):
@@ -37,7 +62,267 @@ STATIC_DIR = get_resource_path("static")
 DOCS_PATH = os.path.join(os.path.expanduser("~"), "Documents", "Yuuruii", "AgustinaFalcon")
 GRAPHICS_PATH = os.path.join(DOCS_PATH, "graphics")
 
+# --- MODO SERVIDOR ---
+# Procesos de uvicorn (--workers o el panel de control, vía AGUSTINA_WORKERS) e hilos
+# por proceso para las lecturas de archivos (los handlers `def` corren en ese pool)
+WORKERS = max(1, int(os.environ.get("AGUSTINA_WORKERS", "1") or 1))
+HILOS_IO = max(4, int(os.environ.get("AGUSTINA_HILOS", "40") or 40))
+AYUDA_WORKERS = ("procesos de uvicorn (por defecto AGUSTINA_WORKERS o 1). Cada worker arma su propio "
+                 "índice de búsqueda/ubicaciones y sus vigilantes de archivos, así que la memoria y el "
+                 "arranque crecen con la cantidad; entre workers solo se comparten las respuestas JSON "
+                 "ya serializadas (/api/puntos, /api/bodegas, info de teselas)")
+# Carpeta local compartida por los workers: caché de respuestas y carga de cada uno.
+# Va fuera de DOCS_PATH para no despertar a los vigilantes de archivos, y lleva la
+# carpeta de datos y el puerto: dos servidores en el mismo equipo no se mezclan.
+CARPETA_SERVIDOR = os.path.join(
+    tempfile.gettempdir(),
+    f"agustina_falcon_{hashlib.sha1(os.path.abspath(DOCS_PATH).encode('utf-8')).hexdigest()[:12]}_{PUERTO}")
+CARPETA_CACHE_WEB = os.path.join(CARPETA_SERVIDOR, "cache")
+CARPETA_CARGA = os.path.join(CARPETA_SERVIDOR, "workers")
+
+# Backend de datos compartido (JSON o SQLite en modo WAL)
+backend = obtener_backend(DOCS_PATH)
+# Diario de operaciones de bodega.py (cambios aún no compactados en la instantánea)
+diario = DiarioBodegas(DOCS_PATH)
+# Índice de búsqueda de items sobre todas las bodegas y el inventario global
+catalogo = CatalogoBodegas(DOCS_PATH, backend, diario)
+
+# --- CACHÉ DE RESPUESTAS JSON (ETag + compresión) ---
+# {clave: {"firma", "etag", "cuerpos": {codificación: bytes}}}; la firma sale de
+# mtime/tamaño (JSON) o versión (SQLite) de los archivos de origen, así una
+# escritura de bodega.py invalida la entrada sin avisar al servidor.
+cache_respuestas = {}
+lock_cache = threading.Lock()
+MIN_COMPRIMIR = 1024  # bytes; respuestas más chicas van sin comprimir
+
+
+def elegir_codificacion(accept_encoding):
+    """'br', 'gzip' o 'identity' según Accept-Encoding (respeta q=0)."""
+    aceptadas = {}
+    for parte in (accept_encoding or "").split(","):
+        nombre, _, params = parte.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if nombre:
+            aceptadas[nombre.strip().lower()] = q
+    if brotli is not None and aceptadas.get("br", 0) > 0:
+        return "br"
+    if aceptadas.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
+
+
+def _ruta_compartida(clave):
+    return os.path.join(CARPETA_CACHE_WEB, hashlib.sha1(clave.encode('utf-8')).hexdigest() + ".bin")
+
+
+def leer_compartida(clave, firma):
+    """Entrada que otro worker ya serializó para esta misma firma, o None.
+
+    El archivo es una línea JSON con la firma y el ETag seguida del cuerpo;
+    las firmas (stat de archivos o versión de la fila) no dependen del
+    proceso, así que sirven para comparar entre workers. El sistema
+    operativo mantiene el archivo en su caché de páginas, compartida por
+    todos, y el worker se ahorra leer el JSON de la bodega y reproducir el diario.
+    """
+    try:
+        with open(_ruta_compartida(clave), "rb") as f:
+            cabecera = json.loads(f.readline())
+            if cabecera.get("clave") != clave or cabecera.get("firma") != repr(firma):
+                return None
+            cuerpo = f.read()
+    except (OSError, ValueError):
+        return None
+    return {"firma": firma, "etag": cabecera["etag"], "cuerpos": {"identity": cuerpo}}
+
+
+def escribir_compartida(clave, entrada):
+    """Publica la entrada para los demás workers (temporal + rename, sin fsync: es una caché)."""
+    ruta = _ruta_compartida(clave)
+    cabecera = json.dumps({"clave": clave, "firma": repr(entrada["firma"]), "etag": entrada["etag"]},
+                          ensure_ascii=False).encode('utf-8')
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CARPETA_CACHE_WEB, exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(cabecera + b"\n" + entrada["cuerpos"]["identity"])
+        os.replace(tmp, ruta)
+    except OSError as e:
+        print(f"[Cache] No se pudo compartir {clave}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def guardar_en_cache(clave, firma, datos):
+    """Serializa `datos` y los deja en la caché con su ETag; devuelve la entrada."""
+    cuerpo = json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # ETag del contenido: igual en todos los procesos y tras reiniciar el servidor
+    entrada = {"firma": firma, "etag": f'"{hashlib.sha1(cuerpo).hexdigest()}"',
+               "cuerpos": {"identity": cuerpo}}
+    with lock_cache:
+        cache_respuestas[clave] = entrada
+    if WORKERS > 1:
+        escribir_compartida(clave, entrada)
+    return entrada
+
+
+def respuesta_json(request, clave, firma, generar):
+    """Respuesta JSON cacheada por `firma`, con ETag fuerte, 304 y gzip/brotli.
+
+    `generar()` solo se llama si la firma cambió desde la última vez y, con
+    varios workers, ninguno dejó ya la respuesta en la caché compartida.
+    Bloqueante: se llama desde handlers `def` (pool de hilos).
+    """
+    with lock_cache:
+        entrada = cache_respuestas.get(clave)
+    if entrada is None or entrada["firma"] != firma:
+        entrada = leer_compartida(clave, firma) if WORKERS > 1 else None
+        if entrada is not None:
+            with lock_cache:
+                cache_respuestas[clave] = entrada
+        else:
+            entrada = guardar_en_cache(clave, firma, generar())
+    cabeceras = {"ETag": entrada["etag"], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    si_no = request.headers.get("if-none-match", "")
+    if si_no and (si_no.strip() == "*" or entrada["etag"] in [e.strip().removeprefix("W/") for e in si_no.split(",")]):
+        return Response(status_code=304, headers=cabeceras)
+    codificacion = elegir_codificacion(request.headers.get("accept-encoding"))
+    cuerpos = entrada["cuerpos"]
+    if len(cuerpos["identity"]) < MIN_COMPRIMIR:
+        codificacion = "identity"
+    if codificacion not in cuerpos:
+        if codificacion == "br":
+            cuerpos["br"] = brotli.compress(cuerpos["identity"], quality=5)
+        else:
+            cuerpos["gzip"] = gzip.compress(cuerpos["identity"], compresslevel=6)
+    if codificacion != "identity":
+        cabeceras["Content-Encoding"] = codificacion
+    return Response(content=cuerpos[codificacion], media_type="application/json", headers=cabeceras)
+
+
+# --- CARGA POR WORKER ---
+
+class CargaWorker:
+    """Contadores de peticiones de este proceso.
+
+    Un hilo los publica cada `intervalo` segundos en CARPETA_CARGA/<pid>.json
+    (activas, req/s, latencia media, clientes SSE, hilos ocupados) y el
+    panel de control los lee para mostrar la carga de cada worker.
+    """
+
+    def __init__(self, intervalo=2.0):
+        self.intervalo = intervalo
+        self.activas = 0
+        self.total = 0
+        self.ms_total = 0.0
+        self.limitador = None  # limitador de hilos de anyio de este proceso
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self.ruta = None
+
+    def entrar(self):
+        with self._lock:
+            self.activas += 1
+
+    def salir(self, ms):
+        with self._lock:
+            self.activas -= 1
+            self.total += 1
+            self.ms_total += ms
+
+    def iniciar(self, limitador):
+        self.limitador = limitador
+        self.ruta = os.path.join(CARPETA_CARGA, f"{os.getpid()}.json")
+        threading.Thread(target=self._bucle, daemon=True).start()
+
+    def detener(self):
+        self._detener.set()
+        if self.ruta:
+            try:
+                os.remove(self.ruta)
+            except OSError:
+                pass
+
+    def _bucle(self):
+        previo = (0, 0.0, time.monotonic())
+        while not self._detener.wait(self.intervalo):
+            with self._lock:
+                total, ms_total, activas = self.total, self.ms_total, self.activas
+            ahora = time.monotonic()
+            hechas = total - previo[0]
+            estado = {"pid": os.getpid(), "ts": time.time(), "activas": activas, "total": total,
+                      "rps": round(hechas / max(ahora - previo[2], 1e-6), 2),
+                      "ms": round((ms_total - previo[1]) / hechas, 1) if hechas else 0.0,
+                      "sse": vigilante.clientes(),
+                      "hilos": self.limitador.borrowed_tokens if self.limitador else 0,
+                      "hilos_max": self.limitador.total_tokens if self.limitador else 0}
+            previo = (total, ms_total, ahora)
+            try:
+                os.makedirs(CARPETA_CARGA, exist_ok=True)
+                escribir_json_atomico(self.ruta, estado)
+            except OSError as e:
+                print(f"[Carga] No se pudo publicar la carga: {e}")
+
+
+def leer_carga_workers(vigencia=6.0):
+    """Estados publicados por los workers vivos (los viejos se descartan y, pasado un minuto, se borran)."""
+    estados = []
+    try:
+        nombres = os.listdir(CARPETA_CARGA)
+    except OSError:
+        return estados
+    ahora = time.time()
+    for nombre in nombres:
+        if not nombre.endswith(".json"):
+            continue
+        ruta = os.path.join(CARPETA_CARGA, nombre)
+        estado = leer_json(ruta, None)
+        if not isinstance(estado, dict):
+            continue
+        edad = ahora - estado.get("ts", 0)
+        if edad > 60:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        elif edad <= vigencia:
+            estados.append(estado)
+    return sorted(estados, key=lambda e: e["pid"])
+
+
+carga = CargaWorker()
+
+
+class MedirCarga:
+    """Middleware ASGI que cuenta peticiones y su duración en `carga`.
+
+    Es ASGI puro (no BaseHTTPMiddleware) para no meterse en el flujo SSE;
+    /api/eventos no se mide como petición: se cuenta en los clientes SSE.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/api/eventos/"):
+            await self.app(scope, receive, send)
+            return
+        carga.entrar()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            carga.salir((time.perf_counter() - t0) * 1000)
+
+
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(MedirCarga)
 
 # Montar estáticos solo si la ruta existe
 if os.path.exists(STATIC_DIR):
@@ -54,41 +339,302 @@ async def read_index():
 async def health_check():
     return {"status": "ok"}
 
+def nombres_bodegas():
+    return list(archivos_bodegas(DOCS_PATH, backend))
+
 @app.get("/api/bodegas")
-async def listar_bodegas():
-    config_path = os.path.join(DOCS_PATH, "bodegas_config.json")
-    if os.path.exists(config_path):
-        try:
-            with open(config_path, "r", encoding='utf-8') as f:
-                return list(json.load(f).keys())
-        except: pass
-    
-    if os.path.exists(DOCS_PATH):
-        archivos = [f for f in os.listdir(DOCS_PATH) if f.startswith("yrz_") and f.endswith(".json")]
-        return [f.replace("yrz_", "").replace(".json", "").replace("_", " ").title() for f in archivos]
-    return []
+def listar_bodegas(request: Request):
+    # La lista es barata de calcular; la caché aporta el ETag/304 para los teléfonos
+    nombres = nombres_bodegas()
+    return respuesta_json(request, "bodegas", tuple(nombres), lambda: nombres)
+
+def archivo_bodega(nombre_bodega):
+    return f"yrz_{nombre_bodega.lower().replace(' ', '_')}.json"
+
+def firma_puntos(archivo_json):
+    """Cambia cuando bodega.py escribe la bodega o añade operaciones a su diario."""
+    return (backend.firma_estantes(archivo_json), diario.firma(archivo_json))
 
 @app.get("/api/puntos/{nombre_bodega}")
-async def obtener_puntos(nombre_bodega: str):
-    archivo_json = f"yrz_{nombre_bodega.lower().replace(' ', '_')}.json"
-    ruta = os.path.join(DOCS_PATH, archivo_json)
-    if os.path.exists(ruta):
-        with open(ruta, "r", encoding='utf-8') as f: return json.load(f)
-    return []
+def obtener_puntos(nombre_bodega: str, request: Request):
+    archivo_json = archivo_bodega(nombre_bodega)
+    return respuesta_json(request, f"puntos:{archivo_json}", firma_puntos(archivo_json),
+                          lambda: diario.reproducir(archivo_json, backend.cargar_estantes(archivo_json)))
 
-@app.get("/api/imagen/{nombre_bodega}")
-async def obtener_imagen_bodega(nombre_bodega: str):
+@app.on_event("startup")
+async def iniciar_worker():
+    # Los handlers `def` (lecturas de archivos) corren en el pool de hilos de anyio
+    limitador = anyio.to_thread.current_default_thread_limiter()
+    limitador.total_tokens = HILOS_IO
+    carga.iniciar(limitador)
+    # El índice de búsqueda/ubicaciones se arma al arrancar y se mantiene al día
+    # con los cambios de archivos (no en la primera consulta). Es de este proceso:
+    # con N workers hay N índices y N vigilantes (ver AYUDA_WORKERS)
+    VigilanteCatalogo(catalogo).start()
+    print(f"[Servidor] Worker {os.getpid()} listo ({WORKERS} workers, {HILOS_IO} hilos de E/S)")
+
+@app.on_event("shutdown")
+def detener_worker():
+    carga.detener()
+
+MAX_CODIGOS_UBICACION = 2000
+
+@app.get("/api/ubicacion")
+async def ubicar_codigos(codes: str = ""):
+    """Ubicaciones de varios códigos (internos o de barras) en una sola llamada: ?codes=A1,B2,..."""
+    codigos = list(dict.fromkeys(c.strip() for c in codes.split(",") if c.strip()))
+    if not codigos:
+        raise HTTPException(status_code=400, detail="Falta ?codes=codigo1,codigo2,...")
+    if len(codigos) > MAX_CODIGOS_UBICACION:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_CODIGOS_UBICACION} códigos por consulta")
+    ubicaciones = await run_in_threadpool(catalogo.ubicar, codigos)
+    return {"ubicaciones": ubicaciones,
+            "no_encontrados": [c for c, item in ubicaciones.items() if item is None]}
+
+@app.get("/api/ubicacion/{codigo}")
+async def ubicar_codigo(codigo: str):
+    """Bodega, estante, gaveta y coordenadas en el plano de un código (interno o de barras)."""
+    item = (await run_in_threadpool(catalogo.ubicar, [codigo])).get(codigo.strip())
+    if item is None:
+        raise HTTPException(status_code=404, detail=f"Código '{codigo}' no encontrado")
+    return item
+
+@app.get("/api/ruta")
+async def ruta_picking(codes: str = "", bodega: str = "", x: float = None, y: float = None, volver: bool = False):
+    """Orden de visita de los estantes para una lista de picking (?codes=A1,B2,...).
+
+    Con `bodega`, `x` e `y` el recorrido de esa bodega parte de ese punto
+    (p. ej. la entrada) y, con `volver`, termina en él.
+    """
+    codigos = list(dict.fromkeys(c.strip() for c in codes.split(",") if c.strip()))
+    if not codigos:
+        raise HTTPException(status_code=400, detail="Falta ?codes=codigo1,codigo2,...")
+    if len(codigos) > MAX_CODIGOS_UBICACION:
+        raise HTTPException(status_code=413, detail=f"Máximo {MAX_CODIGOS_UBICACION} códigos por consulta")
+    inicio = {bodega: (x, y)} if bodega and x is not None and y is not None else None
+
+    def calcular():
+        return planificar_recorrido(catalogo.ubicar(codigos), inicio, volver)
+    return await run_in_threadpool(calcular)
+
+@app.get("/api/buscar")
+async def buscar_items(q: str = "", limite: int = 20, bodega: str = ""):
+    """Mejores coincidencias de `q` en todas las bodegas; con `bodega`, además los
+    estantes de esa bodega con algún item que coincide (para filtrar el mapa)."""
+    limite = max(1, min(limite, 100))
+    resultados, estantes = await run_in_threadpool(catalogo.buscar, q, limite, bodega or None)
+    return {"q": q, "resultados": resultados,
+            "estantes": sorted(estantes) if estantes is not None else None}
+
+# --- CAMBIOS EN VIVO (Server-Sent Events) ---
+
+class _AvisoCambios:
+    """Manejador de watchdog: cualquier evento en DOCS_PATH despierta al vigilante."""
+    def __init__(self, evento):
+        self.evento = evento
+
+    def dispatch(self, event):
+        self.evento.set()
+
+class VigilanteBodegas:
+    """Vigila las bodegas con clientes conectados y les envía los cambios.
+
+    Con watchdog (inotify/FSEvents/ReadDirectoryChanges) cada escritura en
+    DOCS_PATH despierta al hilo al instante; sin él, revisa las firmas cada
+    `intervalo` segundos (solo un stat por bodega con clientes). Ante un
+    cambio relee la bodega una vez, actualiza la caché de /api/puntos y
+    envía a todos sus clientes las operaciones mínimas (common_journal.
+    diferencias) junto con el ETag anterior y el nuevo: un cliente cuyo
+    ETag no coincide con el anterior vuelve a pedir la bodega completa.
+    """
+
+    def __init__(self, intervalo=1.0):
+        self.intervalo = intervalo
+        self.suscriptores = {}  # {archivo: {cola: loop}}
+        self.estado = {}        # {archivo: (firma, estantes, etag)}
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._hilo = None
+        self._observador = None
+
+    def _iniciar(self):
+        if self._hilo is not None:
+            return
+        if Observer is not None and os.path.isdir(DOCS_PATH):
+            try:
+                self._observador = Observer()
+                self._observador.schedule(_AvisoCambios(self._despertar), DOCS_PATH, recursive=True)
+                self._observador.daemon = True
+                self._observador.start()
+                self.intervalo = max(self.intervalo, 5.0)  # solo como respaldo
+            except Exception as e:
+                print(f"[Vivo] watchdog no disponible, se revisa por intervalo: {e}")
+                self._observador = None
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+        self._hilo.start()
+
+    def _leer(self, archivo):
+        firma = firma_puntos(archivo)
+        estantes = diario.reproducir(archivo, backend.cargar_estantes(archivo))
+        etag = guardar_en_cache(f"puntos:{archivo}", firma, estantes)["etag"]
+        return firma, estantes, etag
+
+    def suscribir(self, archivo, cola, loop):
+        """Registra un cliente; devuelve el ETag actual de la bodega (bloqueante)."""
+        with self._lock:
+            self.suscriptores.setdefault(archivo, {})[cola] = loop
+            actual = self.estado.get(archivo)
+        if actual is None:
+            actual = self._leer(archivo)
+            with self._lock:
+                actual = self.estado.setdefault(archivo, actual)
+        self._iniciar()
+        return actual[2]
+
+    def desuscribir(self, archivo, cola):
+        with self._lock:
+            clientes = self.suscriptores.get(archivo, {})
+            clientes.pop(cola, None)
+            if not clientes:
+                self.suscriptores.pop(archivo, None)
+                self.estado.pop(archivo, None)
+
+    def clientes(self):
+        with self._lock:
+            return sum(len(c) for c in self.suscriptores.values())
+
+    def _bucle(self):
+        while True:
+            if self._despertar.wait(self.intervalo):
+                self._despertar.clear()
+                time.sleep(0.2)  # agrupar las escrituras de un mismo guardado
+            with self._lock:
+                archivos = list(self.suscriptores)
+            for archivo in archivos:
+                try:
+                    self._revisar(archivo)
+                except Exception as e:
+                    print(f"[Vivo] Error al revisar {archivo}: {e}")
+
+    def _revisar(self, archivo):
+        with self._lock:
+            previo = self.estado.get(archivo)
+        if previo is None or firma_puntos(archivo) == previo[0]:
+            return
+        firma, estantes, etag = self._leer(archivo)
+        if etag == previo[2]:
+            with self._lock:
+                self.estado[archivo] = (firma, estantes, etag)
+            return
+        mensaje = {"tipo": "cambios", "base": previo[2], "etag": etag,
+                   "ops": diferencias(previo[1], estantes)}
+        with self._lock:
+            self.estado[archivo] = (firma, estantes, etag)
+            clientes = list(self.suscriptores.get(archivo, {}).items())
+        for cola, loop in clientes:
+            loop.call_soon_threadsafe(self._entregar, cola, mensaje)
+
+    @staticmethod
+    def _entregar(cola, mensaje):
+        """Encola para un cliente; si está muy atrasado, se le pide resincronizar."""
+        try:
+            cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            while not cola.empty():
+                cola.get_nowait()
+            cola.put_nowait({"tipo": "inicio", "etag": mensaje["etag"]})
+
+vigilante = VigilanteBodegas()
+
+def evento_sse(datos):
+    return f"data: {json.dumps(datos, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+@app.get("/api/eventos/{nombre_bodega}")
+async def eventos_bodega(nombre_bodega: str, request: Request):
+    """Flujo SSE de cambios de una bodega: 'inicio' con el ETag actual y luego 'cambios'."""
+    archivo_json = archivo_bodega(nombre_bodega)
+    cola = asyncio.Queue(maxsize=50)
+    etag = await run_in_threadpool(vigilante.suscribir, archivo_json, cola, asyncio.get_running_loop())
+
+    async def flujo():
+        try:
+            yield "retry: 3000\n" + evento_sse({"tipo": "inicio", "etag": etag})
+            while not await request.is_disconnected():
+                try:
+                    mensaje = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": latido\n\n"  # mantiene viva la conexión en el Wi-Fi de bodega
+                    continue
+                yield evento_sse(mensaje)
+        finally:
+            vigilante.desuscribir(archivo_json, cola)
+
+    return StreamingResponse(flujo(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def ruta_imagen_bodega(nombre_bodega):
     posibles = [f"{nombre_bodega}.png", f"{nombre_bodega.lower().replace(' ', '_')}.png"]
     for n in posibles:
         ruta = os.path.join(GRAPHICS_PATH, n)
-        if os.path.exists(ruta): return FileResponse(ruta, media_type="image/png")
+        if os.path.exists(ruta): return ruta
+    return None
+
+@app.get("/api/imagen/{nombre_bodega}")
+def obtener_imagen_bodega(nombre_bodega: str):
+    ruta = ruta_imagen_bodega(nombre_bodega)
+    if ruta: return FileResponse(ruta, media_type="image/png")
     raise HTTPException(status_code=404)
 
+# --- PLANO EN TESELAS (pirámide multirresolución, common_tiles) ---
+CACHE_INMUTABLE = {"Cache-Control": "public, max-age=31536000, immutable"}
+PATRON_TESELA = re.compile(r"^\d+_\d+\.(webp|png)$")
+
+@app.get("/api/teselas/{nombre_bodega}/info")
+def info_teselas(nombre_bodega: str, request: Request):
+    """Tamaño, niveles y versión de la pirámide; se genera la primera vez que se pide."""
+    ruta = ruta_imagen_bodega(nombre_bodega)
+    if not ruta:
+        raise HTTPException(status_code=404)
+    try:
+        info = asegurar_piramide(GRAPHICS_PATH, ruta)
+    except Exception as e:
+        # Sin Pillow (o imagen ilegible): el cliente usa /api/imagen completa
+        print(f"[Teselas] No se pudo generar la pirámide de {ruta}: {e}")
+        info = None
+    if not info:
+        raise HTTPException(status_code=404)
+    return respuesta_json(request, f"teselas:{ruta}", info["version"], lambda: info)
+
+def archivo_piramide(nombre_bodega, version, *partes):
+    ruta = ruta_imagen_bodega(nombre_bodega)
+    if not ruta or not re.fullmatch(r"[0-9a-f]{12}", version):
+        raise HTTPException(status_code=404)
+    archivo = os.path.join(carpeta_piramide(GRAPHICS_PATH, ruta), version, *partes)
+    if not os.path.exists(archivo):
+        raise HTTPException(status_code=404)
+    return archivo
+
+@app.get("/api/teselas/{nombre_bodega}/{version}/{nivel}/{archivo}")
+def obtener_tesela(nombre_bodega: str, version: str, nivel: int, archivo: str):
+    """Tesela de un nivel; la URL lleva la versión, así que se cachea para siempre."""
+    if not PATRON_TESELA.match(archivo):
+        raise HTTPException(status_code=404)
+    ruta = archivo_piramide(nombre_bodega, version, str(nivel), archivo)
+    return FileResponse(ruta, media_type=f"image/{archivo.rsplit('.', 1)[1]}", headers=CACHE_INMUTABLE)
+
+@app.get("/api/teselas/{nombre_bodega}/{version}/{archivo}")
+def obtener_base_teselas(nombre_bodega: str, version: str, archivo: str):
+    """Imagen de base (baja resolución) que va debajo de las teselas."""
+    if archivo not in ("base.webp", "base.png"):
+        raise HTTPException(status_code=404)
+    ruta = archivo_piramide(nombre_bodega, version, archivo)
+    return FileResponse(ruta, media_type=f"image/{archivo.rsplit('.', 1)[1]}", headers=CACHE_INMUTABLE)
+
 class ControlPanel(ctk.CTk):
     def __init__(self):
         super().__init__()
         self.title("Agustina Falcon - Web Server Control Panel")
-        self.geometry("360x540")
+        self.geometry("420x690")
         self.resizable(False, False)
         self.configure(fg_color="#0b0c0d")
         self.protocol("WM_DELETE_WINDOW", self.withdraw)
@@ -158,9 +704,24 @@ class ControlPanel(ctk.CTk):
         self.sw = ctk.CTkSwitch(self, text="Activar Host Local", command=self.toggle, 
                     variable=self.sw_var, onvalue="on", offvalue="off",
                     progress_color="#3b3b3b", button_color="#fff")
-        self.sw.pack(pady=30)
+        self.sw.pack(pady=(30, 10))
         self.uvicorn_process = None
 
+        # Procesos del servidor: se aplica al (re)iniciar el host
+        fila_workers = ctk.CTkFrame(self, fg_color="transparent")
+        fila_workers.pack(pady=(0, 10))
+        ctk.CTkLabel(fila_workers, text="Workers", font=("Helvetica", 12), text_color="#aaa").pack(side="left", padx=(0, 10))
+        opciones = [str(n) for n in (1, 2, 4, 8) if n <= max(2, os.cpu_count() or 1)]
+        self.workers_var = ctk.StringVar(value=str(WORKERS) if str(WORKERS) in opciones else "1")
+        ctk.CTkOptionMenu(fila_workers, values=opciones, variable=self.workers_var, width=70,
+                          fg_color="#3b3b3b", button_color="#2f2f2f", command=self.cambiar_workers).pack(side="left")
+        ctk.CTkLabel(self, text="Cada worker carga su propio índice de búsqueda:\nmás workers = más memoria y arranque más lento",
+                     font=("Helvetica", 10), text_color="#666").pack(pady=(0, 6))
+
+        self.carga_lbl = ctk.CTkLabel(self, text="", font=("Consolas", 11), text_color="#888", justify="left")
+        self.carga_lbl.pack(pady=(0, 10))
+        self.after(2000, self.actualizar_carga)
+
         self.btn_web = ctk.CTkButton(self, text="ABRIR MAPA INTERACTIVO", font=("Helvetica", 12, "bold"),
                        fg_color="#3b3b3b", text_color="#ffffff", hover_color="#2f2038",
                        height=45, corner_radius=10, command=lambda: webbrowser.open(f"http://{direccion_ip_local}:{PUERTO}"))
@@ -184,15 +745,45 @@ class ControlPanel(ctk.CTk):
             if self.uvicorn_process is None or self.uvicorn_process.poll() is not None:
                 env = os.environ.copy()
                 env["RUN_UVICORN"] = "1"
+                env["AGUSTINA_WORKERS"] = self.workers_var.get()
                 self.uvicorn_process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
             threading.Thread(target=self.health_loop, daemon=True).start()
         else:
             # Solo apaga el host, no la app
             self.led.configure(text_color="#ff3b3b")
             self.status_lbl.configure(text="SISTEMA OFFLINE")
-            if self.uvicorn_process and self.uvicorn_process.poll() is None:
-                self.uvicorn_process.terminate()
-                self.uvicorn_process = None
+            self.detener_servidor()
+
+    def detener_servidor(self):
+        import subprocess
+        proceso, self.uvicorn_process = self.uvicorn_process, None
+        if proceso is None or proceso.poll() is not None:
+            return
+        if os.name == 'nt':
+            # terminate() en Windows no alcanza a los workers hijos de uvicorn (seguirían con el puerto)
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proceso.pid)], capture_output=True,
+                           creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        else:
+            proceso.terminate()  # uvicorn cierra sus workers al recibir SIGTERM
+        try:
+            proceso.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+    def cambiar_workers(self, _valor):
+        # Con el host encendido se reinicia con la nueva cantidad de procesos
+        if self.sw_var.get() == "on":
+            self.detener_servidor()
+            self.toggle()
+
+    def actualizar_carga(self):
+        lineas = []
+        if self.uvicorn_process is not None and self.uvicorn_process.poll() is None:
+            for e in leer_carga_workers():
+                lineas.append(f"PID {e['pid']}: {e['activas']} act · {e['rps']:.1f} req/s · {e['ms']:.0f} ms · "
+                              f"{e['sse']} SSE · {e['hilos']}/{e['hilos_max']} hilos")
+        self.carga_lbl.configure(text="\n".join(lineas))
+        self.after(2000, self.actualizar_carga)
     def confirmar_cierre(self):
         import tkinter.messagebox as mb
         respuesta = mb.askquestion(
@@ -220,7 +811,14 @@ class ControlPanel(ctk.CTk):
             time.sleep(1)
 
 if __name__ == "__main__":
-    # Si se ejecuta con RUN_UVICORN=1, solo lanza el servidor y no la GUI
+    # Uso: app.py [--workers N]; con RUN_UVICORN=1 solo lanza el servidor y no la GUI
+    import argparse
+    parser = argparse.ArgumentParser(description="Agustina Falcon - servidor web del mapa de bodegas")
+    parser.add_argument("--workers", type=int, default=WORKERS, help=AYUDA_WORKERS)
+    args, _ = parser.parse_known_args()
+    WORKERS = max(1, args.workers)
+    # Los procesos de uvicorn (y el que lanza el panel) leen la cantidad al importar
+    os.environ["AGUSTINA_WORKERS"] = str(WORKERS)
     if os.environ.get("RUN_UVICORN") == "1":
         # Redirigir stdout/stderr a un objeto válido si están en None
         import sys
@@ -230,7 +828,14 @@ if __name__ == "__main__":
         if sys.stderr is None:
             sys.stderr = io.StringIO()
         import uvicorn
-        uvicorn.run(app, host=direccion_ip_local, port=PUERTO, log_level="critical", access_log=False)
+        if WORKERS > 1:
+            # Con varios procesos uvicorn necesita la ruta de importación de la app
+            import multiprocessing
+            multiprocessing.freeze_support()
+            uvicorn.run("app:app", host=direccion_ip_local, port=PUERTO, workers=WORKERS,
+                        app_dir=os.path.dirname(os.path.abspath(__file__)), log_level="critical", access_log=False)
+        else:
+            uvicorn.run(app, host=direccion_ip_local, port=PUERTO, log_level="critical", access_log=False)
     else:
         # Evitar que los prints crasheen la app sin consola
         if sys.executable.endswith("pythonw.exe"):
@@ -1,6 +1,23 @@
 let stage, layer, puntosData = [], currentImg, scale = 1;
 const API_BASE = window.location.origin;
 
+// Cambios en vivo (SSE): ETag de los puntos mostrados y bodega actual
+let etagPuntos = null, fuenteEventos = null, bodegaActual = null, estanteMostrado = null;
+
+// Plano en teselas: info de la pirámide (null = imagen completa) y teselas en pantalla
+let planoInfo = null, grupoTeselas = null, teselasCargadas = new Map(), teselasPendientes = false;
+
+// Marcadores dibujados en una capa Konva: {data, visible} por estante (mismo orden que puntosData),
+// árbol de cuadrantes para recortar a la pantalla y para el toque, y estante resaltado
+let capaMarcadores = null, marcadores = [], arbolMarcadores = null, estanteActivo = null;
+const RADIO_MARCADOR = 9;     // px de pantalla (18px de diámetro, como los antiguos div)
+const RADIO_TOQUE = 16;       // px de pantalla alrededor del marcador que cuentan como toque
+
+// Búsqueda en el servidor (/api/buscar): estantes de la bodega actual que coinciden
+// (null = sin filtro), bodega a la que corresponden y estante a mostrar al cambiar de bodega
+let busquedaPendiente = null, busquedaEnCurso = null;
+let estantesFiltro = null, bodegaFiltro = null, estantePendiente = null;
+
 // Variables para gestos móviles
 let lastTouchDistance = 0;
 let lastTapTime = 0;
@@ -16,20 +33,28 @@ async function init() {
     selector.innerHTML = bodegas.map(b => `<option value="${b}">${b}</option>`).join('');
     selector.onchange = (e) => cargarBodega(e.target.value);
     
-    document.getElementById('input-busqueda').oninput = (e) => {
-        filtrarPorItem(e.target.value);
-        verificarSeleccionSugerencia(e.target.value);
+    const input = document.getElementById('input-busqueda');
+    input.oninput = (e) => programarBusqueda(e.target.value);
+    input.onkeydown = (e) => {
+        // Enter: ir a la primera ubicación del primer resultado
+        const primera = document.querySelector('#resultados-busqueda .result-location');
+        if (e.key === 'Enter' && primera) primera.click();
     };
     if(bodegas.length > 0) cargarBodega(bodegas[0]);
 }
 
 async function cargarBodega(nombre) {
     if(stage) stage.destroy();
+    bodegaActual = nombre;
+    etagPuntos = null;
+    if(fuenteEventos) { fuenteEventos.close(); fuenteEventos = null; }
     // Reset globals para forzar recreación de la imagen y limpiar marcadores
     currentImg = null;
     puntosData = [];
+    marcadores = [];
+    arbolMarcadores = null;
+    estanteActivo = null;
     scale = 1;
-    document.getElementById('marker-layer').innerHTML = '';
     const container = document.getElementById('canvas-container');
     
     stage = new Konva.Stage({
@@ -41,10 +66,34 @@ async function cargarBodega(nombre) {
     
     layer = new Konva.Layer();
     stage.add(layer);
+    // Todos los marcadores son una sola figura: un trazo por cuadro, solo los visibles
+    capaMarcadores = new Konva.Layer({ listening: false });
+    capaMarcadores.add(new Konva.Shape({ sceneFunc: dibujarMarcadores, listening: false }));
+    stage.add(capaMarcadores);
+    stage.on('click tap', tocarMapa);
+    if (!isMobile) stage.on('mousemove', (e) => {
+        stage.container().style.cursor = marcadorEn(stage.getPointerPosition()) ? 'pointer' : '';
+    });
 
+    // Primero la imagen de base (liviana) de la pirámide; si no hay, el plano completo
+    planoInfo = null;
+    teselasCargadas = new Map();
+    let src = `${API_BASE}/api/imagen/${nombre}?t=${Date.now()}`;
+    try {
+        const res = await fetch(`${API_BASE}/api/teselas/${nombre}/info`);
+        if (res.ok) {
+            const info = await res.json();
+            if (nombre !== bodegaActual) return;
+            planoInfo = info;
+            src = `${API_BASE}/api/teselas/${nombre}/${info.version}/base.${info.formato}`;
+        }
+    } catch (e) {
+        console.warn('Sin teselas, se usa el plano completo', e);
+    }
     const img = new Image();
-    img.src = `${API_BASE}/api/imagen/${nombre}?t=${Date.now()}`;
+    img.src = src;
     img.onload = () => {
+        if (nombre !== bodegaActual) return;
         ajustarMapaAResize(img);
         obtenerPuntos(nombre);
     };
@@ -65,17 +114,29 @@ function ajustarMapaAResize(nuevaImg) {
     stage.width(container.offsetWidth);
     stage.height(container.offsetHeight);
 
-    const scX = stage.width() / imgObj.width;
-    const scY = stage.height() / imgObj.height;
+    // Los puntos están en píxeles del plano original, no de la imagen de base
+    const ancho = planoInfo ? planoInfo.ancho : imgObj.width;
+    const alto = planoInfo ? planoInfo.alto : imgObj.height;
+    const scX = stage.width() / ancho;
+    const scY = stage.height() / alto;
     scale = Math.min(scX, scY) * 0.9;
 
     if(!currentImg) {
         currentImg = new Konva.Image({ image: imgObj });
         layer.add(currentImg);
+        if (planoInfo) {
+            grupoTeselas = new Konva.Group({ listening: false });
+            layer.add(grupoTeselas);
+        }
     }
     
-    currentImg.width(imgObj.width * scale);
-    currentImg.height(imgObj.height * scale);
+    currentImg.width(ancho * scale);
+    currentImg.height(alto * scale);
+    if (grupoTeselas) {
+        // La escala cambió: las teselas se vuelven a ubicar desde cero
+        grupoTeselas.destroyChildren();
+        teselasCargadas.clear();
+    }
 
     // Asegurar que el stage está en escala inicial 1:1
     stage.scale({ x: 1, y: 1 });
@@ -85,44 +146,395 @@ function ajustarMapaAResize(nuevaImg) {
         x: (stage.width() - currentImg.width()) / 2,
         y: (stage.height() - currentImg.height()) / 2
     });
-    
-    if(puntosData.length > 0) {
-        document.querySelectorAll('.dot-marker').forEach((div, i) => {
-            div._x = puntosData[i].x * scale;
-            div._y = puntosData[i].y * scale;
+    updateMarkers();
+}
+
+async function obtenerPuntos(nombre, suscribir = true) {
+    const res = await fetch(`${API_BASE}/api/puntos/${nombre}`);
+    const datos = await res.json();
+    if (nombre !== bodegaActual) return; // se cambió de bodega mientras llegaba
+    puntosData = datos;
+    etagPuntos = res.headers.get('ETag');
+    marcadores = puntosData.map(crearMarcador);
+    arbolMarcadores = null;
+
+    const busqueda = document.getElementById('input-busqueda').value;
+    if (busqueda.trim() && bodegaFiltro !== nombre) buscarItems(busqueda); // el filtro era de otra bodega
+    else filtrarPorItem();
+    if (estantePendiente) {
+        const estante = estantePendiente;
+        estantePendiente = null;
+        mostrarEstante(estante);
+    }
+    updateMarkers();
+    if (suscribir) suscribirCambios(nombre);
+}
+
+function crearMarcador(p) {
+    return { data: p, visible: true };
+}
+
+// ========== MARCADORES (capa Konva + árbol de cuadrantes) ==========
+
+// Árbol de cuadrantes sobre las coordenadas del plano (píxeles de la imagen original)
+class ArbolCuadrantes {
+    constructor(x, y, ancho, alto, nivel = 0) {
+        this.x = x; this.y = y; this.ancho = ancho; this.alto = alto;
+        this.nivel = nivel;
+        this.items = [];
+        this.hijos = null;
+    }
+
+    insertar(m) {
+        if (this.hijos) return this.hijoPara(m).insertar(m);
+        this.items.push(m);
+        if (this.items.length > 16 && this.nivel < 12) {
+            const w = this.ancho / 2, h = this.alto / 2, n = this.nivel + 1;
+            this.hijos = [
+                new ArbolCuadrantes(this.x, this.y, w, h, n), new ArbolCuadrantes(this.x + w, this.y, w, h, n),
+                new ArbolCuadrantes(this.x, this.y + h, w, h, n), new ArbolCuadrantes(this.x + w, this.y + h, w, h, n)
+            ];
+            const items = this.items;
+            this.items = [];
+            items.forEach(i => this.hijoPara(i).insertar(i));
+        }
+    }
+
+    hijoPara(m) {
+        const derecha = m.data.x >= this.x + this.ancho / 2 ? 1 : 0;
+        const abajo = m.data.y >= this.y + this.alto / 2 ? 2 : 0;
+        return this.hijos[derecha + abajo];
+    }
+
+    // Marcadores dentro del rectángulo [x0, x1] x [y0, y1]
+    consultar(x0, y0, x1, y1, salida = []) {
+        if (x1 < this.x || y1 < this.y || x0 > this.x + this.ancho || y0 > this.y + this.alto) return salida;
+        if (this.hijos) {
+            this.hijos.forEach(h => h.consultar(x0, y0, x1, y1, salida));
+        } else {
+            this.items.forEach(m => {
+                if (m.data.x >= x0 && m.data.x <= x1 && m.data.y >= y0 && m.data.y <= y1) salida.push(m);
+            });
+        }
+        return salida;
+    }
+}
+
+function arbolActual() {
+    // Se reconstruye (n log n) solo cuando cambiaron los estantes
+    if (!arbolMarcadores) {
+        let x0 = 0, y0 = 0, x1 = 1, y1 = 1;
+        marcadores.forEach(m => {
+            x0 = Math.min(x0, m.data.x); y0 = Math.min(y0, m.data.y);
+            x1 = Math.max(x1, m.data.x); y1 = Math.max(y1, m.data.y);
+        });
+        arbolMarcadores = new ArbolCuadrantes(x0, y0, x1 - x0 + 1, y1 - y0 + 1);
+        marcadores.forEach(m => arbolMarcadores.insertar(m));
+    }
+    return arbolMarcadores;
+}
+
+// Marcadores visibles dentro de un rectángulo de pantalla (px del contenedor)
+function marcadoresEnPantalla(x0, y0, x1, y1) {
+    const t = stage.getAbsoluteTransform().getMatrix();
+    const k = t[0] * scale;
+    return arbolActual()
+        .consultar((x0 - t[4]) / k, (y0 - t[5]) / k, (x1 - t[4]) / k, (y1 - t[5]) / k)
+        .filter(m => m.visible);
+}
+
+function dibujarMarcadores(ctx) {
+    if (!stage || !marcadores.length) return;
+    const t = stage.getAbsoluteTransform().getMatrix();
+    const k = t[0] * scale;
+    const r = RADIO_MARCADOR * 1.3;
+    const visibles = marcadoresEnPantalla(-r, -r, stage.width() + r, stage.height() + r);
+    // Se dibuja en píxeles de pantalla: tamaño fijo sin importar el zoom
+    const pr = capaMarcadores.getCanvas().getPixelRatio();
+    ctx.setTransform(pr, 0, 0, pr, 0, 0);
+
+    let activo = null;
+    const circulos = (radio) => {
+        ctx.beginPath();
+        visibles.forEach(m => {
+            if (m.data.nombre === estanteActivo) { activo = m; return; }
+            const x = m.data.x * k + t[4], y = m.data.y * k + t[5];
+            ctx.moveTo(x + radio, y);
+            ctx.arc(x, y, radio, 0, Math.PI * 2);
+        });
+    };
+    // Halo, relleno y borde en tres trazos para todos (sin sombras por marcador)
+    circulos(RADIO_MARCADOR + 4);
+    ctx.setAttr('fillStyle', 'rgba(255, 59, 59, 0.25)');
+    ctx.fill();
+    circulos(RADIO_MARCADOR - 1.25);
+    ctx.setAttr('fillStyle', '#ff3b3b');
+    ctx.fill();
+    ctx.setAttr('strokeStyle', '#fff');
+    ctx.setAttr('lineWidth', 2.5);
+    ctx.stroke();
+
+    if (activo) {
+        const acento = getComputedStyle(document.documentElement).getPropertyValue('--accent').trim() || '#00d4ff';
+        const x = activo.data.x * k + t[4], y = activo.data.y * k + t[5];
+        ctx.beginPath();
+        ctx.arc(x, y, RADIO_MARCADOR * 1.3 - 1.25, 0, Math.PI * 2);
+        ctx.setAttr('shadowColor', acento);
+        ctx.setAttr('shadowBlur', 20);
+        ctx.setAttr('fillStyle', '#fff');
+        ctx.fill();
+        ctx.setAttr('shadowBlur', 0);
+        ctx.setAttr('strokeStyle', acento);
+        ctx.stroke();
+    }
+}
+
+// Marcador visible más cercano a un punto de pantalla, o null
+function marcadorEn(pos) {
+    if (!pos || !marcadores.length) return null;
+    const t = stage.getAbsoluteTransform().getMatrix();
+    const k = t[0] * scale;
+    let mejor = null, mejorDist = RADIO_TOQUE * RADIO_TOQUE;
+    marcadoresEnPantalla(pos.x - RADIO_TOQUE, pos.y - RADIO_TOQUE, pos.x + RADIO_TOQUE, pos.y + RADIO_TOQUE)
+        .forEach(m => {
+            const dx = m.data.x * k + t[4] - pos.x, dy = m.data.y * k + t[5] - pos.y;
+            if (dx * dx + dy * dy <= mejorDist) { mejor = m; mejorDist = dx * dx + dy * dy; }
         });
+    return mejor;
+}
+
+function tocarMapa() {
+    const m = marcadorEn(stage.getPointerPosition());
+    if (m) { mostrarDetalles(m.data); resaltarEstante(m.data.nombre); }
+}
+
+// ========== BÚSQUEDA (servidor) ==========
+
+function programarBusqueda(val) {
+    // Una consulta por pausa al escribir; la anterior en vuelo se cancela
+    clearTimeout(busquedaPendiente);
+    busquedaPendiente = setTimeout(() => buscarItems(val), 120);
+}
+
+async function buscarItems(val) {
+    if (busquedaEnCurso) busquedaEnCurso.abort();
+    busquedaEnCurso = null;
+    const q = val.trim();
+    if (!q) {
+        estantesFiltro = null;
+        bodegaFiltro = null;
+        filtrarPorItem();
+        mostrarResultados([]);
+        return;
+    }
+    const control = busquedaEnCurso = new AbortController();
+    const bodega = bodegaActual;
+    try {
+        const params = new URLSearchParams({ q, limite: 20, bodega: bodega || '' });
+        const res = await fetch(`${API_BASE}/api/buscar?${params}`, { signal: control.signal });
+        const datos = await res.json();
+        if (control !== busquedaEnCurso) return;
+        busquedaEnCurso = null;
+        if (bodega === bodegaActual) {
+            estantesFiltro = datos.estantes ? new Set(datos.estantes) : null;
+            bodegaFiltro = bodega;
+            filtrarPorItem();
+        }
+        mostrarResultados(datos.resultados);
+    } catch (e) {
+        if (e.name !== 'AbortError') console.warn('Error en la búsqueda', e);
     }
+}
+
+function mostrarResultados(resultados) {
+    const lista = document.getElementById('resultados-busqueda');
+    lista.replaceChildren(...resultados.map(r => {
+        const card = document.createElement('div');
+        card.className = 'item-card result-card';
+        const nombre = document.createElement('span');
+        nombre.className = 'item-name';
+        nombre.textContent = r.nombre || r.codigo;
+        const codigo = document.createElement('span');
+        codigo.className = 'item-code';
+        codigo.textContent = `ID: ${r.codigo || 'S/C'}` + (r.stock !== null ? ` · Stock: ${r.stock}` : '');
+        card.append(nombre, codigo);
+        r.ubicaciones.forEach(u => {
+            const lugar = document.createElement('button');
+            lugar.className = 'result-location';
+            lugar.textContent = `${u.bodega} › ${u.estante}` + (u.gaveta ? ` · Gaveta ${u.gaveta}` : '');
+            lugar.onclick = () => irAUbicacion(u);
+            card.appendChild(lugar);
+        });
+        if (r.total_ubicaciones > r.ubicaciones.length) {
+            const mas = document.createElement('span');
+            mas.className = 'item-code';
+            mas.textContent = `+${r.total_ubicaciones - r.ubicaciones.length} ubicaciones más`;
+            card.appendChild(mas);
+        } else if (!r.total_ubicaciones) {
+            const sin = document.createElement('span');
+            sin.className = 'item-code';
+            sin.textContent = 'Sin ubicar en ninguna bodega';
+            card.appendChild(sin);
+        }
+        return card;
+    }));
+}
+
+function irAUbicacion(u) {
+    if (u.bodega !== bodegaActual) {
+        estantePendiente = u.estante;
+        document.getElementById('selector-bodega').value = u.bodega;
+        cargarBodega(u.bodega);
+        return;
+    }
+    mostrarEstante(u.estante);
+}
+
+function mostrarEstante(nombre) {
+    const p = puntosData.find(p => p.nombre === nombre);
+    if (!p || !stage) return;
+    mostrarDetalles(p);
+    resaltarEstante(nombre);
+    // Centrar el estante sin cambiar el zoom
+    const k = stage.scaleX() * scale;
+    stage.position({ x: stage.width() / 2 - p.x * k, y: stage.height() / 2 - p.y * k });
     updateMarkers();
 }
 
-async function obtenerPuntos(nombre) {
-    const res = await fetch(`${API_BASE}/api/puntos/${nombre}`);
-    puntosData = await res.json();
-    const layerHTML = document.getElementById('marker-layer');
-    const datalist = document.getElementById('lista-items');
-    layerHTML.innerHTML = '';
-    let itemsUnificados = new Set();
-
-    puntosData.forEach(p => {
-        p.suplementos.forEach(s => itemsUnificados.add(`${(s.nombre || s).toUpperCase()} | #${s.codigo || "S/C"}`));
-        const div = document.createElement('div');
-        div.className = 'dot-marker';
-        div._x = p.x * scale; div._y = p.y * scale;
-        div._data = p;
-        div.onclick = () => { mostrarDetalles(p); resaltarDot(div); };
-        layerHTML.appendChild(div);
+// ========== CAMBIOS EN VIVO ==========
+
+function suscribirCambios(nombre) {
+    if (fuenteEventos) fuenteEventos.close();
+    if (!window.EventSource) return;
+    fuenteEventos = new EventSource(`${API_BASE}/api/eventos/${nombre}`);
+    fuenteEventos.onmessage = (e) => {
+        if (nombre !== bodegaActual) return;
+        const msg = JSON.parse(e.data);
+        if (msg.tipo === 'inicio') {
+            // Al conectar (o reconectar) se comprueba que lo mostrado siga al día
+            if (msg.etag !== etagPuntos) obtenerPuntos(nombre, false);
+        } else if (msg.tipo === 'cambios') {
+            if (msg.base !== etagPuntos) {
+                obtenerPuntos(nombre, false); // se perdió un cambio: se pide todo de nuevo
+            } else {
+                aplicarCambios(msg.ops);
+                etagPuntos = msg.etag;
+            }
+        }
+    };
+}
+
+// Aplica las operaciones ('add', 'set', 'del', 'todo') tocando solo esos marcadores
+function aplicarCambios(ops) {
+    const q = document.getElementById('input-busqueda').value.trim().toLowerCase();
+    const tocados = new Set();
+
+    ops.forEach(op => {
+        if (op.op === 'todo') {
+            puntosData = op.estantes;
+            marcadores = puntosData.map(crearMarcador);
+            marcadores.forEach(m => tocados.add(m));
+        } else if (op.op === 'add') {
+            puntosData.push(op.estante);
+            const m = crearMarcador(op.estante);
+            marcadores.push(m);
+            tocados.add(m);
+        } else if (op.op === 'set' && marcadores[op.pos]) {
+            puntosData[op.pos] = op.estante;
+            tocados.delete(marcadores[op.pos]);
+            marcadores[op.pos] = crearMarcador(op.estante);
+            tocados.add(marcadores[op.pos]);
+        } else if (op.op === 'del' && marcadores[op.pos]) {
+            puntosData.splice(op.pos, 1);
+            tocados.delete(marcadores[op.pos]);
+            marcadores.splice(op.pos, 1);
+        }
     });
+    arbolMarcadores = null;
 
-    datalist.innerHTML = Array.from(itemsUnificados).sort().map(i => `<option value="${i}">`).join('');
-    updateMarkers();
+    tocados.forEach(m => {
+        // El servidor aún no indexó el cambio: el filtro de estos estantes se decide aquí
+        if (estantesFiltro && q) {
+            if (coincideEstante(m.data, q)) estantesFiltro.add(m.data.nombre);
+            else estantesFiltro.delete(m.data.nombre);
+        }
+        aplicarFiltroMarcador(m);
+        // Panel abierto sobre un estante que cambió: se refresca su contenido
+        if (m.data.nombre === estanteMostrado && document.getElementById('panel-inventario').classList.contains('active')) {
+            mostrarDetalles(m.data);
+        }
+    });
+    if (stage) updateMarkers();
 }
 
 function updateMarkers() {
-    const transform = stage.getAbsoluteTransform().getMatrix();
-    document.querySelectorAll('.dot-marker').forEach(div => {
-        div.style.left = (div._x * transform[0] + transform[4]) + 'px';
-        div.style.top = (div._y * transform[3] + transform[5]) + 'px';
+    // Konva agrupa los redibujados en un solo cuadro (requestAnimationFrame)
+    if (capaMarcadores) capaMarcadores.batchDraw();
+    programarTeselas();
+}
+
+function programarTeselas() {
+    // Como mucho una actualización de teselas por cuadro
+    if (planoInfo && !teselasPendientes) {
+        teselasPendientes = true;
+        requestAnimationFrame(() => { teselasPendientes = false; actualizarTeselas(); });
+    }
+}
+
+function actualizarTeselas() {
+    // Nivel con ~1 píxel de tesela por píxel de pantalla; solo las teselas visibles
+    if (!planoInfo || !grupoTeselas || !stage) return;
+    const info = planoInfo, max = info.niveles - 1;
+    const zoom = scale * stage.scaleX() * (window.devicePixelRatio || 1);
+    const z = Math.max(0, Math.min(max, max + Math.ceil(Math.log2(zoom))));
+    const lado = info.tam * Math.pow(2, max - z);  // píxeles del original que cubre una tesela
+    const ladoPantalla = lado * scale;
+    const columnas = Math.ceil(info.ancho / lado), filas = Math.ceil(info.alto / lado);
+
+    // Rectángulo visible en coordenadas del stage (sin zoom)
+    const s = stage.scaleX();
+    const x0 = -stage.x() / s, y0 = -stage.y() / s;
+    const x1 = x0 + stage.width() / s, y1 = y0 + stage.height() / s;
+    const tx0 = Math.max(0, Math.floor(x0 / ladoPantalla)), tx1 = Math.min(columnas - 1, Math.floor(x1 / ladoPantalla));
+    const ty0 = Math.max(0, Math.floor(y0 / ladoPantalla)), ty1 = Math.min(filas - 1, Math.floor(y1 / ladoPantalla));
+
+    const visibles = new Set();
+    for (let ty = ty0; ty <= ty1; ty++) {
+        for (let tx = tx0; tx <= tx1; tx++) {
+            const clave = `${z}/${tx}_${ty}`;
+            visibles.add(clave);
+            if (teselasCargadas.has(clave)) continue;
+            const nodo = new Konva.Image({
+                x: tx * ladoPantalla, y: ty * ladoPantalla,
+                width: Math.min(lado, info.ancho - tx * lado) * scale,
+                height: Math.min(lado, info.alto - ty * lado) * scale
+            });
+            teselasCargadas.set(clave, nodo);
+            const img = new Image();
+            img.onload = () => {
+                if (teselasCargadas.get(clave) !== nodo) return; // salió de pantalla mientras cargaba
+                nodo.image(img);
+                grupoTeselas.add(nodo);
+                // Las del nivel actual quedan encima de las de otros niveles que aún se ven
+                nodo.moveToTop();
+                nodo._nivel = z;
+                layer.batchDraw();
+                programarTeselas(); // para liberar las del nivel anterior cuando este se completa
+            };
+            img.src = `${API_BASE}/api/teselas/${bodegaActual}/${info.version}/${clave}.${info.formato}`;
+        }
+    }
+    // Las que no se ven se liberan; las de otro nivel siguen tapando huecos
+    // hasta que todas las visibles del nivel actual terminaron de cargar
+    const completo = [...visibles].every(c => teselasCargadas.get(c).image());
+    teselasCargadas.forEach((nodo, clave) => {
+        if (visibles.has(clave)) return;
+        if (completo || nodo._nivel === undefined || nodo._nivel === z) {
+            nodo.destroy();
+            teselasCargadas.delete(clave);
+        }
     });
+    layer.batchDraw();
 }
 
 function zoomMap(factor) {
@@ -165,32 +577,26 @@ function updateZoomDisplay() {
     }
 }
 
-function filtrarPorItem(val) {
-    const q = val.split(' | #')[0].toLowerCase();
-    document.querySelectorAll('.dot-marker').forEach(div => {
-        const match = div._data.suplementos.some(s => (s.nombre || s).toLowerCase().includes(q) || (s.codigo || "").toLowerCase().includes(q));
-        div.style.display = (match || !val) ? 'block' : 'none';
-        div.style.opacity = val && match ? "1" : (val ? "0.2" : "1");
-    });
+function filtrarPorItem() {
+    marcadores.forEach(aplicarFiltroMarcador);
+    if (stage) updateMarkers();
 }
 
-function verificarSeleccionSugerencia(val) {
-    if (!val.includes(' | #')) return;
-    const partes = val.split(' | #');
-    const nom = partes[0].toLowerCase();
-    const estante = puntosData.find(p => p.suplementos.some(s => (s.nombre || s).toLowerCase() === nom));
-    if(estante) {
-        mostrarDetalles(estante);
-        document.querySelectorAll('.dot-marker').forEach(m => { if(m._data.nombre === estante.nombre) resaltarDot(m); });
-    }
+function aplicarFiltroMarcador(m) {
+    m.visible = !estantesFiltro || estantesFiltro.has(m.data.nombre);
+}
+
+function coincideEstante(p, q) {
+    return p.suplementos.some(s => (s.nombre || s).toLowerCase().includes(q) || (s.codigo || "").toLowerCase().includes(q));
 }
 
-function resaltarDot(el) {
-    document.querySelectorAll('.dot-marker').forEach(d => d.classList.remove('active'));
-    el.classList.add('active');
+function resaltarEstante(nombre) {
+    estanteActivo = nombre;
+    if (stage) updateMarkers();
 }
 
 function mostrarDetalles(p) {
+    estanteMostrado = p.nombre;
     document.getElementById('inventory-title').textContent = p.nombre.toUpperCase();
     document.getElementById('panel-inventario').classList.add('active');
     document.getElementById('lista-suplementos').innerHTML = p.suplementos.map(s => `